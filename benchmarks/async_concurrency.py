@@ -0,0 +1,120 @@
+"""
+Compare AsyncTraits with the thread-pool approach (a pooled Traits called through
+run_in_executor, as an async gateway does today) under concurrent requests.
+
+Run against a scratch MariaDB initialized with the Traits schema and a scratch Neo4j
+(the same ones used by the tests):
+    python -m benchmarks.async_concurrency --requests 500 --concurrency 50
+Prints the throughput and latency percentiles of both variants as JSON.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from traits.interface import TraitsKey, TrainStatus
+from traits.implementation import Traits
+from traits.async_implementation import AsyncTraits
+from benchmarks.cypher_plan_cache import percentile
+
+PREFIX = "bench-"
+
+
+def create_network(traits: Traits, stations: int, days: int, users: int) -> None:
+    names = [TraitsKey(f"{PREFIX}{i}") for i in range(stations)]
+    for name in names:
+        traits.add_train_station(name, None)
+    for a, b in zip(names, names[1:]):
+        traits.connect_train_stations(a, b, 10)
+    for hour in (8, 12, 16):
+        train = TraitsKey(f"{PREFIX}t{hour}")
+        traits.add_train(train, train_capacity=100, train_status=TrainStatus.OPERATIONAL)
+        traits.add_schedule(train, hour, 0, [(name, 2) for name in names], 1, 1, 2030, days, 1, 2030)
+    for i in range(users):
+        traits.add_user(f"{PREFIX}{i}@example.com", None)
+
+
+def requests(count: int, stations: int, days: int, users: int):
+    random.seed(0)
+    for _ in range(count):
+        if random.random() < 0.8:
+            a, b = sorted(random.sample(range(stations), 2))
+            yield "search_connections", (TraitsKey(f"{PREFIX}{a}"), TraitsKey(f"{PREFIX}{b}"), random.randint(1, days), 1, 2030)
+        else:
+            yield "get_purchase_history", (f"{PREFIX}{random.randrange(users)}@example.com",)
+
+
+def summary(latencies, elapsed):
+    return {
+        "requests_per_second": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.5), 3),
+        "p95_ms": round(percentile(latencies, 0.95), 3),
+    }
+
+
+async def run_threads(traits: Traits, calls, concurrency: int):
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    latencies = []
+
+    async def call(name, args):
+        begin = time.perf_counter()
+        await loop.run_in_executor(executor, lambda: getattr(traits, name)(*args))
+        latencies.append((time.perf_counter() - begin) * 1000)
+
+    begin = time.perf_counter()
+    await asyncio.gather(*(call(name, args) for name, args in calls))
+    elapsed = time.perf_counter() - begin
+    executor.shutdown()
+    return summary(latencies, elapsed)
+
+
+async def run_async(traits: AsyncTraits, calls, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def call(name, args):
+        async with semaphore:
+            begin = time.perf_counter()
+            await getattr(traits, name)(*args)
+            latencies.append((time.perf_counter() - begin) * 1000)
+
+    begin = time.perf_counter()
+    await asyncio.gather(*(call(name, args) for name, args in calls))
+    return summary(latencies, time.perf_counter() - begin)
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=3306)
+    parser.add_argument("--database", default="test")
+    parser.add_argument("--uri", default="neo4j://localhost:7687")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--pool-size", type=int, default=10)
+    parser.add_argument("--stations", type=int, default=10)
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--users", type=int, default=20)
+    args = parser.parse_args()
+
+    settings = dict(host=args.host, port=args.port, database=args.database, neo4j_uri=args.uri, pool_size=args.pool_size)
+    async_traits = await AsyncTraits.from_settings(**settings)
+    traits = async_traits.traits
+    try:
+        await asyncio.to_thread(create_network, traits, args.stations, args.days, args.users)
+        calls = list(requests(args.requests, args.stations, args.days, args.users))
+        results = {
+            "thread_pool": await run_threads(traits, calls, args.concurrency),
+            "asyncio": await run_async(async_traits, calls, args.concurrency),
+        }
+        for hour in (8, 12, 16):
+            await async_traits.delete_train(TraitsKey(f"{PREFIX}t{hour}"))
+    finally:
+        await async_traits.close()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,92 @@
+"""
+Compare the connection search Cypher with inlined literals (a new query text, hence a new
+plan, for every search) against the fixed parameterized templates used by TraitsUtility.
+
+Run against a scratch Neo4j (the same one used by the tests):
+    python -m benchmarks.cypher_plan_cache --uri neo4j://localhost:7687 --calls 200
+Prints the latency percentiles of both variants as JSON.
+"""
+import argparse
+import json
+import random
+import time
+from datetime import datetime, timedelta
+from neo4j import GraphDatabase
+from traits.implementation import SEARCH_DAYS_QUERIES
+
+PREFIX = "bench-"
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def create_network(driver, stations: int, days: int) -> None:
+    names = [f"{PREFIX}{i}" for i in range(stations)]
+    driver.execute_query("UNWIND $names AS name CREATE (:Station {name: name})", names=names)
+    rows = []
+    trip_id = 0
+    for day in range(days):
+        for i in range(stations - 1):
+            trip_id += 1
+            departure = datetime(2030, 1, 1, 8) + timedelta(days=day, minutes=10 * i)
+            rows.append({"a": names[i], "b": names[i + 1], "trip_id": -trip_id, "departure_time": departure,
+                         "arrival_time": departure + timedelta(minutes=10), "travel_time": 10})
+    driver.execute_query("""
+        UNWIND $rows AS row
+        MATCH (a:Station {name: row.a}), (b:Station {name: row.b})
+        CREATE (a)-[:TRIP {trip_id: row.trip_id, departure_time: row.departure_time,
+                           arrival_time: row.arrival_time, travel_time: row.travel_time}]->(b)
+        """, rows=rows)
+
+
+def run(driver, calls: int, stations: int, parameterized: bool):
+    latencies, available_after = [], []
+    with driver.session() as session:
+        for call in range(calls):
+            start_station = f"{PREFIX}{random.randrange(stations - 1)}"
+            travel_time = datetime(2030, 1, 1) + timedelta(minutes=call)
+            begin = time.perf_counter()
+            if parameterized:
+                result = session.run(SEARCH_DAYS_QUERIES[True], start_station=start_station, end_station=None, travel_time=travel_time)
+            else:
+                # The former approach: literals inlined with an f-string
+                result = session.run(f"""
+                    MATCH (:Station {{name: '{start_station}'}})-[r:TRIP]->()
+                    WHERE r.departure_time >= localdatetime('{travel_time.isoformat()}')
+                    RETURN DISTINCT date(r.departure_time) AS day ORDER BY day ASC
+                    """)
+            list(result)
+            summary = result.consume()
+            latencies.append((time.perf_counter() - begin) * 1000)
+            available_after.append(summary.result_available_after)
+    return {
+        "p50_ms": round(percentile(latencies, 0.5), 3),
+        "p95_ms": round(percentile(latencies, 0.95), 3),
+        "p50_result_available_after_ms": percentile(available_after, 0.5),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--uri", default="neo4j://localhost:7687")
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--stations", type=int, default=50)
+    parser.add_argument("--days", type=int, default=30)
+    args = parser.parse_args()
+
+    with GraphDatabase.driver(args.uri) as driver:
+        create_network(driver, args.stations, args.days)
+        try:
+            results = {
+                "inlined": run(driver, args.calls, args.stations, parameterized=False),
+                "parameterized": run(driver, args.calls, args.stations, parameterized=True),
+            }
+        finally:
+            driver.execute_query("MATCH (s:Station) WHERE s.name STARTS WITH $prefix DETACH DELETE s", prefix=PREFIX)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Seeded generator of synthetic railway networks, loaded through the public Traits API.
+
+The same seed and parameters always give the same stations, connections, trains,
+schedules and users, so benchmark runs can be compared over time.
+"""
+import math
+import random
+from datetime import date, timedelta
+from typing import Dict, List, NamedTuple, Tuple
+from traits.interface import TraitsKey, TrainStatus
+
+TOPOLOGIES = ("grid", "hub")
+
+
+class TrainSpec(NamedTuple):
+    name: str
+    capacity: int
+    starting_hours_24_h: int
+    starting_minutes: int
+    stops: List[Tuple[str, int]]  # (station name, waiting time)
+
+
+class Network(NamedTuple):
+    stations: List[str]
+    connections: List[Tuple[str, str, int]]  # one entry per pair, connect_train_stations adds both directions
+    trains: List[TrainSpec]
+    users: List[str]
+    first_day: date
+    days: int
+
+    @property
+    def last_day(self) -> date:
+        return self.first_day + timedelta(days=self.days - 1)
+
+
+def _topology(stations: int, topology: str) -> List[Tuple[int, int]]:
+    if topology == "grid":
+        side = math.ceil(math.sqrt(stations))
+        pairs = []
+        for i in range(stations):
+            if (i + 1) % side != 0 and i + 1 < stations:
+                pairs.append((i, i + 1))
+            if i + side < stations:
+                pairs.append((i, i + side))
+        return pairs
+    if topology == "hub":
+        # One hub every 10 stations, hubs on a ring, every other station on one hub
+        hubs = max(1, stations // 10)
+        pairs = [(i, (i + 1) % hubs) for i in range(hubs)] if hubs > 2 else [(0, 1)] if hubs == 2 else []
+        pairs += [(i % hubs, i) for i in range(hubs, stations)]
+        return pairs
+    raise ValueError(f"Unknown topology {topology}, expected one of {TOPOLOGIES}")
+
+
+def generate_network(seed: int = 0, stations: int = 100, topology: str = "grid", trains: int = 20, days: int = 7,
+                     users: int = 50, min_stops: int = 3, max_stops: int = 8, first_day: date = date(2030, 1, 1)) -> Network:
+    """
+    Build a network of `stations` stations, `trains` trains each running one schedule every day
+    for `days` days along a random path of `min_stops` to `max_stops` stops, and `users` users
+    """
+    if stations < 2:
+        raise ValueError
+    rng = random.Random(seed)
+    names = [f"S{i}" for i in range(stations)]
+    pairs = _topology(stations, topology)
+    connections = [(names[a], names[b], rng.randint(5, 60)) for a, b in pairs]
+    neighbours: Dict[str, List[str]] = {}
+    for a, b, _ in connections:
+        neighbours.setdefault(a, []).append(b)
+        neighbours.setdefault(b, []).append(a)
+
+    train_specs = []
+    for i in range(trains):
+        # Random walk without revisits
+        path = [rng.choice(names)]
+        length = rng.randint(min_stops, max_stops)
+        while len(path) < length:
+            candidates = [n for n in neighbours.get(path[-1], []) if n not in path]
+            if not candidates:
+                break
+            path.append(rng.choice(candidates))
+        # The last stop needs at least 10 minutes of waiting time
+        stops = [(name, rng.randint(1, 10)) for name in path[:-1]] + [(path[-1], 10)]
+        train_specs.append(TrainSpec(f"T{i}", rng.randint(50, 500), rng.randint(5, 14), rng.choice((0, 15, 30, 45)), stops))
+
+    return Network(names, connections, train_specs, [f"user{i}@example.com" for i in range(users)], first_day, days)
+
+
+def load_stations(traits, network: Network) -> None:
+    for name in network.stations:
+        traits.add_train_station(TraitsKey(name), None)
+    for a, b, travel_time in network.connections:
+        traits.connect_train_stations(TraitsKey(a), TraitsKey(b), travel_time)
+
+
+def load_train(traits, network: Network, train: TrainSpec) -> None:
+    traits.add_train(TraitsKey(train.name), train_capacity=train.capacity, train_status=TrainStatus.OPERATIONAL)
+    first, last = network.first_day, network.last_day
+    traits.add_schedule(TraitsKey(train.name), train.starting_hours_24_h, train.starting_minutes,
+                        [(TraitsKey(name), waiting_time) for name, waiting_time in train.stops],
+                        first.day, first.month, first.year, last.day, last.month, last.year)
+
+
+def load_users(traits, network: Network) -> None:
+    for email in network.users:
+        traits.add_user(email, None)
+
+
+def random_trip_queries(network: Network, count: int, seed: int = 0) -> List[Tuple[str, str, date]]:
+    """
+    (start, end, day) along the train paths, so that most searches have results
+    """
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        stops = rng.choice(network.trains).stops
+        a, b = sorted(rng.sample(range(len(stops)), 2))
+        queries.append((stops[a][0], stops[b][0], network.first_day + timedelta(days=rng.randrange(network.days))))
+    return queries
+
+
+def load_ticket_histories(traits, network: Network, tickets_per_user: int, seed: int = 0) -> int:
+    """
+    Every user buys up to `tickets_per_user` routes found with search_connections, return the number of purchases
+    """
+    purchases = 0
+    queries = random_trip_queries(network, len(network.users) * tickets_per_user, seed)
+    for i, (start, end, day) in enumerate(queries):
+        routes = traits.search_connections(TraitsKey(start), TraitsKey(end), day.day, day.month, day.year, limit=1)
+        if routes:
+            try:
+                traits.buy_ticket(network.users[i % len(network.users)], routes[0])
+                purchases += 1
+            except ValueError:
+                # Sold out
+                pass
+    return purchases
+
+
+def load_network(traits, network: Network, tickets_per_user: int = 0, seed: int = 0) -> None:
+    load_stations(traits, network)
+    for train in network.trains:
+        load_train(traits, network, train)
+    load_users(traits, network)
+    if tickets_per_user:
+        load_ticket_histories(traits, network, tickets_per_user, seed)
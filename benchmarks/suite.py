@@ -0,0 +1,230 @@
+"""
+Scenario benchmarks of Traits on a synthetic network (see benchmarks.network).
+
+Run against the local MariaDB and Neo4j used by the tests. The "test" database and the
+graph are reset and initialized like the conftest.py fixtures do:
+    python -m benchmarks.suite --stations 100 --topology grid --trains 20 --days 7 --output results.json
+Prints (or writes) one JSON document with the parameters and the results of every scenario.
+"""
+import argparse
+import json
+import platform
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from statistics import mean
+from traits.interface import TraitsKey, SortingCriteria
+from traits.implementation import Traits, TraitsUtility
+from benchmarks.cypher_plan_cache import percentile
+from benchmarks.network import TOPOLOGIES, generate_network, load_stations, load_train, load_users, \
+    load_ticket_histories, random_trip_queries
+
+
+def summary(latencies, elapsed=None):
+    """
+    Latency percentiles in milliseconds, plus the throughput when the wall time is given
+    """
+    if not latencies:
+        return {"count": 0}
+    result = {
+        "count": len(latencies),
+        "mean_ms": round(mean(latencies), 3),
+        "p50_ms": round(percentile(latencies, 0.5), 3),
+        "p95_ms": round(percentile(latencies, 0.95), 3),
+        "max_ms": round(max(latencies), 3),
+    }
+    if elapsed:
+        result["operations_per_second"] = round(len(latencies) / elapsed, 1)
+    return result
+
+
+def timed(function, *args, **kwargs):
+    begin = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, (time.perf_counter() - begin) * 1000
+
+
+def reset_databases(host: str, port: int, root_password: str, neo4j_uri: str) -> None:
+    import mysql.connector
+    from neo4j import GraphDatabase
+
+    connection = mysql.connector.connect(host=host, port=port, user="root", password=root_password)
+    cursor = connection.cursor()
+    cursor.execute("DROP DATABASE IF EXISTS test;")
+    cursor.execute("CREATE DATABASE test;")
+    cursor.execute("USE test;")
+    for sql_statement in TraitsUtility.generate_sql_initialization_code():
+        cursor.execute(sql_statement)
+    connection.commit()
+    connection.close()
+    with GraphDatabase.driver(neo4j_uri) as driver:
+        driver.execute_query("MATCH (a) DETACH DELETE a")
+        for cypher_statement in TraitsUtility.generate_neo4j_initialization_code():
+            driver.execute_query(cypher_statement)
+
+
+def bench_load(traits: Traits, network):
+    """
+    Stations and connections, then the add_schedule bulk load (one schedule per train)
+    """
+    _, stations_ms = timed(load_stations, traits, network)
+    latencies = []
+    begin = time.perf_counter()
+    for train in network.trains:
+        latencies.append(timed(load_train, traits, network, train)[1])
+    elapsed = time.perf_counter() - begin
+    _, users_ms = timed(load_users, traits, network)
+    trips = network.days * sum(len(train.stops) - 1 for train in network.trains)
+    return {
+        "stations_and_connections_ms": round(stations_ms, 3),
+        "users_ms": round(users_ms, 3),
+        "add_schedule": dict(summary(latencies, elapsed), trips=trips, trips_per_second=round(trips / elapsed, 1)),
+    }
+
+
+def bench_search(traits: Traits, network, queries: int, seed: int):
+    """
+    search_connections for every SortingCriteria, both directions, on the same queries
+    """
+    results = {}
+    trip_queries = random_trip_queries(network, queries, seed)
+    for sort_by in SortingCriteria:
+        for is_departure_time in (True, False):
+            latencies, found = [], 0
+            for start, end, day in trip_queries:
+                routes, ms = timed(traits.search_connections, TraitsKey(start), TraitsKey(end), day.day, day.month, day.year,
+                                   is_departure_time=is_departure_time, sort_by=sort_by)
+                latencies.append(ms)
+                found += len(routes) > 0
+            name = f"{sort_by.name.lower()}_{'departure' if is_departure_time else 'arrival'}"
+            results[name] = dict(summary(latencies), with_results=found)
+    return results
+
+
+def bench_buy_ticket(traits: Traits, network, purchases: int, concurrency: int, seed: int):
+    """
+    Concurrent buy_ticket on routes found beforehand, half of them on the same few trips (contention)
+    """
+    routes = []
+    for start, end, day in random_trip_queries(network, max(1, purchases // 10), seed):
+        found = traits.search_connections(TraitsKey(start), TraitsKey(end), day.day, day.month, day.year, limit=1)
+        routes.extend(found)
+    if not routes:
+        return {"count": 0}
+
+    def buy(i):
+        route = routes[0] if i % 2 else routes[i % len(routes)]
+        begin = time.perf_counter()
+        try:
+            traits.buy_ticket(network.users[i % len(network.users)], route)
+            sold = True
+        except ValueError:
+            sold = False
+        return (time.perf_counter() - begin) * 1000, sold
+
+    begin = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = list(executor.map(buy, range(purchases)))
+    elapsed = time.perf_counter() - begin
+    return dict(summary([ms for ms, _ in outcomes], elapsed), sold=sum(sold for _, sold in outcomes),
+                concurrency=concurrency)
+
+
+def bench_sell_out(traits: Traits, network, buyers: int, seed: int):
+    """
+    `buyers` concurrent buy_ticket with seat reservation on one trip until it is sold out
+    """
+    trip = None
+    for start, end, day in random_trip_queries(network, 10, seed + 1):
+        found = traits.search_connections(TraitsKey(start), TraitsKey(end), day.day, day.month, day.year, limit=1)
+        if found:
+            trip = found[0][0]
+            break
+    if trip is None:
+        return {"count": 0}
+    seats = traits.utility.check_available_seats(trip[0])
+
+    def buy(i):
+        begin = time.perf_counter()
+        try:
+            traits.buy_ticket(network.users[i % len(network.users)], trip, also_reserve_seats=True)
+            sold = True
+        except ValueError:
+            sold = False
+        return (time.perf_counter() - begin) * 1000, sold
+
+    begin = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=buyers) as executor:
+        outcomes = list(executor.map(buy, range(buyers)))
+    elapsed = time.perf_counter() - begin
+    sold = sum(sold for _, sold in outcomes)
+    return dict(summary([ms for ms, _ in outcomes], elapsed), seats=seats, sold=sold,
+                overbooked=max(0, sold - seats), seats_left=traits.utility.check_available_seats(trip[0]))
+
+
+def bench_purchase_history(traits: Traits, network):
+    latencies = [timed(traits.get_purchase_history, email)[1] for email in network.users]
+    return summary(latencies)
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=3306)
+    parser.add_argument("--root-password", default="root-pass")
+    parser.add_argument("--uri", default="neo4j://localhost:7687")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stations", type=int, default=100)
+    parser.add_argument("--topology", choices=TOPOLOGIES, default="grid")
+    parser.add_argument("--trains", type=int, default=20)
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--tickets-per-user", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--purchases", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--buyers", type=int, default=60, help="concurrent buyers of the sell_out scenario")
+    parser.add_argument("--output", help="write the JSON to this file instead of stdout")
+    args = parser.parse_args()
+
+    reset_databases(args.host, args.port, args.root_password, args.uri)
+    network = generate_network(args.seed, args.stations, args.topology, args.trains, args.days, args.users)
+    traits = Traits.from_settings(host=args.host, port=args.port, neo4j_uri=args.uri, pool_size=args.concurrency)
+    try:
+        results = {"load": bench_load(traits, network)}
+        _, histories_ms = timed(load_ticket_histories, traits, network, args.tickets_per_user, args.seed)
+        results["ticket_histories_ms"] = round(histories_ms, 3)
+        results["search_connections"] = bench_search(traits, network, args.queries, args.seed)
+        results["buy_ticket"] = bench_buy_ticket(traits, network, args.purchases, args.concurrency, args.seed)
+        results["sell_out"] = bench_sell_out(traits, network, args.buyers, args.seed)
+        results["get_purchase_history"] = bench_purchase_history(traits, network)
+    finally:
+        traits.close()
+
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "parameters": vars(args) | {"root_password": None},
+        "network": {"stations": len(network.stations), "connections": len(network.connections),
+                    "trains": len(network.trains), "users": len(network.users)},
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -169,6 +169,8 @@ def neo4j_db(neo4j_db_host, neo4j_db_port):
         # The community version of Neo4j supports only one database, so we need to remove
         # all the nodes/links before and after each test
         records, summary, keys = driver.execute_query("MATCH (a) DETACH DELETE a")
+        for cypher_statement in TraitsUtility.generate_neo4j_initialization_code():
+            driver.execute_query(cypher_statement)
 
         yield driver
 
@@ -351,7 +351,10 @@ def test_connect_train_stations_success(rdbms_connection, rdbms_admin_connection
     t.connect_train_stations(station_key_1, station_key_2, travel_time)
     
     cursor = rdbms_admin_connection.cursor()
-    cursor.execute("SELECT * FROM Connections WHERE starting_station = %s AND ending_station = %s", 
+    cursor.execute("""SELECT * FROM Connections c
+                   JOIN Stations s1 ON c.starting_station_id = s1.station_id
+                   JOIN Stations s2 ON c.ending_station_id = s2.station_id
+                   WHERE s1.name = %s AND s2.name = %s""",
                    (station_key_1.to_string(), station_key_2.to_string()))
     connection = cursor.fetchone()
     assert connection is not None
@@ -455,6 +458,23 @@ def test_delete_train(rdbms_connection, rdbms_admin_connection, neo4j_db):
                    JOIN Trips t ON tk.trip_id = t.trip_id WHERE t.train_id = %s """, (tr,))
     rec = cursor.fetchall()
     assert len(rec) == 0
+
+def test_delete_train_commits(rdbms_connection, rdbms_admin_connection, neo4j_db):
+    import mysql.connector
+
+    t = Traits(rdbms_connection, rdbms_admin_connection, neo4j_db)
+    set_up(t, TraitsKey("1"), TraitsKey("2"), TraitsKey('t1'), 8, 0, 1, 1, 2030, 1, 1, 2030)
+    t.delete_train(TraitsKey('t1'))
+
+    # Visible from another connection, and the admin connection is usable right away
+    assert int(mysql.connector.__version__.split(".")[0]) >= 9
+    rdbms_connection.commit()
+    cursor = rdbms_connection.cursor()
+    cursor.execute("SELECT COUNT(*) FROM Trains;")
+    assert cursor.fetchone()[0] == 0
+    assert t.get_train_current_status(TraitsKey('t1')) is None
+    t.add_train(TraitsKey('t2'), train_capacity=3, train_status=TrainStatus.OPERATIONAL)
+    assert t.get_train_current_status(TraitsKey('t2')) == TrainStatus.OPERATIONAL
     # Purchase history remains
     assert len(t.get_purchase_history(user_email)) == 1
  
@@ -624,3 +644,871 @@ def test_schedule_overlap_multiple(rdbms_connection, rdbms_admin_connection, neo
                     sch,
                     valid_from_day, valid_from_month, valid_from_year,
                     valid_until_day, valid_until_month, valid_until_year) 
+
+def test_search_connections_feasible_transfers(rdbms_connection, rdbms_admin_connection, neo4j_db):
+    t = Traits(rdbms_connection, rdbms_admin_connection, neo4j_db)
+
+    starting_station_key = TraitsKey("1")
+    middle_station_key = TraitsKey("2")
+    ending_station_key = TraitsKey("3")
+
+    t.add_train_station(starting_station_key, None)
+    t.add_train_station(middle_station_key, None)
+    t.add_train_station(ending_station_key, None)
+    t.add_train(TraitsKey('t1'), train_capacity=100, train_status=TrainStatus.OPERATIONAL)
+    t.add_train(TraitsKey('t2'), train_capacity=100, train_status=TrainStatus.OPERATIONAL)
+    t.add_train(TraitsKey('t3'), train_capacity=100, train_status=TrainStatus.OPERATIONAL)
+    t.connect_train_stations(starting_station_key, middle_station_key, 40)
+    t.connect_train_stations(middle_station_key, ending_station_key, 20)
+
+    # t1 arrives at the middle station at 8:40
+    t.add_schedule(TraitsKey('t1'), 8, 0, [(starting_station_key, 5), (middle_station_key, 10)], 6, 1, 2024, 6, 1, 2024)
+    # t2 leaves the middle station before t1 arrives, so it cannot be used as a change
+    t.add_schedule(TraitsKey('t2'), 8, 30, [(middle_station_key, 5), (ending_station_key, 10)], 6, 1, 2024, 6, 1, 2024)
+    # t3 leaves after t1 arrives
+    t.add_schedule(TraitsKey('t3'), 9, 0, [(middle_station_key, 5), (ending_station_key, 10)], 6, 1, 2024, 6, 1, 2024)
+
+    results = t.search_connections(starting_station_key, ending_station_key, 6, 1, 2024)
+    test_final = [[res[0] for res in result] for result in results]
+    # Trip ids: t1 -> 1, t2 -> 2, t3 -> 3
+    assert test_final == [[1, 3]]
+
+def test_search_connections_timetable_snapshot(rdbms_connection, rdbms_admin_connection, neo4j_db):
+    t = Traits(rdbms_connection, rdbms_admin_connection, neo4j_db)
+    starting_station_key = TraitsKey("1")
+    ending_station_key = TraitsKey("2")
+    train_key = TraitsKey('t1')
+    set_up(t, starting_station_key, ending_station_key, train_key, 8, 0, 1, 1, 2030, 2, 1, 2030)
+
+    from_databases = t.search_connections(starting_station_key, ending_station_key, 1, 1, 2030)
+    t.load_timetable_snapshot()
+    from_snapshot = t.search_connections(starting_station_key, ending_station_key, 1, 1, 2030)
+    assert from_snapshot == from_databases
+
+    # The snapshot follows new schedules and deleted trains
+    t.add_train(TraitsKey('t2'), train_capacity=3, train_status=TrainStatus.OPERATIONAL)
+    t.add_schedule(TraitsKey('t2'), 12, 0, [(starting_station_key, 5), (ending_station_key, 10)], 1, 1, 2030, 1, 1, 2030)
+    assert len(t.search_connections(starting_station_key, ending_station_key, 1, 1, 2030)) == 3
+    t.delete_train(TraitsKey('t2'))
+    assert t.search_connections(starting_station_key, ending_station_key, 1, 1, 2030) == from_databases
+
+    with pytest.raises(ValueError):
+        t.search_connections(starting_station_key, TraitsKey("unknown"), 1, 1, 2030)
+
+def test_timetable_snapshot_concurrent_refresh():
+    import sys
+    import threading
+    from datetime import date, datetime, timedelta
+    from traits.snapshot import TimetableSnapshot
+
+    class Connection:
+        """
+        Trains by name, with their trips
+        """
+        def __init__(self):
+            self.trains = {}
+
+        def cursor(self):
+            return self
+
+        def execute(self, query, params):
+            self.params = params
+
+        def fetchone(self):
+            return self.trains[self.params[0]][0]
+
+        def fetchall(self):
+            return next(trips for train, trips in self.trains.values() if train[0] == self.params[0])
+
+        def close(self):
+            pass
+
+    # Every trip takes trip_id % 30 + 1 minutes
+    def trips(train_id, first_id, days):
+        return [(trip_id, train_id, 1, 2, date(2030, 1, day), timedelta(minutes=trip_id % 60),
+                 timedelta(minutes=trip_id % 60 + trip_id % 30 + 1))
+                for day in days for trip_id in range(first_id + 1000 * day, first_id + 1000 * day + 50)]
+
+    snapshot = TimetableSnapshot()
+    snapshot.add_station(1, "A")
+    snapshot.add_station(2, "B")
+    connection = Connection()
+    # t2 runs every day, the refreshes of t1 move it between two sets of days
+    connection.trains["t2"] = ((2, "t2", 3, 0), trips(2, 500, range(1, 6)))
+    snapshot.refresh_train(connection, "t2")
+    done = threading.Event()
+    errors = []
+
+    def refresh():
+        for i in range(200):
+            connection.trains["t1"] = ((1, "t1", 3, 0), trips(1, i % 2, range(1, 4) if i % 2 else range(2, 6)))
+            snapshot.refresh_train(connection, "t1")
+        done.set()
+
+    def search():
+        try:
+            while not done.is_set():
+                snapshot.edges()
+                for day in snapshot.search_days(datetime(2030, 1, 1), True):
+                    for leg in snapshot.legs(day):
+                        assert leg.travel_time == leg.relation[0] % 30 + 1
+        except Exception as e:
+            errors.append(e)
+
+    # Switch threads as often as possible, a half-updated snapshot would be seen
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        threads = [threading.Thread(target=refresh)] + [threading.Thread(target=search) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+    assert errors == []
+    assert [len(snapshot.days[day]) for day in snapshot.sorted_days] == [100, 100, 100, 50, 50]
+
+def test_lazy_trips(rdbms_connection, rdbms_admin_connection, neo4j_db):
+    t = Traits(rdbms_connection, rdbms_admin_connection, neo4j_db, lazy_trips=True)
+    starting_station_key = TraitsKey("1")
+    ending_station_key = TraitsKey("2")
+    set_up(t, starting_station_key, ending_station_key, TraitsKey('t1'), 8, 0, 1, 1, 2024, 31, 12, 2024)
+
+    # Only the schedule is stored, no dated trips
+    cursor = rdbms_admin_connection.cursor()
+    cursor.execute("SELECT COUNT(*) FROM Trips")
+    assert cursor.fetchone()[0] == 0
+
+    result = t.search_connections(starting_station_key, ending_station_key, 6, 1, 2024, limit=2)
+    assert len(result) == 2
+    assert [str(route[0][4]) for route in result] == ["2024-01-06", "2024-01-07"]
+    assert result[0][0][0] is None
+
+    # Buying a ticket stores the trip
+    t.add_user("user@example.com", None)
+    t.buy_ticket("user@example.com", result[0][0], also_reserve_seats=True)
+    result = t.search_connections(starting_station_key, ending_station_key, 6, 1, 2024, limit=2)
+    assert result[0][0][0] == 1 and result[1][0][0] is None
+    assert len(t.get_purchase_history("user@example.com")) == 1
+
+def explain(cursor, query, params, table):
+    cursor.execute("EXPLAIN " + query, params)
+    rows = [row for row in cursor.fetchall() if row["table"] == table]
+    assert rows, f"{table} is not part of the plan"
+    return rows[0]
+
+def test_hot_queries_use_indexes(rdbms_connection, rdbms_admin_connection, neo4j_db):
+    t = Traits(rdbms_connection, rdbms_admin_connection, neo4j_db)
+    set_up(t, TraitsKey("1"), TraitsKey("2"), TraitsKey('t1'), 8, 0, 1, 1, 2030, 28, 2, 2030)
+    t.add_user("user@example.com", None)
+    result = t.search_connections(TraitsKey("1"), TraitsKey("2"), 1, 1, 2030)
+    t.buy_ticket("user@example.com", result[0][0], also_reserve_seats=True)
+    # Other trains, so that the range lookups below are selective
+    from traits.implementation import ScheduleSpec
+    from datetime import date
+    trains = [TraitsKey(f"other{i}") for i in range(20)]
+    t.add_trains([(train_key, 3, TrainStatus.OPERATIONAL) for train_key in trains])
+    t.add_schedules([ScheduleSpec(train_key, 8, 0, [(TraitsKey("1"), 5), (TraitsKey("2"), 10)], date(2030, 1, 1), date(2030, 1, 10))
+                     for train_key in trains])
+
+    cursor = rdbms_admin_connection.cursor(dictionary=True)
+    cursor.execute("ANALYZE TABLE Trips, Schedules;")
+    cursor.fetchall()
+    # Point lookups must not scan the table
+    plan = explain(cursor, "SELECT station_id FROM Stations WHERE name = %s", ("1",), "Stations")
+    assert plan["type"] != "ALL"
+    plan = explain(cursor, "SELECT travel_time FROM Connections WHERE starting_station_id = %s AND ending_station_id = %s", (1, 2), "Connections")
+    assert plan["type"] != "ALL" and plan["key"] == "connection_stations"
+    plan = explain(cursor, "SELECT COUNT(*) FROM Reservations R JOIN Tickets T ON R.ticket_id = T.ticket_id WHERE T.trip_id = %s", (1,), "T")
+    assert plan["type"] != "ALL" and plan["key"] == "ticket_trip"
+    # Range lookups of delete_on_trians and is_schedule_feasible use their index
+    plan = explain(cursor, "SELECT trip_id FROM Trips WHERE train_id = %s AND date >= %s", (1, "2030-02-20"), "Trips")
+    assert plan["type"] != "ALL" and plan["key"] == "trip_departure"
+    plan = explain(cursor, "SELECT start_time, end_time FROM Schedules WHERE train_id = %s AND valid_until >= %s AND valid_from <= %s",
+                   (1, "2030-01-01", "2030-01-02"), "Schedules")
+    assert plan["type"] != "ALL" and plan["key"] == "schedule_validity"
+
+def test_reserved_seat_counter(rdbms_connection, rdbms_admin_connection, neo4j_db):
+    t = Traits(rdbms_connection, rdbms_admin_connection, neo4j_db)
+    set_up(t, TraitsKey("1"), TraitsKey("2"), TraitsKey('t1'), 8, 0, 1, 1, 2030, 1, 1, 2030)
+    result = t.search_connections(TraitsKey("1"), TraitsKey("2"), 1, 1, 2030)
+    trip_id = result[0][0][0]
+
+    t.add_user("user@example.com", None)
+    t.add_user("user2@example.com", None)
+    t.buy_ticket("user@example.com", result[0][0], also_reserve_seats=True)
+    t.buy_ticket("user2@example.com", result[0][0], also_reserve_seats=True)
+    t.buy_ticket("user2@example.com", result[0][0], also_reserve_seats=False)
+    # The train has 3 seats
+    assert t.utility.check_available_seats(trip_id) == 1
+
+    # Deleting a user releases the seats
+    t.delete_user("user2@example.com")
+    assert t.utility.check_available_seats(trip_id) == 2
+    assert t.utility.reconcile_reserved_seats() == []
+
+    # Drift is detected and repaired
+    cursor = rdbms_admin_connection.cursor()
+    cursor.execute("UPDATE TripSeats SET reserved_seats = 3 WHERE trip_id = %s", (trip_id,))
+    rdbms_admin_connection.commit()
+    assert t.utility.reconcile_reserved_seats() == [(trip_id, 3, 1)]
+    assert t.utility.check_available_seats(trip_id) == 2
+
+def test_buy_ticket_concurrent_no_overbooking(rdbms_connection, rdbms_admin_connection, neo4j_db, connection_factory):
+    from concurrent.futures import ThreadPoolExecutor
+    from traits.interface import BASE_USER_NAME, BASE_USER_PASS
+
+    t = Traits(rdbms_connection, rdbms_admin_connection, neo4j_db)
+    t.add_train_station(TraitsKey("1"), None)
+    t.add_train_station(TraitsKey("2"), None)
+    t.connect_train_stations(TraitsKey("1"), TraitsKey("2"), 40)
+    t.add_train(TraitsKey('t1'), train_capacity=20, train_status=TrainStatus.OPERATIONAL)
+    t.add_schedule(TraitsKey('t1'), 8, 0, [(TraitsKey("1"), 5), (TraitsKey("2"), 10)], 1, 1, 2030, 1, 1, 2030)
+    trip = t.search_connections(TraitsKey("1"), TraitsKey("2"), 1, 1, 2030)[0][0]
+
+    buyers = 60
+    for i in range(buyers):
+        t.add_user(f"user{i}@example.com", None)
+
+    def buy(i):
+        # One connection per buyer, as for concurrent web requests
+        with connection_factory(BASE_USER_NAME, BASE_USER_PASS) as connection:
+            try:
+                Traits(connection, connection, neo4j_db).buy_ticket(f"user{i}@example.com", trip, also_reserve_seats=True)
+                return True
+            except ValueError:
+                return False
+
+    # Any error other than sold out is raised here, see benchmarks/suite.py for the throughput
+    with ThreadPoolExecutor(max_workers=buyers) as executor:
+        outcomes = list(executor.map(buy, range(buyers)))
+    assert outcomes.count(True) == 20
+
+    # Every buyer has one outcome: one reserved ticket when sold, nothing when sold out
+    rdbms_admin_connection.commit()
+    cursor = rdbms_admin_connection.cursor()
+    cursor.execute("""
+        SELECT u.email, COUNT(t.ticket_id), COUNT(r.ticket_id) FROM Users u
+        LEFT JOIN Journeys j ON j.user_id = u.user_id LEFT JOIN Tickets t ON t.journey_id = j.journey_id
+        LEFT JOIN Reservations r ON r.ticket_id = t.ticket_id GROUP BY u.email;""")
+    assert {email: (tickets, reserved) for email, tickets, reserved in cursor.fetchall()} == \
+           {f"user{i}@example.com": (1, 1) if sold else (0, 0) for i, sold in enumerate(outcomes)}
+    # Never more seats sold than the capacity
+    cursor.execute("SELECT COUNT(*) FROM Reservations")
+    assert cursor.fetchone()[0] == 20
+    assert t.utility.check_available_seats(trip[0]) == 0
+
+def test_buy_ticket_whole_route(rdbms_connection, rdbms_admin_connection, neo4j_db):
+    t = Traits(rdbms_connection, rdbms_admin_connection, neo4j_db)
+    t.add_train_station(TraitsKey("1"), None)
+    t.add_train_station(TraitsKey("2"), None)
+    t.add_train_station(TraitsKey("3"), None)
+    t.connect_train_stations(TraitsKey("1"), TraitsKey("2"), 40)
+    t.connect_train_stations(TraitsKey("2"), TraitsKey("3"), 20)
+    t.add_train(TraitsKey('t1'), train_capacity=5, train_status=TrainStatus.OPERATIONAL)
+    t.add_train(TraitsKey('t2'), train_capacity=1, train_status=TrainStatus.OPERATIONAL)
+    t.add_schedule(TraitsKey('t1'), 8, 0, [(TraitsKey("1"), 5), (TraitsKey("2"), 10)], 1, 1, 2030, 1, 1, 2030)
+    t.add_schedule(TraitsKey('t2'), 9, 0, [(TraitsKey("2"), 5), (TraitsKey("3"), 10)], 1, 1, 2030, 1, 1, 2030)
+    route = t.search_connections(TraitsKey("1"), TraitsKey("3"), 1, 1, 2030)[0]
+    assert len(route) == 2
+
+    t.add_user("user@example.com", None)
+    t.add_user("user2@example.com", None)
+    assert t.buy_ticket("user@example.com", route, also_reserve_seats=True) == [1, 2]
+    assert len(t.get_purchase_history("user@example.com")) == 2
+
+    # The second leg is sold out: nothing is booked
+    with pytest.raises(ValueError):
+        t.buy_ticket("user2@example.com", route, also_reserve_seats=True)
+    assert t.get_purchase_history("user2@example.com") == []
+    assert t.utility.check_available_seats(route[0][0]) == 4
+    # Without seats the whole route can still be bought
+    assert len(t.buy_ticket("user2@example.com", route, also_reserve_seats=False)) == 2
+
+def test_buy_tickets_bulk(rdbms_connection, rdbms_admin_connection, neo4j_db):
+    from traits.implementation import PurchaseOutcome
+
+    t = Traits(rdbms_connection, rdbms_admin_connection, neo4j_db)
+    set_up(t, TraitsKey("1"), TraitsKey("2"), TraitsKey('t1'), 8, 0, 1, 1, 2030, 1, 1, 2030)
+    trip = t.search_connections(TraitsKey("1"), TraitsKey("2"), 1, 1, 2030)[0][0]
+    for i in range(4):
+        t.add_user(f"user{i}@example.com", None)
+
+    # The train has 3 seats
+    outcomes = t.buy_tickets([(f"user{i}@example.com", trip, True) for i in range(4)]
+                             + [("unknown@example.com", trip, True), ("user0@example.com", [trip], False)])
+    assert [outcome for outcome, _ in outcomes] == [PurchaseOutcome.BOOKED] * 3 + [PurchaseOutcome.BOOKED_WITHOUT_SEAT,
+                                                    PurchaseOutcome.REJECTED, PurchaseOutcome.BOOKED_WITHOUT_SEAT]
+    assert [tickets for _, tickets in outcomes] == [[1], [2], [3], [4], [], [5]]
+    assert t.utility.check_available_seats(trip[0]) == 0
+    assert t.utility.reconcile_reserved_seats(repair=False) == []
+    assert len(t.get_purchase_history("user0@example.com")) == 2
+
+def test_buy_tickets_non_consecutive_ids(rdbms_connection, rdbms_admin_connection, neo4j_db):
+    t = Traits(rdbms_connection, rdbms_admin_connection, neo4j_db)
+    set_up(t, TraitsKey("1"), TraitsKey("2"), TraitsKey('t1'), 8, 0, 1, 1, 2030, 1, 1, 2030)
+    trip = t.search_connections(TraitsKey("1"), TraitsKey("2"), 1, 1, 2030)[0][0]
+    for i in range(3):
+        t.add_user(f"user{i}@example.com", None)
+
+    # Ids of a multi-row insert are not consecutive, as with Galera
+    cursor = rdbms_connection.cursor()
+    cursor.execute("SET SESSION auto_increment_increment = 2;")
+    outcomes = t.buy_tickets([(f"user{i}@example.com", trip, True) for i in range(3)])
+    cursor.execute("SET SESSION auto_increment_increment = 1;")
+
+    cursor = rdbms_admin_connection.cursor()
+    cursor.execute("""
+        SELECT t.ticket_id, u.email, r.ticket_id IS NOT NULL FROM Tickets t
+        JOIN Journeys j ON t.journey_id = j.journey_id JOIN Users u ON j.user_id = u.user_id
+        LEFT JOIN Reservations r ON t.ticket_id = r.ticket_id;""")
+    stored = {ticket_id: (email, bool(reserved)) for ticket_id, email, reserved in cursor.fetchall()}
+    assert {tickets[0]: (f"user{i}@example.com", True) for i, (_, tickets) in enumerate(outcomes)} == stored
+
+def test_pooled_traits_shared_between_threads(mariadb, mariadb_host, mariadb_port, neo4j_db, neo4j_db_host, neo4j_db_port):
+    from concurrent.futures import ThreadPoolExecutor
+
+    t = Traits.from_settings(host=mariadb_host, port=int(mariadb_port), neo4j_uri=f"neo4j://{neo4j_db_host}:{neo4j_db_port}", pool_size=2)
+    try:
+        set_up(t, TraitsKey("1"), TraitsKey("2"), TraitsKey('t1'), 8, 0, 1, 1, 2030, 1, 1, 2030)
+
+        def add_and_read(i):
+            t.add_user(f"user{i}@example.com", None)
+            return t.get_purchase_history(f"user{i}@example.com")
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            assert list(executor.map(add_and_read, range(16))) == [[]] * 16
+        assert len(t.utility.get_all_users()) == 16
+        assert len(t.search_connections(TraitsKey("1"), TraitsKey("2"), 1, 1, 2030)) == 1
+        # Never more connections than the pool size
+        assert all(pool._created <= 2 for pool in t.pools)
+    finally:
+        t.close()
+
+def test_pooled_connection_checkout():
+    from mysql.connector.errors import PoolError
+    from traits.pool import ConnectionPool, PooledConnection
+
+    class Connection:
+        def is_connected(self):
+            return True
+
+        def reset_session(self):
+            pass
+
+    base_pool, admin_pool, base_reserve = (ConnectionPool(Connection, 1, timeout=0.1) for _ in range(3))
+    admin = PooledConnection(admin_pool)
+    base = PooledConnection(base_pool, base_reserve, admin)
+    taken = base_pool.acquire()
+    with pytest.raises(PoolError):
+        base_pool.acquire()
+
+    with admin.operation(), base.operation():
+        # An admin statement only takes an admin connection
+        admin.is_connected()
+        assert (base_pool._created, admin_pool._created, base_reserve._created) == (1, 1, 0)
+        # With every base connection taken, the admin holder does not wait for one
+        base.is_connected()
+        assert base_reserve._created == 1
+    base_pool.release(taken)
+    assert [pool._idle.qsize() for pool in (base_pool, admin_pool, base_reserve)] == [1, 1, 1]
+
+def test_search_connections_station_name_with_quote(rdbms_connection, rdbms_admin_connection, neo4j_db):
+    t = Traits(rdbms_connection, rdbms_admin_connection, neo4j_db)
+    # Station names are passed as Cypher parameters, quotes cannot break the query
+    set_up(t, TraitsKey("O'Hare"), TraitsKey('Central "Station"'), TraitsKey('t1'), 8, 0, 1, 1, 2030, 1, 1, 2030)
+    result = t.search_connections(TraitsKey("O'Hare"), TraitsKey('Central "Station"'), 1, 1, 2030)
+    assert len(result) == 1
+
+def test_neo4j_initialization(rdbms_connection, rdbms_admin_connection, neo4j_db):
+    t = Traits(rdbms_connection, rdbms_admin_connection, neo4j_db)
+    # Idempotent, the fixture already ran it
+    t.utility.initialize_neo4j()
+    t.utility.initialize_neo4j()
+
+    records, _, _ = neo4j_db.execute_query("SHOW CONSTRAINTS YIELD name")
+    assert "station_name" in [record["name"] for record in records]
+    records, _, _ = neo4j_db.execute_query("SHOW INDEXES YIELD name")
+    assert {"trip_departure_time", "trip_arrival_time", "trip_trip_id"} <= {record["name"] for record in records}
+
+    t.add_train_station(TraitsKey("1"), None)
+    with pytest.raises(Exception):
+        neo4j_db.execute_query("CREATE (:Station {name: '1'})")
+
+def test_search_cache(rdbms_connection, rdbms_admin_connection, neo4j_db):
+    t = Traits(rdbms_connection, rdbms_admin_connection, neo4j_db)
+    cache = t.enable_search_cache()
+    set_up(t, TraitsKey("1"), TraitsKey("2"), TraitsKey('t1'), 8, 0, 1, 1, 2030, 1, 1, 2030)
+    t.add_train_station(TraitsKey("3"), None)
+    t.add_train_station(TraitsKey("4"), None)
+    t.connect_train_stations(TraitsKey("3"), TraitsKey("4"), 20)
+
+    result = t.search_connections(TraitsKey("1"), TraitsKey("2"), 1, 1, 2030)
+    assert t.search_connections(TraitsKey("1"), TraitsKey("2"), 1, 1, 2030) == result
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+    # A schedule on unrelated stations keeps the entry
+    t.add_train(TraitsKey('t2'), train_capacity=3, train_status=TrainStatus.OPERATIONAL)
+    t.add_schedule(TraitsKey('t2'), 9, 0, [(TraitsKey("3"), 5), (TraitsKey("4"), 10)], 1, 1, 2030, 1, 1, 2030)
+    assert cache.stats()["entries"] == 1
+
+    # A second train between the same stations drops it
+    t.add_train(TraitsKey('t3'), train_capacity=3, train_status=TrainStatus.OPERATIONAL)
+    t.add_schedule(TraitsKey('t3'), 10, 0, [(TraitsKey("1"), 5), (TraitsKey("2"), 10)], 1, 1, 2030, 1, 1, 2030)
+    assert cache.stats()["entries"] == 0
+    assert len(t.search_connections(TraitsKey("1"), TraitsKey("2"), 1, 1, 2030)) == 2
+
+    # Deleting a train drops the searches using it
+    t.search_connections(TraitsKey("3"), TraitsKey("4"), 1, 1, 2030)
+    t.delete_train(TraitsKey('t3'))
+    assert cache.stats()["entries"] == 1
+    assert len(t.search_connections(TraitsKey("1"), TraitsKey("2"), 1, 1, 2030)) == 1
+
+    # Bulk schedules only drop the searches of their trains' stations and days as well
+    from datetime import date
+    from traits.implementation import ScheduleSpec
+    t.add_trains([(TraitsKey('t4'), 3, TrainStatus.OPERATIONAL), (TraitsKey('t5'), 3, TrainStatus.OPERATIONAL)])
+    t.add_schedules([ScheduleSpec(TraitsKey('t4'), 11, 0, [(TraitsKey("3"), 5), (TraitsKey("4"), 10)], date(2030, 1, 1), date(2030, 1, 1))])
+    assert cache.stats()["entries"] == 1
+    t.add_schedules([ScheduleSpec(TraitsKey('t5'), 11, 0, [(TraitsKey("1"), 5), (TraitsKey("2"), 10)], date(2030, 1, 1), date(2030, 1, 1))])
+    assert cache.stats()["entries"] == 0
+    assert len(t.search_connections(TraitsKey("1"), TraitsKey("2"), 1, 1, 2030)) == 2
+
+def test_async_traits(mariadb, mariadb_host, mariadb_port, neo4j_db, neo4j_db_host, neo4j_db_port):
+    import asyncio
+    from datetime import date
+    from traits.async_implementation import AsyncTraits
+    from traits.service_patterns import ServicePattern
+
+    async def scenario():
+        t = await AsyncTraits.from_settings(host=mariadb_host, port=int(mariadb_port), neo4j_uri=f"neo4j://{neo4j_db_host}:{neo4j_db_port}", pool_size=2)
+        try:
+            await asyncio.to_thread(set_up, t.traits, TraitsKey("1"), TraitsKey("2"), TraitsKey('t1'), 8, 0, 1, 1, 2030, 2, 1, 2030)
+            await t.add_user("user@example.com", None)
+
+            # Concurrent searches give the same results as the synchronous API
+            results = await asyncio.gather(*(t.search_connections(TraitsKey("1"), TraitsKey("2"), 1, 1, 2030) for _ in range(10)))
+            assert results == [t.traits.search_connections(TraitsKey("1"), TraitsKey("2"), 1, 1, 2030)] * 10
+            assert len(results[0]) == 2
+            with pytest.raises(ValueError):
+                await t.search_connections(TraitsKey("1"), TraitsKey("3"), 1, 1, 2030)
+
+            assert await t.get_train_current_status(TraitsKey('t1')) == TrainStatus.OPERATIONAL
+            await t.buy_ticket("user@example.com", results[0][0][0])
+            await t.buy_ticket("user@example.com", results[0][1])
+            assert len(await t.get_purchase_history("user@example.com")) == 2
+            assert t.traits.utility.check_available_seats(results[0][0][0][0]) == 1
+            page, after = await t.get_purchase_history_page("user@example.com", limit=1)
+            assert await t.get_purchase_history_page("user@example.com", limit=1, after=after) == \
+                t.traits.get_purchase_history_page("user@example.com", limit=1, after=after)
+
+            # The other methods run on the wrapped Traits, whose pools stay small
+            assert [pool.size for pool in t.traits.pools] == [1, 1, 1, 1]
+            outcomes = await t.buy_tickets([("user@example.com", results[0][0][0], False)])
+            assert len(outcomes[0][1]) == 1
+            await t.add_train(TraitsKey('t2'), 3, TrainStatus.OPERATIONAL)
+            # Only on January 2
+            await t.add_schedule(TraitsKey('t2'), 10, 0, [(TraitsKey("1"), 5), (TraitsKey("2"), 10)], 1, 1, 2030, 2, 1, 2030,
+                                 ServicePattern(0, added=[date(2030, 1, 2)]))
+            assert len(await t.search_connections(TraitsKey("1"), TraitsKey("2"), 1, 1, 2030)) == 3
+        finally:
+            await t.close()
+
+    asyncio.run(scenario())
+
+def test_dual_store_writes_outbox(rdbms_connection, rdbms_admin_connection, neo4j_db):
+    from datetime import datetime
+    from traits.implementation import CREATE_TRIPS_QUERY
+    from traits.pipeline import graph_write
+
+    t = Traits(rdbms_connection, rdbms_admin_connection, neo4j_db)
+    set_up(t, TraitsKey("1"), TraitsKey("2"), TraitsKey('t1'), 8, 0, 1, 1, 2030, 10, 1, 2030)
+
+    def trips_in_neo4j():
+        records, _, _ = neo4j_db.execute_query("MATCH ()-[r:TRIP]->() RETURN count(r) AS trips")
+        return records[0]["trips"]
+
+    cursor = rdbms_admin_connection.cursor()
+    cursor.execute("SELECT COUNT(*) FROM Trips")
+    assert cursor.fetchone()[0] == trips_in_neo4j() == 10
+    cursor.execute("SELECT COUNT(*) FROM GraphOutbox")
+    assert cursor.fetchone()[0] == 0
+
+    # A failure on the MariaDB side removes what was already written to Neo4j
+    row = {"trip_id": -1, "start_station_name": "1", "end_station_name": "2", "departure_time": datetime(2030, 2, 1, 8),
+           "travel_time": 40, "arrival_time": datetime(2030, 2, 1, 8, 40), "train_name": "t1"}
+    with pytest.raises(RuntimeError):
+        with graph_write(t.utility, rdbms_admin_connection, "schedule", "t1") as writer:
+            writer.submit(CREATE_TRIPS_QUERY, rows=[row])
+            raise RuntimeError
+    assert trips_in_neo4j() == 10
+    cursor.execute("SELECT COUNT(*) FROM GraphOutbox")
+    assert cursor.fetchone()[0] == 0
+
+    # Entries left by a crash: rolled back if MariaDB did not commit, dropped otherwise
+    write_id = t.utility.begin_graph_write("schedule", "t1")
+    neo4j_db.execute_query(CREATE_TRIPS_QUERY, rows=[row], write_id=write_id)
+    committed_id = t.utility.begin_graph_write("station", "1")
+    t.utility.mark_graph_write(committed_id)
+    rdbms_admin_connection.commit()
+    assert t.utility.replay_graph_outbox(min_age=0) == [(write_id, "t1", False), (committed_id, "1", True)]
+    assert trips_in_neo4j() == 10
+    assert t.utility.replay_graph_outbox(min_age=0) == []
+
+def test_graph_writer_session_thread():
+    import threading
+    from traits.pipeline import GraphWriter
+
+    class Session:
+        def __init__(self):
+            self.thread = threading.get_ident()
+            self.runs = []
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            pass
+
+        def run(self, query, **params):
+            # Only used by the thread that opened the session
+            assert threading.get_ident() == self.thread
+            self.runs.append((query, params))
+            return self
+
+        def consume(self):
+            pass
+
+    class Driver:
+        def __init__(self):
+            self.sessions = []
+
+        def session(self):
+            self.sessions.append(Session())
+            return self.sessions[-1]
+
+    driver = Driver()
+    writer = GraphWriter(driver, write_id=7)
+    writer.submit("CREATE (:Station {name: $name})", name="1")
+    writer.join()
+    assert len(driver.sessions) == 1 and driver.sessions[0].thread != threading.get_ident()
+    assert driver.sessions[0].runs == [("CREATE (:Station {name: $name})", {"write_id": 7, "name": "1"})]
+
+def test_instrumentation(rdbms_connection, rdbms_admin_connection, neo4j_db):
+    exported = []
+    t = Traits(rdbms_connection, rdbms_admin_connection, neo4j_db)
+    instrumentation = t.enable_instrumentation(exporters=[exported.append], profile=True)
+    set_up(t, TraitsKey("1"), TraitsKey("2"), TraitsKey('t1'), 8, 0, 1, 1, 2030, 1, 1, 2030)
+    t.search_connections(TraitsKey("1"), TraitsKey("2"), 1, 1, 2030)
+
+    # One trace per outer call, the utility methods used by search_connections are part of it
+    assert [trace.method for trace in exported] == ["Traits.add_train_station", "Traits.add_train_station", "Traits.add_train",
+                                                    "Traits.connect_train_stations", "Traits.add_schedule", "Traits.search_connections"]
+    search = exported[-1]
+    assert search.sql_round_trips >= 3 and search.sql_rows >= 1
+    assert search.cypher_queries == 2 and search.cypher_rows >= 2
+    assert search.db_hits > 0
+    assert search.wall_ms >= search.sql_ms + search.cypher_ms
+    # The Neo4j writes of add_schedule run on a worker thread but belong to the call
+    assert exported[4].cypher_queries == 1
+
+    assert instrumentation.histograms()["Traits.search_connections"]["wall_ms"]["count"] == 1
+    assert instrumentation.hot_queries(1)[0]["count"] >= 1
+
+def test_validate_schedules_batch(rdbms_connection, rdbms_admin_connection, neo4j_db):
+    t = Traits(rdbms_connection, rdbms_admin_connection, neo4j_db)
+    set_up(t, TraitsKey("1"), TraitsKey("2"), TraitsKey('t1'), 8, 0, 1, 1, 2030, 10, 1, 2030)
+    cursor = rdbms_admin_connection.cursor()
+    cursor.execute("SELECT train_id FROM Trains WHERE train_name = 't1'")
+    train_id = cursor.fetchone()[0]
+
+    assert t.utility.validate_schedules(train_id, [
+        ("8:30:00", "9:00:00", "2030-01-05", "2030-01-06"),   # overlaps the stored schedule
+        ("12:0:00", "13:00:00", "2030-01-05", "2030-01-20"),  # feasible
+        ("12:30:00", "12:45:00", "2030-01-15", "2030-01-15"), # overlaps the previous candidate
+        ("3:0:00", "4:00:00", "2030-01-11", "2030-01-11"),    # more than 6 hours after the last 8:00 run
+        ("23:0:00", "23:50:00", "2030-01-10", "2030-01-10"),  # less than 6 hours before the 3:00 candidate of the next day
+        ("14:0:00", "13:00:00", "2030-01-21", "2030-01-21"),  # goes onto the next day
+    ]) == ["overlap", None, "overlap", None, "turnaround_after", "next_day"]
+    # Nothing was stored
+    assert len(t.utility.get_all_schedules()) == 1
+    assert t.utility.is_schedule_feasible(train_id, "12:0:00", "13:00:00", "2030-01-05", "2030-01-20")
+
+def test_service_patterns(rdbms_connection, rdbms_admin_connection, neo4j_db):
+    from datetime import date
+    from traits.service_patterns import ServicePattern, WEEKDAYS
+    t = Traits(rdbms_connection, rdbms_admin_connection, neo4j_db)
+    t.add_holiday_calendar("holidays", [date(2030, 1, 8)])
+    # Weekdays of 2030-01-01 (Tuesday) to 2030-01-14, without the 8th (holiday) and the 9th, plus Saturday the 5th
+    service = ServicePattern(WEEKDAYS, added=[date(2030, 1, 5)], removed=[date(2030, 1, 9)], holiday_calendar="holidays")
+    t.add_train_station(TraitsKey("1"), None)
+    t.add_train_station(TraitsKey("2"), None)
+    t.connect_train_stations(TraitsKey("1"), TraitsKey("2"), 40)
+    t.add_train(TraitsKey("t1"), train_capacity=3, train_status=TrainStatus.OPERATIONAL)
+    t.add_schedule(TraitsKey("t1"), 8, 0, [(TraitsKey("1"), 5), (TraitsKey("2"), 10)], 1, 1, 2030, 14, 1, 2030, service=service)
+    cursor = rdbms_admin_connection.cursor()
+    cursor.execute("SELECT COUNT(*) FROM Trips")
+    assert cursor.fetchone()[0] == 9
+
+    # Same pattern with trips generated by the searches
+    lazy = Traits(rdbms_connection, rdbms_admin_connection, neo4j_db, lazy_trips=True)
+    lazy.add_train(TraitsKey("t2"), train_capacity=3, train_status=TrainStatus.OPERATIONAL)
+    lazy.add_schedule(TraitsKey("t2"), 12, 0, [(TraitsKey("1"), 5), (TraitsKey("2"), 10)], 1, 1, 2030, 14, 1, 2030, service=service)
+    result = lazy.search_connections(TraitsKey("1"), TraitsKey("2"), 5, 1, 2030, limit=3)
+    assert [str(route[0][4]) for route in result] == ["2030-01-05", "2030-01-07", "2030-01-10"]
+
+    with pytest.raises(ValueError):
+        t.add_schedule(TraitsKey("t1"), 15, 0, [(TraitsKey("1"), 5), (TraitsKey("2"), 10)], 1, 2, 2030, 14, 2, 2030,
+                       service=ServicePattern(holiday_calendar="unknown"))
+
+def test_purchase_history_pages(rdbms_connection, rdbms_admin_connection, neo4j_db):
+    from traits.implementation import PURCHASE_HISTORY_QUERY
+
+    t = Traits(rdbms_connection, rdbms_admin_connection, neo4j_db)
+    set_up(t, TraitsKey("1"), TraitsKey("2"), TraitsKey('t1'), 8, 0, 1, 1, 2030, 1, 1, 2030)
+    trip = t.search_connections(TraitsKey("1"), TraitsKey("2"), 1, 1, 2030)[0][0]
+    t.add_user("user@example.com", None)
+    for _ in range(5):
+        t.buy_ticket("user@example.com", trip, also_reserve_seats=False)
+
+    # Tickets bought in the same second are ordered by ticket_id
+    history = t.get_purchase_history("user@example.com")
+    assert [row[1] for row in history] == [5, 4, 3, 2, 1]
+    page, after = t.get_purchase_history_page("user@example.com", limit=2)
+    assert page == history[:2] and after == (history[1][0], 4)
+    page, after = t.get_purchase_history_page("user@example.com", limit=2, after=after)
+    assert page == history[2:4]
+    page, after = t.get_purchase_history_page("user@example.com", limit=2, after=after)
+    assert page == history[4:] and after is None
+    assert list(t.iter_purchase_history("user@example.com", chunk_size=2)) == history
+    assert t.get_purchase_history_page("unknown@example.com") == ([], None)
+
+    cursor = rdbms_admin_connection.cursor(dictionary=True)
+    plan = explain(cursor, PURCHASE_HISTORY_QUERY.format(after=""), (1,), "tk")
+    assert plan["key"] == "ticket_user_booking"
+
+def test_journey_history(rdbms_connection, rdbms_admin_connection, neo4j_db):
+    from datetime import datetime
+
+    t = Traits(rdbms_connection, rdbms_admin_connection, neo4j_db)
+    for station in ("1", "2", "3"):
+        t.add_train_station(TraitsKey(station), None)
+    t.connect_train_stations(TraitsKey("1"), TraitsKey("2"), 40)
+    t.connect_train_stations(TraitsKey("2"), TraitsKey("3"), 20)
+    t.add_train(TraitsKey('t1'), train_capacity=5, train_status=TrainStatus.OPERATIONAL)
+    t.add_train(TraitsKey('t2'), train_capacity=5, train_status=TrainStatus.OPERATIONAL)
+    t.add_schedule(TraitsKey('t1'), 8, 0, [(TraitsKey("1"), 5), (TraitsKey("2"), 10)], 1, 1, 2030, 1, 1, 2030)
+    t.add_schedule(TraitsKey('t2'), 9, 0, [(TraitsKey("2"), 5), (TraitsKey("3"), 10)], 1, 1, 2030, 1, 1, 2030)
+    route = t.search_connections(TraitsKey("1"), TraitsKey("3"), 1, 1, 2030)[0]
+    t.add_user("user@example.com", None)
+    t.add_user("user2@example.com", None)
+
+    t.buy_ticket("user@example.com", route, also_reserve_seats=True)
+    t.buy_tickets([("user@example.com", route[0], False), ("user2@example.com", route, True)])
+    history = t.get_journey_history("user@example.com")
+    # Newest first: (journey_id, booked_at, total_price, departure, arrival, legs, reserved_seats)
+    assert [row[0] for row in history] == [2, 1]
+    assert history[1][2:] == (22 + 12, datetime(2030, 1, 1, 8, 0), datetime(2030, 1, 1, 9, 20), 2, 2)
+    assert history[0][2:] == (22, datetime(2030, 1, 1, 8, 0), datetime(2030, 1, 1, 8, 40), 1, 0)
+    assert [row[2] for row in t.get_journey_history("user2@example.com")] == [34]
+    assert t.get_journey_history("unknown@example.com") == []
+
+    # Cancelled legs are taken out of the totals, fully cancelled journeys are left out
+    t.delete_train(TraitsKey('t1'))
+    assert [row[2:] for row in t.get_journey_history("user@example.com")] == [
+        (12, datetime(2030, 1, 1, 9, 0), datetime(2030, 1, 1, 9, 20), 1, 1)]
+
+def test_streaming_exports(rdbms_connection, rdbms_admin_connection, neo4j_db):
+    import csv
+    import io
+
+    t = Traits(rdbms_connection, rdbms_admin_connection, neo4j_db)
+    set_up(t, TraitsKey("1"), TraitsKey("2"), TraitsKey('t1'), 8, 0, 1, 1, 2030, 10, 1, 2030)
+    for i in range(5):
+        t.add_user(f"user{i}@example.com", None)
+
+    assert list(t.utility.iter_users(batch_size=2)) == t.utility.get_all_users()
+    assert list(t.utility.iter_schedules(batch_size=2)) == t.utility.get_all_schedules()
+    # A generator closed early leaves the rest of the result to the caller
+    users = t.utility.iter_users(batch_size=2)
+    next(users)
+    with pytest.raises(RuntimeError):
+        users.close()
+    rdbms_admin_connection.consume_results()
+    assert len(t.utility.get_all_users()) == 5
+
+    file = io.StringIO()
+    assert t.utility.export_users(file, batch_size=2) == 5
+    rows = list(csv.reader(io.StringIO(file.getvalue())))
+    assert rows[0] == ["user_id", "details", "email"] and rows[1][2] == "user0@example.com"
+    file = io.StringIO()
+    assert t.utility.export_schedules(file) == 1
+
+def test_pooled_streaming_closed_early(mariadb, mariadb_host, mariadb_port, neo4j_db, neo4j_db_host, neo4j_db_port):
+    t = Traits.from_settings(host=mariadb_host, port=int(mariadb_port), neo4j_uri=f"neo4j://{neo4j_db_host}:{neo4j_db_port}", pool_size=1)
+    try:
+        for i in range(5):
+            t.add_user(f"user{i}@example.com", None)
+        # The stream has a connection of its own, dropped when closed early
+        users = t.utility.iter_users(batch_size=2)
+        next(users)
+        users.close()
+        assert t.pools[1]._created == 0
+        assert len(t.utility.get_all_users()) == 5
+        assert len(list(t.utility.iter_users(batch_size=2))) == 5
+        assert t.pools[1]._created == 1
+    finally:
+        t.close()
+
+def test_gtfs_import(rdbms_connection, rdbms_admin_connection, neo4j_db, tmp_path):
+    from datetime import timedelta
+    from traits.gtfs import import_gtfs
+
+    feed = {
+        "stops.txt": "stop_id,stop_name,location_type\nA,Alpha,0\nB,Beta,\nC,Gamma,0\nP,Parent,1\n",
+        "routes.txt": "route_id,route_short_name,route_type\nR1,R1,2\n",
+        "trips.txt": "route_id,service_id,trip_id\nR1,WK,T1\nR1,WK,T2\nR1,XX,T3\n",
+        "calendar.txt": "service_id,monday,tuesday,wednesday,thursday,friday,saturday,sunday,start_date,end_date\n"
+                        "WK,1,1,1,1,1,0,0,20300101,20300107\n",
+        "calendar_dates.txt": "service_id,date,exception_type\nWK,20300102,2\n",
+        "stop_times.txt": "trip_id,arrival_time,departure_time,stop_id,stop_sequence\n"
+                          "T1,08:00:00,08:00:00,A,1\nT1,08:20:00,08:22:00,B,2\nT1,08:50:00,08:50:00,C,3\n"
+                          "T2,10:25:00,10:25:00,B,2\nT2,10:00:00,10:00:00,A,1\nT2,10:55:00,10:55:00,C,3\n"
+                          "T3,11:00:00,11:00:00,A,1\nT3,11:20:00,11:20:00,B,2\n",
+    }
+    for name, content in feed.items():
+        (tmp_path / name).write_text(content)
+
+    t = Traits(rdbms_connection, rdbms_admin_connection, neo4j_db)
+    progress = []
+    report = import_gtfs(t, str(tmp_path), batch_size=2, progress=lambda stage, count: progress.append((stage, count)))
+    assert (report.stations, report.connections, report.trains, report.schedules) == (3, 2, 2, 2)
+    assert report.errors == [("trips.txt", "T3", "unknown_service")]
+    assert ("schedules", 3) in progress
+
+    # 2 trains x 2 legs x 4 weekdays (the 2nd is removed)
+    cursor = rdbms_admin_connection.cursor()
+    cursor.execute("SELECT COUNT(*) FROM Trips")
+    assert cursor.fetchone()[0] == 16
+    route = t.search_connections(TraitsKey("A"), TraitsKey("C"), 2, 1, 2030)[0]
+    assert str(route[0][4]) == "2030-01-03" and route[0][5] == timedelta(hours=8)
+
+def test_gtfs_import_rejected_schedule(rdbms_connection, rdbms_admin_connection, neo4j_db, tmp_path):
+    from traits.gtfs import import_gtfs
+
+    # Z is not a stop, the schedule of T2 is rejected after its train was added
+    feed = {
+        "stops.txt": "stop_id,stop_name\nA,Alpha\nB,Beta\n",
+        "routes.txt": "route_id,route_short_name,route_type\nR1,R1,2\n",
+        "trips.txt": "route_id,service_id,trip_id\nR1,WK,T1\nR1,WK,T2\n",
+        "calendar.txt": "service_id,monday,tuesday,wednesday,thursday,friday,saturday,sunday,start_date,end_date\n"
+                        "WK,1,1,1,1,1,0,0,20300101,20300107\n",
+        "stop_times.txt": "trip_id,arrival_time,departure_time,stop_id,stop_sequence\n"
+                          "T1,08:00:00,08:00:00,A,1\nT1,08:20:00,08:20:00,B,2\n"
+                          "T2,09:00:00,09:00:00,A,1\nT2,09:20:00,09:20:00,Z,2\n",
+    }
+    for name, content in feed.items():
+        (tmp_path / name).write_text(content)
+
+    t = Traits(rdbms_connection, rdbms_admin_connection, neo4j_db)
+    report = import_gtfs(t, str(tmp_path))
+    assert (report.stations, report.connections, report.trains, report.schedules) == (2, 1, 1, 1)
+    assert report.errors == [("stop_times.txt", "A-Z", "unknown_station"), ("trips.txt", "T2", "unknown_station")]
+
+    # No train is left without its schedule
+    cursor = rdbms_admin_connection.cursor()
+    cursor.execute("SELECT train_name FROM Trains")
+    assert cursor.fetchall() == [("T1",)]
+
+def test_bulk_admin(rdbms_connection, rdbms_admin_connection, neo4j_db):
+    t = Traits(rdbms_connection, rdbms_admin_connection, neo4j_db)
+    t.add_train_station(TraitsKey("1"), None)
+    assert t.add_train_stations([(TraitsKey("1"), None), (TraitsKey("2"), "two"), (TraitsKey("3"), None),
+                                 (TraitsKey("2"), None)]) == ["exists", None, None, "duplicate"]
+    records, _, _ = neo4j_db.execute_query("MATCH (s:Station) RETURN s.name AS name ORDER BY name")
+    assert [record["name"] for record in records] == ["1", "2", "3"]
+
+    t.connect_train_stations(TraitsKey("1"), TraitsKey("2"), 10)
+    assert t.connect_many_train_stations([
+        (TraitsKey("2"), TraitsKey("1"), 10),    # already connected the other way
+        (TraitsKey("2"), TraitsKey("3"), 20),
+        (TraitsKey("3"), TraitsKey("2"), 20),    # same pair in the batch
+        (TraitsKey("1"), TraitsKey("4"), 20),
+        (TraitsKey("1"), TraitsKey("3"), 61),
+        (TraitsKey("1"), TraitsKey("1"), 5),
+    ]) == ["exists", None, "duplicate", "unknown_station", "invalid_travel_time", "same_station"]
+    cursor = rdbms_admin_connection.cursor()
+    cursor.execute("SELECT COUNT(*) FROM Connections")
+    assert cursor.fetchone()[0] == 4
+
+    t.add_train(TraitsKey("t1"), train_capacity=3, train_status=TrainStatus.OPERATIONAL)
+    assert t.add_trains([(TraitsKey("t1"), 5, TrainStatus.OPERATIONAL), (TraitsKey("t2"), 5, TrainStatus.DELAYED),
+                         (TraitsKey("t2"), 5, TrainStatus.OPERATIONAL)]) == ["exists", None, "duplicate"]
+    assert t.get_train_current_status(TraitsKey("t2")) == TrainStatus.DELAYED
+    # The bulk objects are usable like the others
+    t.add_schedule(TraitsKey("t2"), 8, 0, [(TraitsKey("1"), 5), (TraitsKey("2"), 5), (TraitsKey("3"), 10)], 1, 1, 2030, 1, 1, 2030)
+    assert len(t.search_connections(TraitsKey("1"), TraitsKey("3"), 1, 1, 2030)) == 1
+
+
+def test_connection_search_labels():
+    from datetime import date, datetime, timedelta
+    from traits.routing import ConnectionSearch, Leg
+
+    def grid(size):
+        # Every station has an hourly departure to each of its neighbours
+        legs = []
+        for x in range(size):
+            for y in range(size):
+                for nx, ny in ((x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)):
+                    if 0 <= nx < size and 0 <= ny < size:
+                        for hour in range(5, 23):
+                            departure = datetime(2030, 1, 1, hour, (x * 7 + y * 3) % 30)
+                            legs.append(Leg(f"{x},{y}", f"{nx},{ny}", departure, departure + timedelta(minutes=20), 20, {}))
+
+        def load_legs(day):
+            shift = day - date(2030, 1, 1)
+            return [leg._replace(departure=leg.departure + shift, arrival=leg.arrival + shift) for leg in legs]
+        return load_legs
+
+    days = [date(2030, 1, 1) + timedelta(days=i) for i in range(30)]
+    search = ConnectionSearch("0,0", "7,7", datetime(2030, 1, 1), limit=3)
+    routes = search.run(days, grid(8), min_travel_time=280, min_legs=14)
+    assert [route["overallTravelTime"] for route in routes] == [280, 280, 280]
+    assert all(route["numberOfTrains"] == 14 for route in routes)
+
+    # Price has no bound, only the days of the horizon are scanned
+    loaded = []
+    load_legs = grid(4)
+    search = ConnectionSearch("0,0", "3,3", datetime(2030, 1, 1), sort_by=SortingCriteria.ESTIMATED_PRICE, limit=3, horizon_days=2)
+    routes = search.run(days, lambda day: loaded.append(day) or load_legs(day))
+    assert len(routes) == 3
+    assert loaded == days[:2]
+
+    # The labels reaching W through X cannot continue to X: the one of S-X-W must not be dropped for them
+    def leg(start, end, departure, arrival):
+        departure, arrival = datetime(2030, 1, 1, *departure), datetime(2030, 1, 1, *arrival)
+        return Leg(start, end, departure, arrival, int((arrival - departure).total_seconds() // 60), {"stations": start + end})
+
+    legs = [leg("S", "W", (8, 0), (8, 10)), leg("W", "X", (8, 10), (8, 20)), leg("S", "W", (8, 1), (8, 11)),
+            leg("W", "X", (8, 11), (8, 21)), leg("S", "X", (8, 25), (8, 30)), leg("X", "W", (8, 40), (8, 50)),
+            leg("W", "E", (9, 0), (9, 10))]
+    for limit in (1, 5):
+        search = ConnectionSearch("S", "E", datetime(2030, 1, 1), sort_by=SortingCriteria.OVERALL_WAITING_TIME, limit=limit)
+        routes = search.run(days[:1], lambda day: legs)
+        assert routes[0]["totalWaitingTime"] == 525
+        assert [relation["stations"] for relation in routes[0]["relations"]] == ["SX", "XW", "WE"]
+
+
+def test_search_horizon(rdbms_connection, rdbms_admin_connection, neo4j_db):
+    t = Traits(rdbms_connection, rdbms_admin_connection, neo4j_db)
+    set_up(t, TraitsKey("1"), TraitsKey("2"), TraitsKey('t1'), 8, 0, 1, 1, 2030, 10, 1, 2030)
+
+    # Price has no bound, every day is searched unless a horizon is given
+    assert len(t.search_connections(TraitsKey("1"), TraitsKey("2"), 1, 1, 2030, sort_by=SortingCriteria.ESTIMATED_PRICE)) == 5
+    routes = t.search_connections(TraitsKey("1"), TraitsKey("2"), 1, 1, 2030, sort_by=SortingCriteria.ESTIMATED_PRICE, horizon_days=2)
+    assert [str(route[0][4]) for route in routes] == ["2030-01-01", "2030-01-02"]
+    routes = t.search_connections(TraitsKey("1"), TraitsKey("2"), 3, 1, 2030, is_departure_time=False, horizon_days=1)
+    assert [str(route[0][4]) for route in routes] == ["2030-01-03"]
+    with pytest.raises(ValueError):
+        t.search_connections(TraitsKey("1"), TraitsKey("2"), 1, 1, 2030, horizon_days=0)
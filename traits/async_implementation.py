@@ -0,0 +1,285 @@
+import asyncio
+from datetime import date, datetime, time, timedelta
+from typing import Dict, List, Optional, Tuple
+from traits.interface import TraitsKey, TrainStatus, SortingCriteria
+from traits.interface import BASE_USER_NAME, BASE_USER_PASS
+from traits.implementation import Traits, ScheduleSpec, PurchaseOutcome, SEARCH_DAYS_QUERIES, DAY_LEGS_QUERY, \
+    PURCHASE_HISTORY_QUERY, purchase_history_page, purchase_history_page_query, purchase_statements, search_travel_time
+from traits.routing import ConnectionSearch, Leg, corridor_stations, static_lower_bounds
+from traits.pool import AsyncConnectionPool
+from traits.service_patterns import ServicePattern
+
+
+async def execute_statements(cursor, statements):
+    """
+    Async counterpart of traits.implementation.execute_statements
+    """
+    try:
+        query, params, fetch = next(statements)
+        while True:
+            await cursor.execute(query, params)
+            query, params, fetch = statements.send((cursor.lastrowid, cursor.rowcount, await cursor.fetchall() if fetch else None))
+    except StopIteration as stop:
+        return stop.value
+
+
+class AsyncTraits:
+    """
+    asyncio version of the Traits API for async frontends, on top of mysql.connector.aio
+    and the async Neo4j driver. Concurrent calls use connections from a bounded pool.
+
+    search_connections, get_train_current_status, buy_ticket, get_purchase_history and
+    get_purchase_history_page are natively async. The admin methods, the bulk methods,
+    buy_tickets and get_journey_history are rare and run on the wrapped synchronous Traits in
+    a worker thread, so the schedule and trip generation logic exists only once.
+    The streaming reads (iter_purchase_history) and the enable_*/load_timetable_snapshot
+    settings are not mirrored: they are used on `traits` directly.
+    """
+
+    def __init__(self, base_pool: AsyncConnectionPool, neo4j_driver, traits: Traits) -> None:
+        self.base_pool = base_pool
+        self.neo4j_driver = neo4j_driver
+        self.traits = traits
+
+    @classmethod
+    async def from_settings(cls, host: str = "127.0.0.1", port: int = 3306, database: str = "test",
+                            neo4j_uri: str = "neo4j://localhost:7687", neo4j_auth=None,
+                            pool_size: int = 5, timeout: Optional[float] = None, admin_pool_size: int = 1) -> "AsyncTraits":
+        """
+        Build an AsyncTraits with a pool of `pool_size` async base connections. The wrapped Traits
+        only runs the rare synchronous methods, on pools of `admin_pool_size` connections.
+        """
+        import mysql.connector.aio
+        from neo4j import AsyncGraphDatabase
+
+        def connect(user, password):
+            return lambda: mysql.connector.aio.connect(host=host, port=port, database=database, user=user, password=password)
+
+        # Pooled, thread-safe Traits for the admin methods
+        traits = await asyncio.to_thread(Traits.from_settings, host=host, port=port, database=database,
+                                         neo4j_uri=neo4j_uri, neo4j_auth=neo4j_auth, pool_size=admin_pool_size, timeout=timeout)
+        return cls(AsyncConnectionPool(connect(BASE_USER_NAME, BASE_USER_PASS), pool_size, timeout),
+                   AsyncGraphDatabase.driver(neo4j_uri, auth=neo4j_auth, max_connection_pool_size=pool_size),
+                   traits)
+
+    async def close(self) -> None:
+        await self.base_pool.close()
+        await self.neo4j_driver.close()
+        await asyncio.to_thread(self.traits.close)
+
+    async def _fetchall(self, pool: AsyncConnectionPool, query: str, params: Tuple = ()) -> List:
+        async with pool.connection() as connection:
+            cursor = await connection.cursor()
+            await cursor.execute(query, params)
+            rows = await cursor.fetchall()
+            await cursor.close()
+        return rows
+
+    async def _check_stations(self, starting_station: str, ending_station: str) -> None:
+        rows = await self._fetchall(self.base_pool, "SELECT COUNT(DISTINCT name) FROM Stations WHERE name IN (%s, %s)",
+                                    (starting_station, ending_station))
+        if rows[0][0] != 2:
+            raise ValueError
+
+    async def _static_lower_bounds(self, starting_station: str, ending_station: str):
+        """
+        Lower bounds of the search and the stations on a path from start to end
+        """
+        edges = await self._fetchall(self.base_pool, """
+            SELECT s1.name, s2.name, c.travel_time FROM Connections c
+            JOIN Stations s1 ON c.starting_station_id = s1.station_id
+            JOIN Stations s2 ON c.ending_station_id = s2.station_id
+            """)
+        return static_lower_bounds(edges, starting_station, ending_station), list(corridor_stations(edges, starting_station, ending_station))
+
+    async def _search_days(self, starting_station: str, ending_station: str, travel_time: datetime, is_departure_time) -> List:
+        async with self.neo4j_driver.session() as session:
+            result = await session.run(SEARCH_DAYS_QUERIES[bool(is_departure_time)], start_station=starting_station,
+                                       end_station=ending_station, travel_time=travel_time)
+            return [record["day"].to_native() async for record in result]
+
+    async def _load_legs(self, session, day, stations: List[str]) -> List[Leg]:
+        result = await session.run(DAY_LEGS_QUERY, day_start=datetime.combine(day, time.min),
+                                   day_end=datetime.combine(day + timedelta(days=1), time.min), stations=stations)
+        return [Leg(record["start"], record["end"], record["relation"]["departure_time"].to_native(),
+                    record["relation"]["arrival_time"].to_native(), record["relation"]["travel_time"], record["relation"])
+                async for record in result]
+
+    async def _fetch_trips(self, trip_ids: List[int]) -> Dict[int, Tuple]:
+        placeholders = ", ".join(["%s"] * len(trip_ids))
+        rows = await self._fetchall(self.base_pool, f"""
+            SELECT trip_id, train_id, starting_station_id, ending_station_id, date, start_time, end_time
+            FROM Trips WHERE trip_id IN ({placeholders})""", tuple(trip_ids))
+        return {row[0]: row for row in rows}
+
+    async def search_connections(self, starting_station_key: TraitsKey, ending_station_key: TraitsKey,
+                                 travel_time_day: int = None, travel_time_month: int = None, travel_time_year: int = None,
+                                 is_departure_time=True,
+                                 sort_by: SortingCriteria = SortingCriteria.OVERALL_TRAVEL_TIME, is_ascending: bool = True,
+                                 limit: int = 5, horizon_days: Optional[int] = None) -> List:
+        """
+        Same results as Traits.search_connections, through the search cache of the wrapped Traits. With a
+        timetable snapshot or lazy_trips the wrapped Traits searches in a worker thread. On the trip graph
+        the station check, the lower bounds and the days query run concurrently, and the Trips rows of the
+        routes found so far are fetched from MariaDB while the legs of the next day are loaded from Neo4j.
+        """
+        starting_station, ending_station = starting_station_key.to_string(), ending_station_key.to_string()
+        if starting_station == ending_station:
+            raise ValueError
+        if horizon_days is not None and horizon_days < 1:
+            raise ValueError
+        args = (starting_station_key, ending_station_key, travel_time_day, travel_time_month, travel_time_year,
+                is_departure_time, sort_by, is_ascending, limit, horizon_days)
+        if self.traits.snapshot is not None or self.traits.lazy_trips:
+            # The timetable snapshot and the schedule legs are searched by the synchronous Traits
+            return await asyncio.to_thread(self.traits.search_connections, *args)
+        cache_key = self.traits._search_cache_key(*args)
+        if cache_key is not None:
+            routes = self.traits.search_cache.get(cache_key)
+            if routes is not None:
+                return routes
+        routes = await self._search_trip_graph(starting_station, ending_station, travel_time_day, travel_time_month, travel_time_year,
+                                               is_departure_time, sort_by, is_ascending, limit, horizon_days)
+        if cache_key is not None:
+            self.traits.search_cache.put(cache_key, routes)
+        return routes
+
+    async def _search_trip_graph(self, starting_station: str, ending_station: str,
+                                 travel_time_day, travel_time_month, travel_time_year,
+                                 is_departure_time, sort_by, is_ascending, limit, horizon_days=None) -> List:
+        travel_time = search_travel_time(travel_time_day, travel_time_month, travel_time_year, is_departure_time)
+        _, ((min_travel_time, min_legs), stations), days = await asyncio.gather(
+            self._check_stations(starting_station, ending_station),
+            self._static_lower_bounds(starting_station, ending_station),
+            self._search_days(starting_station, ending_station, travel_time, is_departure_time))
+        search = ConnectionSearch(starting_station, ending_station, travel_time, is_departure_time, sort_by, is_ascending, limit,
+                                  horizon_days)
+        if min_travel_time is None or (limit is not None and limit <= 0):
+            return []
+
+        results = []
+        requested = set()
+        hydration = []
+        try:
+            async with self.neo4j_driver.session() as session:
+                for day_index, day in enumerate(days):
+                    if search.settled(results, day, min_travel_time, min_legs):
+                        break
+                    search.add_day(results, day_index, await self._load_legs(session, day, stations))
+                    trip_ids = [leg.relation["trip_id"] for result in results for leg in result[3]
+                                if leg.relation["trip_id"] not in requested]
+                    if trip_ids:
+                        requested.update(trip_ids)
+                        hydration.append(asyncio.create_task(self._fetch_trips(list(dict.fromkeys(trip_ids)))))
+            trips = {}
+            for rows in await asyncio.gather(*hydration):
+                trips.update(rows)
+        except BaseException:
+            for task in hydration:
+                task.cancel()
+            raise
+        # Trips deleted from MariaDB (e.g. by delete_train) are skipped
+        return [[trips[connect["trip_id"]] for connect in route["relations"] if connect["trip_id"] in trips]
+                for route in search.finish(results)]
+
+    async def get_train_current_status(self, train_key: TraitsKey) -> Optional[TrainStatus]:
+        rows = await self._fetchall(self.base_pool, "SELECT t.status FROM Trains t WHERE t.train_name = %s;", (train_key.to_string(),))
+        return TrainStatus(rows[0][0]) if rows else None
+
+    async def buy_ticket(self, user_email: str, connection, also_reserve_seats=True):
+        """
+        Same semantics as Traits.buy_ticket: a single trip or a whole route, all legs or none
+        """
+        is_route, legs = Traits._connection_legs(connection)
+        if not legs:
+            raise ValueError
+        trip_ids = []
+        for leg in legs:
+            # Trips generated from a schedule (lazy_trips) are stored before booking
+            trip_ids.append(leg[0] if leg[0] is not None else await asyncio.to_thread(self.traits.utility.materialize_trip, leg))
+
+        async with self.base_pool.connection() as rdbms_connection:
+            cursor = await rdbms_connection.cursor()
+            await cursor.execute("SELECT * FROM Users WHERE email = %s;", (user_email,))
+            user = await cursor.fetchone()
+            if not user:
+                raise ValueError
+            try:
+                result = await execute_statements(cursor, purchase_statements(user[0], trip_ids, also_reserve_seats, is_route))
+                await rdbms_connection.commit()
+            except Exception as e:
+                await rdbms_connection.rollback()
+                raise e
+        return result
+
+    async def get_purchase_history(self, user_email: str) -> List:
+        users = await self._fetchall(self.base_pool, "SELECT user_id FROM Users WHERE email = %s;", (user_email,))
+        if not users:
+            return []
+        return await self._fetchall(self.base_pool, PURCHASE_HISTORY_QUERY.format(after=""), (users[0][0],))
+
+    async def get_purchase_history_page(self, user_email: str, limit: int = 100,
+                                        after: Optional[Tuple[datetime, int]] = None) -> Tuple[List, Optional[Tuple[datetime, int]]]:
+        if limit < 1:
+            raise ValueError
+        users = await self._fetchall(self.base_pool, "SELECT user_id FROM Users WHERE email = %s;", (user_email,))
+        if not users:
+            return [], None
+        return purchase_history_page(await self._fetchall(self.base_pool, *purchase_history_page_query(users[0][0], limit, after)), limit)
+
+    async def _admin(self, name: str, *args, **kwargs):
+        return await asyncio.to_thread(getattr(self.traits, name), *args, **kwargs)
+
+    async def buy_tickets(self, purchases: List[Tuple[str, object, bool]]) -> List[Tuple[PurchaseOutcome, List[int]]]:
+        return await self._admin("buy_tickets", purchases)
+
+    async def get_journey_history(self, user_email: str) -> List:
+        return await self._admin("get_journey_history", user_email)
+
+    async def add_user(self, user_email: str, user_details) -> None:
+        await self._admin("add_user", user_email, user_details)
+
+    async def delete_user(self, user_email: str) -> None:
+        await self._admin("delete_user", user_email)
+
+    async def add_train(self, train_key: TraitsKey, train_capacity: int, train_status: TrainStatus) -> None:
+        await self._admin("add_train", train_key, train_capacity, train_status)
+
+    async def update_train_details(self, train_key: TraitsKey, train_capacity: Optional[int] = None,
+                                   train_status: Optional[TrainStatus] = None) -> None:
+        await self._admin("update_train_details", train_key, train_capacity, train_status)
+
+    async def delete_train(self, train_key: TraitsKey) -> None:
+        await self._admin("delete_train", train_key)
+
+    async def add_train_station(self, train_station_key: TraitsKey, train_station_details) -> None:
+        await self._admin("add_train_station", train_station_key, train_station_details)
+
+    async def connect_train_stations(self, starting_train_station_key: TraitsKey, ending_train_station_key: TraitsKey,
+                                     travel_time_in_minutes: int) -> None:
+        await self._admin("connect_train_stations", starting_train_station_key, ending_train_station_key, travel_time_in_minutes)
+
+    async def add_schedule(self, train_key: TraitsKey,
+                           starting_hours_24_h: int, starting_minutes: int,
+                           stops: List[Tuple[TraitsKey, int]],
+                           valid_from_day: int, valid_from_month: int, valid_from_year: int,
+                           valid_until_day: int, valid_until_month: int, valid_until_year: int,
+                           service: Optional[ServicePattern] = None) -> None:
+        await self._admin("add_schedule", train_key, starting_hours_24_h, starting_minutes, stops,
+                          valid_from_day, valid_from_month, valid_from_year,
+                          valid_until_day, valid_until_month, valid_until_year, service)
+
+    async def add_schedules(self, schedules: List[ScheduleSpec], chunk_size: int = 1000) -> List[Optional[str]]:
+        return await self._admin("add_schedules", schedules, chunk_size)
+
+    async def add_holiday_calendar(self, name: str, dates: List[date]) -> None:
+        await self._admin("add_holiday_calendar", name, dates)
+
+    async def add_trains(self, trains: List[Tuple[TraitsKey, int, TrainStatus]]) -> List[Optional[str]]:
+        return await self._admin("add_trains", trains)
+
+    async def add_train_stations(self, stations: List[Tuple[TraitsKey, object]]) -> List[Optional[str]]:
+        return await self._admin("add_train_stations", stations)
+
+    async def connect_many_train_stations(self, connections: List[Tuple[TraitsKey, TraitsKey, int]]) -> List[Optional[str]]:
+        return await self._admin("connect_many_train_stations", connections)
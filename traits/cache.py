@@ -0,0 +1,116 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+from typing import Dict, List, Optional, Set, Tuple
+
+
+def _routes_size(routes: List) -> int:
+    """
+    Approximate memory used by a list of routes (lists of Trips rows)
+    """
+    size = sys.getsizeof(routes)
+    for route in routes:
+        size += sys.getsizeof(route)
+        for row in route:
+            size += sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row)
+    return size
+
+
+class SearchCache:
+    """
+    LRU cache of search_connections results, bounded by number of entries, approximate
+    memory and age. Keys are (start, end, date, is_departure_time, sort_by, is_ascending, limit, horizon_days).
+
+    Invalidation is targeted: a new schedule only drops the searches whose days and stations
+    it can affect, a train change only drops the searches whose routes use that train.
+    """
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 16 * 1024 * 1024, ttl: Optional[float] = 300) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: "OrderedDict[Tuple, Tuple[float, int, List]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key: Tuple) -> Optional[List]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if self.ttl is not None and time.monotonic() - entry[0] > self.ttl:
+                self._drop(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return [list(route) for route in entry[2]]
+
+    def put(self, key: Tuple, routes: List) -> None:
+        routes = [list(route) for route in routes]
+        size = _routes_size(routes)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.monotonic(), size, routes)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate_schedule(self, valid_from: date, valid_until: date, starts: Set[str], ends: Set[str]) -> int:
+        """
+        Drop the searches that a schedule running from valid_from to valid_until can change:
+        departure searches on or before valid_until, arrival searches on or after valid_from,
+        starting in `starts` (stations that can reach the schedule) and ending in `ends`
+        (stations reachable from it)
+        """
+        def affected(key):
+            start, end, day, is_departure_time = key[:4]
+            in_window = day <= valid_until if is_departure_time else day >= valid_from
+            return in_window and start in starts and end in ends
+        return self._invalidate(affected)
+
+    def invalidate_train(self, train_id: int) -> int:
+        """
+        Drop the searches whose routes use the train
+        """
+        return self._invalidate(lambda key: any(row[1] == train_id for route in self._entries[key][2] for row in route))
+
+    def clear(self) -> None:
+        self._invalidate(lambda key: True)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+            }
+
+    def _invalidate(self, affected) -> int:
+        with self._lock:
+            keys = [key for key in self._entries if affected(key)]
+            for key in keys:
+                self._drop(key)
+            self.invalidations += len(keys)
+            return len(keys)
+
+    def _drop(self, key: Tuple) -> None:
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
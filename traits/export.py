@@ -0,0 +1,70 @@
+import csv
+from typing import Iterable, Iterator, Sequence, Tuple
+from traits.instrumentation import InstrumentedConnection
+from traits.pool import PooledConnection
+
+
+def stream_rows(connection, query: str, params: Tuple = (), batch_size: int = 1000, commit: bool = False) -> Iterator[Tuple]:
+    """
+    Rows of a query read with an unbuffered cursor, `batch_size` rows at a time, so the client
+    never holds more than one batch.
+    A pooled connection streams on a connection of its own taken from the pool, which starts a new
+    transaction; closing the generator early drops that connection, the server only stops sending
+    the result when the connection is closed.
+    A plain connection cannot run other statements until the generator is exhausted, `commit` ends
+    its current transaction first so that the latest rows are visible. Closing the generator early
+    raises RuntimeError, the rest of the result is still unread.
+    """
+    if batch_size < 1:
+        raise ValueError
+    target = connection.target if isinstance(connection, InstrumentedConnection) else connection
+    if not isinstance(target, PooledConnection):
+        if commit:
+            connection.commit()
+        exhausted = False
+        try:
+            yield from _fetch(connection, query, params, batch_size)
+            exhausted = True
+        finally:
+            if not exhausted and connection.unread_result:
+                raise RuntimeError("Stream closed early, the connection still has unread rows")
+        return
+
+    stream_connection = target.pool.acquire()
+    exhausted = False
+    try:
+        if target is not connection:
+            stream_connection = InstrumentedConnection(stream_connection, connection.instrumentation)
+        yield from _fetch(stream_connection, query, params, batch_size)
+        exhausted = True
+    finally:
+        if isinstance(stream_connection, InstrumentedConnection):
+            stream_connection = stream_connection.target
+        if exhausted:
+            target.pool.release(stream_connection)
+        else:
+            target.pool.discard(stream_connection)
+
+
+def _fetch(connection, query: str, params: Tuple, batch_size: int) -> Iterator[Tuple]:
+    cursor = connection.cursor(buffered=False)
+    cursor.execute(query, params)
+    rows = cursor.fetchmany(batch_size)
+    while rows:
+        yield from rows
+        rows = cursor.fetchmany(batch_size)
+    # Only an exhausted cursor can be closed without reading the rest of the result
+    cursor.close()
+
+
+def write_csv(rows: Iterable[Tuple], file, columns: Sequence[str]) -> int:
+    """
+    Write a header and the rows to an open text file, return the number of rows
+    """
+    writer = csv.writer(file)
+    writer.writerow(columns)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+    return count
@@ -0,0 +1,292 @@
+"""
+Streaming importer of GTFS-style feeds (stops.txt, routes.txt, trips.txt, stop_times.txt, calendar.txt
+and the optional calendar_dates.txt) built on the Traits admin API.
+
+The feed is mapped as follows:
+- every stop (location_type 0 or empty) is a station named after its stop_id, with stop_name as details;
+- consecutive stops of a trip are connected stations. TRAITS has one travel time per connection, so it is
+  the shortest one observed in the feed, the rest goes to the waiting time at the stops and departures
+  keep their feed times;
+- every trip is a train named after its trip_id, with one schedule following the calendar of its service.
+
+stop_times.txt is read twice (travel times, then schedules) and must be grouped by trip_id, as feeds
+usually are: only one trip is held in memory at a time. Stations, connections, trains and schedules
+are written in batches with the bulk methods of Traits.
+"""
+import csv
+import os
+from datetime import date, datetime
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from traits.interface import TraitsKey, TrainStatus
+from traits.implementation import ScheduleSpec
+from traits.service_patterns import ServicePattern
+
+WEEKDAY_COLUMNS = ("monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday")
+
+
+class ImportReport:
+    """
+    Number of created objects and the (file, id, reason) of the rejected ones
+    """
+
+    def __init__(self) -> None:
+        self.stations = 0
+        self.connections = 0
+        self.trains = 0
+        self.schedules = 0
+        self.errors: List[Tuple[str, str, str]] = []
+
+    def error(self, file: str, item: str, reason: str) -> None:
+        self.errors.append((file, item, reason))
+
+
+def read_rows(feed_dir: str, name: str) -> Iterator[Dict[str, str]]:
+    """
+    Stream the rows of a feed file as dicts, a missing file has no rows
+    """
+    path = os.path.join(feed_dir, name)
+    if not os.path.exists(path):
+        return
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        for row in csv.DictReader(f):
+            yield {key.strip(): (value or "").strip() for key, value in row.items() if key is not None}
+
+
+def parse_time(value: str) -> Optional[int]:
+    """
+    GTFS "H:MM:SS" time in minutes after the start of the service day (can exceed 24 hours)
+    """
+    if not value:
+        return None
+    hours, minutes, _ = value.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+def parse_date(value: str) -> date:
+    return datetime.strptime(value, "%Y%m%d").date()
+
+
+def read_services(feed_dir: str) -> Dict[str, Tuple[ServicePattern, date, date]]:
+    """
+    (service pattern, valid_from, valid_until) of every service_id of calendar.txt and calendar_dates.txt
+    """
+    calendars = {}
+    for row in read_rows(feed_dir, "calendar.txt"):
+        weekdays = sum(1 << day for day, column in enumerate(WEEKDAY_COLUMNS) if row.get(column) == "1")
+        calendars[row["service_id"]] = [weekdays, parse_date(row["start_date"]), parse_date(row["end_date"]), set(), set()]
+    dates_only = set()
+    for row in read_rows(feed_dir, "calendar_dates.txt"):
+        day = parse_date(row["date"])
+        if row["service_id"] not in calendars:
+            # A service defined by its dates only runs on no weekday
+            calendars[row["service_id"]] = [0, day, day, set(), set()]
+            dates_only.add(row["service_id"])
+        calendar = calendars[row["service_id"]]
+        if row["service_id"] in dates_only:
+            calendar[1], calendar[2] = min(calendar[1], day), max(calendar[2], day)
+        (calendar[3] if row["exception_type"] == "1" else calendar[4]).add(day)
+    return {service_id: (ServicePattern(weekdays, added, removed), valid_from, valid_until)
+            for service_id, (weekdays, valid_from, valid_until, added, removed) in calendars.items()}
+
+
+class GtfsImporter:
+    """
+    Load a feed directory into Traits. `progress(stage, count)` is called every `batch_size` items
+    of a stage ("stations", "travel_times", "connections", "schedules") and at its end.
+    Only the trips of routes whose route_type is in `route_types` are imported, all when None.
+    """
+
+    def __init__(self, traits, feed_dir: str, train_capacity: int = 300, batch_size: int = 500,
+                 route_types: Optional[List[str]] = None, progress: Optional[Callable[[str, int], None]] = None) -> None:
+        if batch_size < 1:
+            raise ValueError
+        self.traits = traits
+        self.feed_dir = feed_dir
+        self.train_capacity = train_capacity
+        self.batch_size = batch_size
+        self.route_types = route_types
+        self.progress = progress
+
+    def run(self) -> ImportReport:
+        report = ImportReport()
+        self._import_stations(report)
+        trips = self._read_trips()
+        travel_times = self._travel_times(trips)
+        self._import_connections(travel_times, report)
+        self._import_schedules(trips, read_services(self.feed_dir), travel_times, report)
+        return report
+
+    def _report_progress(self, stage: str, count: int, done: bool = False) -> None:
+        # The final count is not reported twice when it ends a batch
+        if self.progress is not None and (count % self.batch_size == 0) != (done and count > 0):
+            self.progress(stage, count)
+
+    def _import_stations(self, report: ImportReport) -> None:
+        count = 0
+        pending = []
+        for row in read_rows(self.feed_dir, "stops.txt"):
+            if row.get("location_type", "") not in ("", "0"):
+                # Stations grouping platforms, entrances, ...
+                continue
+            pending.append((TraitsKey(row["stop_id"]), row.get("stop_name") or None))
+            count += 1
+            if len(pending) == self.batch_size:
+                self._add_stations(pending, report)
+                pending = []
+            self._report_progress("stations", count)
+        if pending:
+            self._add_stations(pending, report)
+        self._report_progress("stations", count, done=True)
+
+    def _add_stations(self, stations: List[Tuple[TraitsKey, Optional[str]]], report: ImportReport) -> None:
+        for (station_key, _), reason in zip(stations, self.traits.add_train_stations(stations)):
+            if reason is None:
+                report.stations += 1
+            else:
+                report.error("stops.txt", station_key.to_string(), reason)
+
+    def _read_trips(self) -> Dict[str, str]:
+        """
+        service_id of every imported trip
+        """
+        route_ids = None
+        if self.route_types is not None:
+            route_ids = {row["route_id"] for row in read_rows(self.feed_dir, "routes.txt") if row.get("route_type") in self.route_types}
+        return {row["trip_id"]: row["service_id"] for row in read_rows(self.feed_dir, "trips.txt")
+                if route_ids is None or row["route_id"] in route_ids}
+
+    def _stop_times(self, trips: Dict[str, str]) -> Iterator[Tuple[str, List[Tuple[str, Optional[int], Optional[int]]]]]:
+        """
+        (trip_id, [(stop_id, arrival, departure)] in stop_sequence order) of the imported trips
+        """
+        seen = set()
+        trip_id, stops = None, []
+        for row in read_rows(self.feed_dir, "stop_times.txt"):
+            if row["trip_id"] != trip_id:
+                if trip_id in trips:
+                    yield trip_id, [stop for _, *stop in sorted(stops)]
+                trip_id, stops = row["trip_id"], []
+                if trip_id in seen:
+                    raise ValueError("stop_times.txt must be grouped by trip_id")
+                seen.add(trip_id)
+            arrival = parse_time(row.get("arrival_time") or row.get("departure_time", ""))
+            departure = parse_time(row.get("departure_time") or row.get("arrival_time", ""))
+            stops.append((int(row["stop_sequence"]), row["stop_id"], arrival, departure))
+        if trip_id in trips:
+            yield trip_id, [stop for _, *stop in sorted(stops)]
+
+    def _travel_times(self, trips: Dict[str, str]) -> Dict[Tuple[str, str], int]:
+        """
+        Shortest travel time in minutes between consecutive stops, by unordered pair of stops
+        """
+        travel_times = {}
+        count = 0
+        for _, stops in self._stop_times(trips):
+            for (a, _, departure), (b, arrival, _) in zip(stops, stops[1:]):
+                if departure is None or arrival is None or a == b:
+                    continue
+                pair = (a, b) if a < b else (b, a)
+                minutes = max(1, arrival - departure)
+                travel_times[pair] = min(travel_times.get(pair, minutes), minutes)
+            count += 1
+            self._report_progress("travel_times", count)
+        self._report_progress("travel_times", count, done=True)
+        return travel_times
+
+    def _import_connections(self, travel_times: Dict[Tuple[str, str], int], report: ImportReport) -> None:
+        pairs = list(travel_times.items())
+        for i in range(0, len(pairs), self.batch_size):
+            batch = pairs[i:i + self.batch_size]
+            # More than 60 minutes between two stops is rejected
+            results = self.traits.connect_many_train_stations([(TraitsKey(a), TraitsKey(b), minutes) for (a, b), minutes in batch])
+            for ((a, b), _), reason in zip(batch, results):
+                if reason is None:
+                    report.connections += 1
+                else:
+                    report.error("stop_times.txt", f"{a}-{b}", reason)
+            self._report_progress("connections", i + len(batch))
+        self._report_progress("connections", len(pairs), done=True)
+
+    def _schedule(self, trip_id: str, stops: List, service: Optional[Tuple], travel_times: Dict) -> Tuple[Optional[ScheduleSpec], Optional[str]]:
+        """
+        The schedule of a trip, or the reason why it cannot be imported
+        """
+        if service is None:
+            return None, "unknown_service"
+        if len(stops) < 2 or any(a == b for (a, _, _), (b, _, _) in zip(stops, stops[1:])):
+            return None, "invalid_stops"
+        if any(arrival is None or departure is None for _, arrival, departure in stops):
+            return None, "untimed_stop"
+        clock = stops[0][2]
+        if clock >= 24 * 60:
+            return None, "after_midnight"
+        schedule_stops = [(TraitsKey(stops[0][0]), 0)]
+        for (a, _, _), (b, _, departure) in zip(stops, stops[1:]):
+            minutes = travel_times.get((a, b) if a < b else (b, a))
+            if minutes is None or minutes > 60:
+                return None, "not_connected"
+            clock += minutes
+            # Waiting time up to the feed departure, the connection may be faster than this trip
+            waiting_time = max(0, departure - clock)
+            clock += waiting_time
+            schedule_stops.append((TraitsKey(b), waiting_time))
+        schedule_stops[-1] = (schedule_stops[-1][0], max(10, schedule_stops[-1][1]))
+        pattern, valid_from, valid_until = service
+        hours, minutes = divmod(stops[0][2], 60)
+        return ScheduleSpec(TraitsKey(trip_id), hours, minutes, schedule_stops, valid_from, valid_until, pattern), None
+
+    def _import_schedules(self, trips: Dict[str, str], services: Dict, travel_times: Dict, report: ImportReport) -> None:
+        pending = []
+        count = 0
+        for trip_id, stops in self._stop_times(trips):
+            spec, reason = self._schedule(trip_id, stops, services.get(trips[trip_id]), travel_times)
+            if reason is not None:
+                report.error("trips.txt", trip_id, reason)
+            else:
+                pending.append(spec)
+            if len(pending) == self.batch_size:
+                self._flush(pending, report)
+                pending = []
+            count += 1
+            self._report_progress("schedules", count)
+        if pending:
+            self._flush(pending, report)
+        self._report_progress("schedules", count, done=True)
+
+    def _flush(self, specs: List[ScheduleSpec], report: ImportReport) -> None:
+        created = []
+        results = self.traits.add_trains([(spec.train_key, self.train_capacity, TrainStatus.OPERATIONAL) for spec in specs])
+        for spec, reason in zip(specs, results):
+            if reason is None:
+                created.append(spec)
+            else:
+                report.error("trips.txt", spec.train_key.to_string(), reason)
+        try:
+            results = self.traits.add_schedules(created)
+        except Exception:
+            self._discard_trains(created)
+            raise
+        # Every trip is a train of its own, its train is dropped with a rejected schedule
+        rejected = []
+        for spec, reason in zip(created, results):
+            if reason is None:
+                report.trains += 1
+                report.schedules += 1
+            else:
+                report.error("trips.txt", spec.train_key.to_string(), reason)
+                rejected.append(spec)
+        self._discard_trains(rejected)
+
+    def _discard_trains(self, specs: List[ScheduleSpec]) -> None:
+        """
+        Drop the trains created by _flush for schedules that were not imported
+        """
+        for spec in specs:
+            self.traits.delete_train(spec.train_key)
+
+
+def import_gtfs(traits, feed_dir: str, **kwargs) -> ImportReport:
+    """
+    Import a GTFS feed directory, see GtfsImporter for the options
+    """
+    return GtfsImporter(traits, feed_dir, **kwargs).run()
@@ -1,12 +1,208 @@
-from typing import List, Tuple, Optional, Dict
+from typing import List, Tuple, Optional, Dict, NamedTuple
 from traits.interface import TraitsUtilityInterface, TraitsInterface, TraitsKey, TrainStatus, SortingCriteria
 from traits.interface import BASE_USER_NAME, BASE_USER_PASS, ADMIN_USER_NAME, ADMIN_USER_PASS
+from traits.routing import ConnectionSearch, Leg, corridor_stations, reachable_stations, static_lower_bounds
+from traits.cache import SearchCache
+from traits.snapshot import TimetableSnapshot
+from traits.schedules import ScheduleIndex
+from traits.service_patterns import ServicePattern, EVERY_DAY
+from traits.pool import ConnectionPool, PooledConnection, pooled
+from traits.pipeline import graph_write
+from traits.export import stream_rows, write_csv
+from traits.instrumentation import Instrumentation
 from datetime import datetime, date, time, timedelta
+from contextlib import contextmanager
+from enum import Enum
+
+
+# Cypher templates of the connection search, one per direction. Only the $parameters change
+# between searches, so Neo4j parses and plans each text once and then hits its plan cache.
+# The ordering for the SortingCriteria is done by ConnectionSearch, not in Cypher.
+SEARCH_DAYS_QUERIES = {
+    # Days with departures from the starting station at or after the travel time
+    True: """
+        MATCH (:Station {name: $start_station})-[r:TRIP]->()
+        WHERE r.departure_time >= $travel_time
+        RETURN DISTINCT date(r.departure_time) AS day ORDER BY day ASC
+        """,
+    # Days with arrivals at the ending station at or before the travel time
+    False: """
+        MATCH ()-[r:TRIP]->(:Station {name: $end_station})
+        WHERE r.arrival_time <= $travel_time
+        RETURN DISTINCT date(r.arrival_time) AS day ORDER BY day DESC
+        """,
+}
+DAY_LEGS_QUERY = """
+    MATCH (a:Station)-[r:TRIP]->(b:Station)
+    WHERE r.departure_time >= $day_start AND r.departure_time < $day_end
+      AND a.name IN $stations AND b.name IN $stations
+    RETURN a.name AS start, b.name AS end, properties(r) AS relation
+    """
+
+
+def search_travel_time(travel_time_day: int, travel_time_month: int, travel_time_year: int, is_departure_time) -> datetime:
+    """
+    Reference time of a search: now when no date is given, the start of the day for departures
+    and its end for arrivals (arriving on a given day means arriving before the end of that day)
+    """
+    if not (travel_time_day or travel_time_month or travel_time_year):
+        return datetime.now().replace(microsecond=0)
+    travel_time = datetime(travel_time_year, travel_time_month, travel_time_day)
+    if not is_departure_time:
+        travel_time = datetime.combine(travel_time.date(), time(23, 59, 59))
+    return travel_time
+# Neo4j writes of add_train_station and add_schedule, tagged with the $write_id of their GraphOutbox entry
+CREATE_STATION_QUERY = """
+    MERGE (s:Station {name: $name})
+    SET s.details = $details, s.write_id = $write_id
+    """
+CREATE_STATIONS_QUERY = """
+    UNWIND $rows AS row
+    MERGE (s:Station {name: row.name})
+    SET s.details = row.details, s.write_id = $write_id
+    """
+CREATE_TRIPS_QUERY = """
+    UNWIND $rows AS row
+    MATCH (a:Station {name: row.start_station_name}), (b:Station {name: row.end_station_name})
+    CREATE (a)-[:TRIP {trip_id: row.trip_id, departure_time: row.departure_time, travel_time: row.travel_time,
+                       arrival_time: row.arrival_time, train_name: row.train_name, write_id: $write_id}]->(b)
+    """
+# Rows of the Purchase view for one user_id, newest first. Filtering on Tickets.user_id instead of
+# Users.email lets the scan follow the ticket_user_booking index; {after} is the keyset condition.
+PURCHASE_HISTORY_QUERY = """
+    SELECT tk.booking_time AS purchase_time, tk.ticket_id, u.email AS user_email,
+        s1.name AS starting_station_name, s2.name AS ending_station_name,
+        tr.start_time, tr.end_time, tk.price AS connection_price, tk.reserved_seat
+    FROM Tickets tk
+        JOIN Trips tr ON tk.trip_id = tr.trip_id
+        JOIN Stations s1 ON tr.starting_station_id = s1.station_id
+        JOIN Stations s2 ON tr.ending_station_id = s2.station_id
+        JOIN Users u ON tk.user_id = u.user_id
+    WHERE tk.user_id = %s {after}
+    ORDER BY tk.booking_time DESC, tk.ticket_id DESC
+    """
+# Columns of the exports, in table order like the SELECT * of get_all_users/get_all_schedules
+USER_COLUMNS = ("user_id", "details", "email")
+SCHEDULE_COLUMNS = ("schedule_id", "train_id", "starting_station_id", "ending_station_id", "start_time", "end_time",
+                    "valid_from", "valid_until", "weekdays", "calendar_id")
+# Totals of the Journeys rows {journeys}, run by the purchases after inserting their tickets
+JOURNEY_TOTALS_QUERY = """
+    UPDATE Journeys j JOIN (
+        SELECT tk.journey_id, SUM(tk.price) AS total_price,
+            MIN(TIMESTAMP(tr.date, tr.start_time)) AS departure, MAX(TIMESTAMP(tr.date, tr.end_time)) AS arrival,
+            COUNT(*) AS legs, SUM(tk.reserved_seat) AS reserved_seats
+        FROM Tickets tk JOIN Trips tr ON tk.trip_id = tr.trip_id
+        WHERE tk.journey_id IN ({journeys})
+        GROUP BY tk.journey_id) totals ON j.journey_id = totals.journey_id
+    SET j.total_price = totals.total_price, j.departure = totals.departure, j.arrival = totals.arrival,
+        j.legs = totals.legs, j.reserved_seats = totals.reserved_seats;
+    """
+
+
+def purchase_statements(user_id: int, trip_ids: List[int], also_reserve_seats: bool, is_route: bool):
+    """
+    Statements of buy_ticket, shared by Traits and AsyncTraits. A generator yielding (query, params, fetch)
+    that gets back (lastrowid, rowcount, rows fetched when `fetch` is set) of every statement and returns
+    the result of buy_ticket. Raise a ValueError when a leg is sold out, the caller rolls back.
+    """
+    placeholders = ", ".join(["%s"] * len(trip_ids))
+    if also_reserve_seats:
+        # The counter rows are locked by the UPDATE until commit/rollback
+        yield f"INSERT IGNORE INTO TripSeats (trip_id) VALUES {', '.join(['(%s)'] * len(trip_ids))};", tuple(trip_ids), False
+        _, rowcount, _ = yield (
+            f"""
+            UPDATE TripSeats s
+                JOIN Trips tr ON s.trip_id = tr.trip_id
+                JOIN Trains t ON tr.train_id = t.train_id
+            SET s.reserved_seats = s.reserved_seats + 1
+            WHERE s.trip_id IN ({placeholders}) AND s.reserved_seats < t.capacity;
+            """, tuple(trip_ids), False)
+        if rowcount != len(set(trip_ids)):
+            # At least one leg is sold out
+            raise ValueError
+
+    journey_id, _, _ = yield "INSERT INTO Journeys (user_id) VALUES (%s);", (user_id,), False
+    # The tickets of this purchase are the ones of its journey, whatever the concurrent purchases
+    last_id, _, _ = yield (
+        f"INSERT INTO Tickets (user_id, trip_id, journey_id, reserved_seat) VALUES {', '.join(['(%s, %s, %s, %s)'] * len(trip_ids))};",
+        tuple(value for trip_id in trip_ids for value in (user_id, trip_id, journey_id, also_reserve_seats)), False)
+    if also_reserve_seats:
+        # Insert into Reservations table
+        last_id, _, _ = yield (
+            "INSERT INTO Reservations (ticket_id) SELECT ticket_id FROM Tickets WHERE journey_id = %s ORDER BY ticket_id;",
+            (journey_id,), False)
+    # The prices are set by the calculate_total_price_before_insert trigger
+    yield JOURNEY_TOTALS_QUERY.format(journeys="%s"), (journey_id,), False
+    if not is_route:
+        return last_id
+    _, _, rows = yield "SELECT trip_id, ticket_id FROM Tickets WHERE journey_id = %s;", (journey_id,), True
+    ticket_ids = dict(rows)
+    return [ticket_ids[trip_id] for trip_id in trip_ids]
+
+
+def purchase_history_page_query(user_id: int, limit: int, after: Optional[Tuple[datetime, int]]) -> Tuple[str, Tuple]:
+    """
+    Query and parameters of a page of get_purchase_history_page, shared by Traits and AsyncTraits
+    """
+    params = (user_id,)
+    condition = ""
+    if after is not None:
+        # Keyset: strictly older than the last row of the previous page, ties broken by ticket_id
+        condition = "AND (tk.booking_time < %s OR (tk.booking_time = %s AND tk.ticket_id < %s))"
+        params += (after[0], after[0], after[1])
+    # One extra row tells whether there is a next page
+    return PURCHASE_HISTORY_QUERY.format(after=condition) + " LIMIT %s;", params + (limit + 1,)
+
+
+def purchase_history_page(records: List, limit: int) -> Tuple[List, Optional[Tuple[datetime, int]]]:
+    """
+    The page and the key of the next one from the rows of purchase_history_page_query
+    """
+    if len(records) <= limit:
+        return records, None
+    records = records[:limit]
+    return records, (records[-1][0], records[-1][1])
+
+
+def execute_statements(cursor, statements):
+    """
+    Run a statement generator such as purchase_statements on a cursor and return its result
+    """
+    try:
+        query, params, fetch = next(statements)
+        while True:
+            cursor.execute(query, params)
+            query, params, fetch = statements.send((cursor.lastrowid, cursor.rowcount, cursor.fetchall() if fetch else None))
+    except StopIteration as stop:
+        return stop.value
+
+
+class PurchaseOutcome(Enum):
+    BOOKED = 0
+    BOOKED_WITHOUT_SEAT = 1
+    REJECTED = 2
+
+
+class ScheduleSpec(NamedTuple):
+    """
+    Arguments of Traits.add_schedule, for Traits.add_schedules
+    """
+    train_key: TraitsKey
+    starting_hours_24_h: int
+    starting_minutes: int
+    stops: List[Tuple[TraitsKey, int]]  # (station_key, waiting_time)
+    valid_from: date
+    valid_until: date
+    service: Optional[ServicePattern] = None
+
+
 class TraitsUtility(TraitsUtilityInterface):
     def __init__(self, rdbms_connection, rdbms_admin_connection, neo4j_driver) -> None:
         self.rdbms_connection = rdbms_connection
         self.rdbms_admin_connection = rdbms_admin_connection
         self.neo4j_driver = neo4j_driver
+        # Pool of admin connections for the GraphOutbox entries (from_settings), see begin_graph_write
+        self.outbox_pool = None
 
     def generate_sql_initialization_code() -> List[str]:
         """
@@ -27,8 +223,11 @@ class TraitsUtility(TraitsUtilityInterface):
             );""",
             """ CREATE TABLE IF NOT EXISTS Stations (
                 station_id INTEGER PRIMARY KEY AUTO_INCREMENT,
-                name TEXT UNIQUE NOT NULL
+                name VARCHAR(255) UNIQUE NOT NULL
             );""",
+            # Indexes follow the hot access paths: Trips by (train_id, date) in delete_on_trians,
+            # Tickets by trip_id in check_available_seats, Schedules by train_id and validity
+            # in is_schedule_feasible, Connections by station ids in add_schedule
             """ CREATE TABLE IF NOT EXISTS Trips (
                 trip_id INT PRIMARY KEY AUTO_INCREMENT,
                 train_id INT NOT NULL,
@@ -37,31 +236,72 @@ class TraitsUtility(TraitsUtilityInterface):
                 date DATE NOT NULL,
                 start_time TIME NOT NULL,
                 end_time TIME NOT NULL,
+                UNIQUE KEY trip_departure (train_id, date, starting_station_id, start_time),
                 FOREIGN KEY (train_id) REFERENCES Trains(train_id),
                 FOREIGN KEY (starting_station_id) REFERENCES Stations(station_id),
                 FOREIGN KEY (ending_station_id) REFERENCES Stations(station_id)
             );""",
+            # One row per purchase (a trip or a whole route) with the totals of its tickets, maintained
+            # by buy_ticket/buy_tickets and by the delete_on_trians trigger, read by get_journey_history
+            """CREATE TABLE IF NOT EXISTS Journeys (
+                journey_id INT PRIMARY KEY AUTO_INCREMENT,
+                user_id INT NOT NULL,
+                booked_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                total_price INT NOT NULL DEFAULT 0,
+                departure DATETIME NULL,
+                arrival DATETIME NULL,
+                legs INT NOT NULL DEFAULT 0,
+                reserved_seats INT NOT NULL DEFAULT 0,
+                KEY journey_user_booking (user_id, booked_at),
+                FOREIGN KEY (user_id) REFERENCES Users(user_id) ON DELETE CASCADE
+            );""",
             """CREATE TABLE IF NOT EXISTS Tickets (
                 ticket_id INT PRIMARY KEY AUTO_INCREMENT,
                 user_id INT NOT NULL,
                 trip_id INT NOT NULL,
+                journey_id INT NULL,
                 booking_time DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
                 reserved_seat BOOLEAN NOT NULL DEFAULT FALSE,
                 price INT NOT NULL,
+                KEY ticket_trip (trip_id),
+                KEY ticket_user_booking (user_id, booking_time),
                 FOREIGN KEY (user_id) REFERENCES Users(user_id) ON DELETE CASCADE,
-                FOREIGN KEY (trip_id) REFERENCES Trips(trip_id)
+                FOREIGN KEY (trip_id) REFERENCES Trips(trip_id),
+                FOREIGN KEY (journey_id) REFERENCES Journeys(journey_id) ON DELETE SET NULL
             );""",
             """CREATE TABLE IF NOT EXISTS Reservations (
                 reservation_id INT PRIMARY KEY AUTO_INCREMENT,
                 ticket_id INT NOT NULL,
+                KEY reservation_ticket (ticket_id),
                 FOREIGN KEY (ticket_id) REFERENCES Tickets(ticket_id) ON DELETE CASCADE
             );""",
+            # Number of Reservations per trip, a missing row means no reserved seat
+            """CREATE TABLE IF NOT EXISTS TripSeats (
+                trip_id INT PRIMARY KEY,
+                reserved_seats INT NOT NULL DEFAULT 0,
+                FOREIGN KEY (trip_id) REFERENCES Trips(trip_id) ON DELETE CASCADE
+            );""",
             """CREATE TABLE IF NOT EXISTS Connections (
                 connection_id INT PRIMARY KEY AUTO_INCREMENT,
-                starting_station VARCHAR(255) NOT NULL,
-                ending_station VARCHAR(255) NOT NULL,
-                travel_time INT NOT NULL
+                starting_station_id INT NOT NULL,
+                ending_station_id INT NOT NULL,
+                travel_time INT NOT NULL,
+                UNIQUE KEY connection_stations (starting_station_id, ending_station_id),
+                FOREIGN KEY (starting_station_id) REFERENCES Stations(station_id) ON DELETE CASCADE,
+                FOREIGN KEY (ending_station_id) REFERENCES Stations(station_id) ON DELETE CASCADE
+            );""",
+            # Holiday calendars of the service patterns, a schedule does not run on their dates
+            """CREATE TABLE IF NOT EXISTS HolidayCalendars (
+                calendar_id INT PRIMARY KEY AUTO_INCREMENT,
+                name VARCHAR(255) NOT NULL UNIQUE
+            );""",
+            """CREATE TABLE IF NOT EXISTS HolidayDates (
+                calendar_id INT NOT NULL,
+                date DATE NOT NULL,
+                PRIMARY KEY (calendar_id, date),
+                FOREIGN KEY (calendar_id) REFERENCES HolidayCalendars(calendar_id) ON DELETE CASCADE
             );""",
+            # weekdays is the ServicePattern mask, bit 0 is Monday
             """CREATE TABLE IF NOT EXISTS Schedules (
                 schedule_id INT PRIMARY KEY AUTO_INCREMENT,
                 train_id INT NOT NULL,
@@ -71,10 +311,44 @@ class TraitsUtility(TraitsUtilityInterface):
                 end_time TIME NOT NULL,
                 valid_from DATE NOT NULL,
                 valid_until DATE NOT NULL,
+                weekdays TINYINT UNSIGNED NOT NULL DEFAULT 127,
+                calendar_id INT NULL,
+                KEY schedule_validity (train_id, valid_from, valid_until),
                 FOREIGN KEY (train_id) REFERENCES Trains(train_id) ON DELETE CASCADE,
                 FOREIGN KEY (starting_station_id) REFERENCES Stations(station_id) ON DELETE CASCADE,
+                FOREIGN KEY (ending_station_id) REFERENCES Stations(station_id) ON DELETE CASCADE,
+                FOREIGN KEY (calendar_id) REFERENCES HolidayCalendars(calendar_id) ON DELETE SET NULL
+            );""",
+            # Dates added to (runs) or removed from (not runs) the service pattern of a schedule
+            """CREATE TABLE IF NOT EXISTS ScheduleExceptions (
+                schedule_id INT NOT NULL,
+                date DATE NOT NULL,
+                runs BOOLEAN NOT NULL,
+                PRIMARY KEY (schedule_id, date),
+                FOREIGN KEY (schedule_id) REFERENCES Schedules(schedule_id) ON DELETE CASCADE
+            );""",
+            # Stops of a schedule, used to generate dated trips on demand (lazy_trips mode)
+            """CREATE TABLE IF NOT EXISTS ScheduleStops (
+                schedule_id INT NOT NULL,
+                stop_index INT NOT NULL,
+                starting_station_id INT NOT NULL,
+                ending_station_id INT NOT NULL,
+                start_time TIME NOT NULL,
+                end_time TIME NOT NULL,
+                travel_time INT NOT NULL,
+                PRIMARY KEY (schedule_id, stop_index),
+                FOREIGN KEY (schedule_id) REFERENCES Schedules(schedule_id) ON DELETE CASCADE,
+                FOREIGN KEY (starting_station_id) REFERENCES Stations(station_id) ON DELETE CASCADE,
                 FOREIGN KEY (ending_station_id) REFERENCES Stations(station_id) ON DELETE CASCADE
             );""",
+            # Outbox of the dual-store writes (add_train_station, add_schedule), see replay_graph_outbox
+            """CREATE TABLE IF NOT EXISTS GraphOutbox (
+                write_id INT AUTO_INCREMENT PRIMARY KEY,
+                kind ENUM('station', 'schedule') NOT NULL,
+                name VARCHAR(255) NOT NULL,
+                committed BOOLEAN NOT NULL DEFAULT FALSE,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );""",
             
             # Views
             """ CREATE VIEW IF NOT EXISTS Purchase AS
@@ -118,6 +392,21 @@ class TraitsUtility(TraitsUtilityInterface):
                 DELETE r FROM Reservations r JOIN Tickets t ON r.ticket_id = t.ticket_id
                 JOIN Trips tr ON t.trip_id = tr.trip_id
                 WHERE tr.train_id = OLD.train_id AND tr.date >= cur_date;
+                UPDATE Journeys j JOIN (
+                    SELECT DISTINCT t.journey_id FROM Tickets t JOIN Trips tr ON t.trip_id = tr.trip_id
+                    WHERE tr.train_id = OLD.train_id AND tr.date >= cur_date AND t.journey_id IS NOT NULL
+                    ) cancelled ON j.journey_id = cancelled.journey_id
+                LEFT JOIN (
+                    SELECT t.journey_id, SUM(t.price) AS price, COUNT(*) AS legs, SUM(t.reserved_seat) AS seats,
+                        MIN(TIMESTAMP(tr.date, tr.start_time)) AS departure, MAX(TIMESTAMP(tr.date, tr.end_time)) AS arrival
+                    FROM Tickets t JOIN Trips tr ON t.trip_id = tr.trip_id
+                    WHERE (tr.train_id <> OLD.train_id OR tr.date < cur_date) AND t.journey_id IN (
+                        SELECT t2.journey_id FROM Tickets t2 JOIN Trips tr2 ON t2.trip_id = tr2.trip_id
+                        WHERE tr2.train_id = OLD.train_id AND tr2.date >= cur_date)
+                    GROUP BY t.journey_id) remaining ON j.journey_id = remaining.journey_id
+                SET j.total_price = COALESCE(remaining.price, 0), j.legs = COALESCE(remaining.legs, 0),
+                    j.reserved_seats = COALESCE(remaining.seats, 0),
+                    j.departure = remaining.departure, j.arrival = remaining.arrival;
                 DELETE t FROM Tickets t JOIN Trips tr ON t.trip_id = tr.trip_id
                 WHERE tr.train_id = OLD.train_id AND tr.date >= cur_date;
                 DELETE FROM Trips WHERE train_id = OLD.train_id AND date >= cur_date;
@@ -136,11 +425,17 @@ class TraitsUtility(TraitsUtilityInterface):
             f"GRANT SELECT ON test.Users TO '{BASE_USER_NAME}'@'%';",
             f"GRANT SELECT ON test.Schedules TO '{BASE_USER_NAME}'@'%';",
             f"GRANT SELECT, INSERT ON test.Tickets TO '{BASE_USER_NAME}'@'%';",
+            f"GRANT SELECT, INSERT, UPDATE ON test.Journeys TO '{BASE_USER_NAME}'@'%';",
             f"GRANT SELECT, INSERT ON test.Reservations TO '{BASE_USER_NAME}'@'%';",
+            f"GRANT SELECT, INSERT, UPDATE ON test.TripSeats TO '{BASE_USER_NAME}'@'%';",
             f"GRANT SELECT, INSERT ON test.Purchase TO '{BASE_USER_NAME}'@'%';",
             f"GRANT SELECT ON test.Trains TO '{BASE_USER_NAME}'@'%';",
             f"GRANT SELECT ON test.Stations TO '{BASE_USER_NAME}'@'%';",
             f"GRANT SELECT ON test.Trips TO '{BASE_USER_NAME}'@'%';",
+            f"GRANT SELECT ON test.Connections TO '{BASE_USER_NAME}'@'%';",
+            f"GRANT SELECT ON test.ScheduleStops TO '{BASE_USER_NAME}'@'%';",
+            f"GRANT SELECT ON test.ScheduleExceptions TO '{BASE_USER_NAME}'@'%';",
+            f"GRANT SELECT ON test.HolidayDates TO '{BASE_USER_NAME}'@'%';",
 
             f"DROP USER IF EXISTS '{ADMIN_USER_NAME}'@'%';",
             f"CREATE USER '{ADMIN_USER_NAME}'@'%' IDENTIFIED BY '{ADMIN_USER_PASS}';",
@@ -149,16 +444,41 @@ class TraitsUtility(TraitsUtilityInterface):
 
         ]
 
+    def generate_neo4j_initialization_code() -> List[str]:
+        """
+        Returns the Cypher statements that set up the constraints and indexes of the graph.
+        They are idempotent (IF NOT EXISTS) and can run on every startup.
+        """
+        return [
+            # Station lookups by name (add_schedule, search) use the constraint's index
+            "CREATE CONSTRAINT station_name IF NOT EXISTS FOR (s:Station) REQUIRE s.name IS UNIQUE",
+            # Day scans of the connection search
+            "CREATE INDEX trip_departure_time IF NOT EXISTS FOR ()-[r:TRIP]-() ON (r.departure_time)",
+            "CREATE INDEX trip_arrival_time IF NOT EXISTS FOR ()-[r:TRIP]-() ON (r.arrival_time)",
+            "CREATE INDEX trip_trip_id IF NOT EXISTS FOR ()-[r:TRIP]-() ON (r.trip_id)",
+        ]
+
+    def initialize_neo4j(self) -> None:
+        """
+        Run the Neo4j initialization code
+        """
+        with self.neo4j_driver.session() as session:
+            for statement in TraitsUtility.generate_neo4j_initialization_code():
+                session.run(statement).consume()
+
+    @pooled
     def get_all_users(self) -> List:
         """
         Return all the users stored in the database
         """
-        self.rdbms_admin_connection.reconnect()
+        # End the current transaction so that the latest users are visible
+        self.rdbms_admin_connection.commit()
         cursor = self.rdbms_admin_connection.cursor()
         cursor.execute("SELECT * FROM Users")
         users = cursor.fetchall()
         return users       
 
+    @pooled
     def get_all_schedules(self) -> List:
         """
         Return all the schedules stored in the database
@@ -169,83 +489,153 @@ class TraitsUtility(TraitsUtilityInterface):
         schedules = cursor.fetchall()
         return schedules
 
-    def _execute_neo4j_query(self, start_station, end_station, travel_time, is_departure_time, sort_by, is_ascending, limit):
-        sort_criteria = ["overallTravelTime", "numberOfTrains","totalWaitingTime", "Price"]
-
-        order_clause = "ASC" if is_ascending else "DESC"
-        time_constraint = f"datetime(r.departure_time)  >= datetime('{travel_time}')" if is_departure_time else f"datetime(r.arrival_time <= '{travel_time}')"
-        query = (f"""
-                MATCH (start:Station {{name: '{start_station}'}}),(end:Station {{name: '{end_station}'}})
-                MATCH path = (start)-[TRIP*]->(end)
-                WHERE ALL(r in relationships(path) WHERE {time_constraint})
-                WITH path, 
-                    reduce(totalTravelTime = 0, r in relationships(path) | totalTravelTime + r.travel_time) AS overallTravelTime,
-                    length(path) AS numberOfTrains,
-                    duration.between(datetime('{travel_time}'), relationships(path)[0].departure_time).minutes AS initialWaitingTime,
-                    reduce(waitingTime = 0, idx in range(0, length(path) - 2) |
-                    waitingTime + duration.between(relationships(path)[idx].arrival_time, relationships(path)[idx + 1].departure_time).minutes) AS intWaitingTime, 
-                    relationships(path)[0].departure_time AS firstDepartureTime
-                WITH relationships(path) AS rels, overallTravelTime, numberOfTrains,initialWaitingTime, intWaitingTime,initialWaitingTime + intWaitingTime AS totalWaitingTime, firstDepartureTime
-                WHERE ALL(r in relationships(path) WHERE date(r.departure_time) = date(firstDepartureTime))
-                RETURN [r in rels | properties(r)] AS relations , overallTravelTime, numberOfTrains, totalWaitingTime,
-                    (overallTravelTime - intWaitingTime) / 2 + (numberOfTrains * 2) AS Price
-                ORDER BY {sort_criteria[sort_by.value]} {order_clause} 
-                LIMIT {limit}
-""")    
-        
+    def iter_users(self, batch_size: int = 1000):
+        """
+        Generator over all the users (rows of get_all_users), read `batch_size` rows at a time
+        """
+        # The latest users are visible, see stream_rows
+        yield from stream_rows(self.rdbms_admin_connection, f"SELECT {', '.join(USER_COLUMNS)} FROM Users;", batch_size=batch_size,
+                               commit=True)
+
+    def iter_schedules(self, batch_size: int = 1000):
+        """
+        Generator over all the schedules (rows of get_all_schedules), read `batch_size` rows at a time
+        """
+        yield from stream_rows(self.rdbms_connection, f"SELECT {', '.join(SCHEDULE_COLUMNS)} FROM Schedules;", batch_size=batch_size)
+
+    def export_users(self, file, batch_size: int = 1000) -> int:
+        """
+        Write all the users as CSV to an open text file, return the number of users
+        """
+        return write_csv(self.iter_users(batch_size), file, USER_COLUMNS)
+
+    def export_schedules(self, file, batch_size: int = 1000) -> int:
+        """
+        Write all the schedules as CSV to an open text file, return the number of schedules
+        """
+        return write_csv(self.iter_schedules(batch_size), file, SCHEDULE_COLUMNS)
+
+    @pooled
+    def _execute_neo4j_query(self, start_station, end_station, travel_time, is_departure_time, sort_by, is_ascending, limit,
+                             horizon_days=None):
+        """
+        Search the routes between two stations with the time-dependent connection search.
+        Neo4j is only asked for the days that have trips and for the legs of one day at a time
+        between the stations lying on a path from start to end, feasibility and ranking are handled
+        in ConnectionSearch.
+        """
+        edges = self.get_connection_edges()
+        min_travel_time, min_legs = static_lower_bounds(edges, start_station, end_station)
+        if min_travel_time is None:
+            return []
+        stations = list(corridor_stations(edges, start_station, end_station))
+        search = ConnectionSearch(start_station, end_station, travel_time, is_departure_time, sort_by, is_ascending, limit, horizon_days)
+
         with self.neo4j_driver.session() as session:
-            result = session.run(query)
-            routes = [record.data() for record in result]
+            result = session.run(SEARCH_DAYS_QUERIES[bool(is_departure_time)], start_station=start_station,
+                                 end_station=end_station, travel_time=travel_time)
+            days = [record["day"].to_native() for record in result]
+
+            def load_legs(day):
+                result = session.run(DAY_LEGS_QUERY, day_start=datetime.combine(day, time.min),
+                                     day_end=datetime.combine(day + timedelta(days=1), time.min), stations=stations)
+                return [Leg(record["start"], record["end"], record["relation"]["departure_time"].to_native(),
+                            record["relation"]["arrival_time"].to_native(), record["relation"]["travel_time"], record["relation"])
+                        for record in result]
+
+            routes = search.run(days, load_legs, min_travel_time, min_legs)
         return routes
 
-    def _fetch_details_from_mariadb(self, routes):
-        detailed_routes = []
+    @pooled
+    def get_connection_edges(self) -> List[Tuple[str, str, int]]:
+        """
+        Return the connections as (starting station name, ending station name, travel time)
+        """
+        cursor = self.rdbms_connection.cursor()
+        cursor.execute("""
+            SELECT s1.name, s2.name, c.travel_time FROM Connections c
+            JOIN Stations s1 ON c.starting_station_id = s1.station_id
+            JOIN Stations s2 ON c.ending_station_id = s2.station_id
+            """)
+        edges = cursor.fetchall()
+        cursor.close()
+        return edges
+
+    @pooled
+    def _fetch_details_from_mariadb(self, routes, chunk_size: int = 1000):
+        """
+        Replace the relations of every route with the matching Trips rows.
+        All trip ids are fetched with set-based queries (chunked IN lists) instead of one query per leg.
+        """
+        trip_ids = list(dict.fromkeys(connect['trip_id'] for route in routes for connect in route['relations']))
+        trips = {}
         cursor = self.rdbms_connection.cursor()
+        for i in range(0, len(trip_ids), chunk_size):
+            chunk = trip_ids[i:i + chunk_size]
+            placeholders = ", ".join(["%s"] * len(chunk))
+            cursor.execute(f"SELECT trip_id, train_id, starting_station_id, ending_station_id, date, start_time, end_time FROM Trips WHERE trip_id IN ({placeholders})", tuple(chunk))
+            for rec in cursor.fetchall():
+                trips[rec[0]] = rec
+        cursor.close()
 
+        detailed_routes = []
         for route in routes:
-            details = []
-            for connect in route['relations']:
-                cursor.execute("SELECT * FROM Trips WHERE trip_id = %s", (connect['trip_id'],))
-                rec = cursor.fetchall()
-                # return trip_ids only
-                if (rec):
-                    details.append(rec[0])
-            detailed_routes.append(details)
+            # Trips deleted from MariaDB (e.g. by delete_train) are skipped
+            detailed_routes.append([trips[connect['trip_id']] for connect in route['relations'] if connect['trip_id'] in trips])
         return detailed_routes
     
+    @pooled
     def check_available_seats(self, trip_id: int) -> int:
+        """
+        Capacity of the train minus the seats reserved on the trip, read from the TripSeats counter
+        """
         cursor = self.rdbms_admin_connection.cursor()
-        
-        # Fetch the train_id for the given trip_id
-        cursor.execute("SELECT train_id FROM Trips WHERE trip_id = %s;", (trip_id,))
-        train_id = cursor.fetchone()
-        if not train_id:
-            raise ValueError("Trip does not exist")
-        
-        train_id = train_id[0]
-
-        # Fetch the train capacity
-        cursor.execute("SELECT capacity FROM Trains WHERE train_id = %s;", (train_id,))
-        train_capacity = cursor.fetchone()
-        if not train_capacity:
-            raise ValueError("Train does not exist")
-
-        train_capacity = train_capacity[0]
-
-        # Fetch the number of reserved seats for the given trip_id
         cursor.execute(
             """
-            SELECT COUNT(*) FROM Reservations R
-            JOIN Tickets T ON R.ticket_id = T.ticket_id
-            WHERE T.trip_id = %s;
+            SELECT t.capacity - COALESCE(s.reserved_seats, 0)
+            FROM Trips tr
+                JOIN Trains t ON tr.train_id = t.train_id
+                LEFT JOIN TripSeats s ON s.trip_id = tr.trip_id
+            WHERE tr.trip_id = %s;
             """,
             (trip_id,)
         )
-        reserved_seats = cursor.fetchone()[0]
+        available_seats = cursor.fetchone()
+        if not available_seats:
+            raise ValueError("Trip does not exist")
+        return available_seats[0]
 
-        available_seats = train_capacity - reserved_seats
-        return available_seats
+    @pooled
+    def reconcile_reserved_seats(self, repair: bool = True) -> List[Tuple[int, int, int]]:
+        """
+        Compare the TripSeats counters with the Reservations and return the drifted trips
+        as (trip_id, stored, actual). With repair the counters are set to the actual count.
+        """
+        cursor = self.rdbms_admin_connection.cursor()
+        cursor.execute(
+            """
+            SELECT tr.trip_id, COALESCE(s.reserved_seats, 0) AS stored, COUNT(r.reservation_id) AS actual
+            FROM Trips tr
+                LEFT JOIN TripSeats s ON s.trip_id = tr.trip_id
+                LEFT JOIN Tickets t ON t.trip_id = tr.trip_id
+                LEFT JOIN Reservations r ON r.ticket_id = t.ticket_id
+            GROUP BY tr.trip_id, s.reserved_seats
+            HAVING stored <> actual;
+            """
+        )
+        drifted = cursor.fetchall()
+        if repair and drifted:
+            cursor.executemany(
+                """
+                INSERT INTO TripSeats (trip_id, reserved_seats) VALUES (%s, %s)
+                ON DUPLICATE KEY UPDATE reserved_seats = VALUES(reserved_seats);
+                """, [(trip_id, actual) for trip_id, _, actual in drifted]
+            )
+            self.rdbms_admin_connection.commit()
+        cursor.close()
+        return drifted
 
+    @pooled
     def search_station_keys(self, starting_station_key: int|str, ending_station_key: int|str) -> None:
         """
         Check if the starting and ending station keys exist in the Stations table.
@@ -271,29 +661,65 @@ class TraitsUtility(TraitsUtilityInterface):
         if start_station_count == 0 or end_station_count == 0:
             raise ValueError
         
+    @pooled
     def get_dates(self, valid_from_day: int, valid_from_month: int, valid_from_year: int,
-                 valid_until_day: int, valid_until_month: int, valid_until_year: int) -> List[date]:
-        cte_query = f"""
-        WITH RECURSIVE DateRange AS (
-            SELECT
-                DATE(CONCAT({valid_from_year}, '-', {valid_from_month}, '-', {valid_from_day})) AS date
-            UNION ALL
-            SELECT
-                DATE_ADD(date, INTERVAL 1 DAY)
-            FROM
-                DateRange
-            WHERE
-                date < DATE(CONCAT({valid_until_year}, '-', {valid_until_month}, '-', {valid_until_day}))
-        )
-        SELECT date FROM DateRange;
+                 valid_until_day: int, valid_until_month: int, valid_until_year: int,
+                 service: Optional[ServicePattern] = None) -> List[date]:
         """
+        Days a schedule runs on between the two dates, computed locally. Every day without a
+        service pattern; with one, only the holidays of its calendar are read from the database
+        """
+        service = service or ServicePattern()
+        holidays = self.get_holidays(service.holiday_calendar)[1] if service.holiday_calendar else frozenset()
+        return service.days(date(valid_from_year, valid_from_month, valid_from_day),
+                            date(valid_until_year, valid_until_month, valid_until_day), holidays)
 
-        # Execute the CTE query
+    @pooled
+    def get_holidays(self, calendar_name: str) -> Tuple[int, frozenset]:
+        """
+        Return the id and the dates of a holiday calendar, raise a ValueError if it does not exist
+        """
         cursor = self.rdbms_admin_connection.cursor()
-        cursor.execute(cte_query)
-        dates = cursor.fetchall()
-        return dates
-    
+        cursor.execute(
+            """
+            SELECT c.calendar_id, h.date FROM HolidayCalendars c
+            LEFT JOIN HolidayDates h ON h.calendar_id = c.calendar_id
+            WHERE c.name = %s;
+            """, (calendar_name,)
+        )
+        rows = cursor.fetchall()
+        cursor.close()
+        if not rows:
+            raise ValueError
+        return rows[0][0], frozenset(row[1] for row in rows if row[1] is not None)
+
+    @pooled
+    def get_service_patterns(self, schedules: List[Tuple[int, int, Optional[int]]]) -> Dict[int, Tuple[ServicePattern, frozenset]]:
+        """
+        Service pattern and holidays of (schedule_id, weekdays, calendar_id) schedules, with one query
+        for the exceptions and one for the holidays
+        """
+        if not schedules:
+            return {}
+        schedule_ids = [schedule[0] for schedule in schedules]
+        cursor = self.rdbms_connection.cursor()
+        cursor.execute(f"SELECT schedule_id, date, runs FROM ScheduleExceptions WHERE schedule_id IN ({', '.join(['%s'] * len(schedule_ids))});",
+                       tuple(schedule_ids))
+        added, removed = {}, {}
+        for schedule_id, day, runs in cursor.fetchall():
+            (added if runs else removed).setdefault(schedule_id, []).append(day)
+        calendar_ids = list({schedule[2] for schedule in schedules if schedule[2] is not None})
+        holidays = {}
+        if calendar_ids:
+            cursor.execute(f"SELECT calendar_id, date FROM HolidayDates WHERE calendar_id IN ({', '.join(['%s'] * len(calendar_ids))});",
+                           tuple(calendar_ids))
+            for calendar_id, day in cursor.fetchall():
+                holidays.setdefault(calendar_id, set()).add(day)
+        cursor.close()
+        return {schedule_id: (ServicePattern(weekdays, added.get(schedule_id, ()), removed.get(schedule_id, ())),
+                              frozenset(holidays.get(calendar_id, ())))
+                for schedule_id, weekdays, calendar_id in schedules}
+
     def add_travel_time(self, starting_hours_24_h: int, starting_minutes: int, travel_minutes: int) -> str:
     # Create start time object
         start_time = time(hour=starting_hours_24_h, minute=starting_minutes)
@@ -311,74 +737,139 @@ class TraitsUtility(TraitsUtilityInterface):
         end_minutes = end_datetime.time().minute
         return end_time, end_hours, end_minutes
     
+    @pooled
     def is_schedule_feasible(self, train_id: int, start_time: time, end_time: time, valid_from: date, valid_until: date) -> bool:
-        # Check if a train is already scheduled during this time
-        cursor = self.rdbms_connection.cursor()
-        new_start_time = timedelta(hours=int(start_time.split(':')[0]), 
-                           minutes=int(start_time.split(':')[1]), 
-                           seconds=int(start_time.split(':')[2]))
-        new_end_time = timedelta(hours=int(end_time.split(':')[0]), 
-                         minutes=int(end_time.split(':')[1]), 
-                         seconds=int(end_time.split(':')[2]))
-        
-        # The schedule went onto the next day
-        if (new_end_time<new_start_time):
-            return False
-        cursor.execute(
-            """
-            SELECT start_time, end_time FROM Schedules
-            WHERE train_id = %s
-            AND (
-                (%s BETWEEN valid_from AND valid_until OR %s BETWEEN valid_from AND valid_until)
-                OR
-                (valid_from BETWEEN %s AND %s OR valid_until BETWEEN %s AND %s)
-            );
-            """, (train_id, valid_from, valid_until, valid_from, valid_until, valid_from, valid_until)
-        )
-        same_day_schedules = cursor.fetchall()
-        
-        
-        if same_day_schedules:
-            for sch in same_day_schedules:
-                if (new_start_time <= sch[1]  and new_end_time >= sch[0]):
-            # if overlapping_schedules > 0:
-                    return False
-        
+        """
+        Check that the train is not already scheduled during this time and that there are at least
+        6 hours between its schedules on consecutive days. The schedules of the train that are valid
+        around these dates are read with one indexed range query into a ScheduleIndex
+        """
+        return ScheduleIndex.load(self.rdbms_connection, train_id, valid_from, valid_until).is_feasible(start_time, end_time, valid_from, valid_until)
 
-        prev_date = datetime.strptime(valid_from, "%Y-%m-%d") - timedelta(days=1)
-        # Ensure at least 6 hours before next day's first start
-        cursor.execute(
-            """
-            SELECT end_time FROM Schedules 
-            WHERE train_id = %s AND  (%s BETWEEN valid_from AND valid_until)
-            ORDER BY end_time DESC LIMIT 1;
-            """, (train_id, prev_date,)
-        )
-        # If new schedule is within six hours of previous day
-        last_end_time = cursor.fetchone()
-        if last_end_time:
-            if (last_end_time[0] - new_start_time).total_seconds() > 64800:
-                return False
-            
-        next_date = datetime.strptime(valid_from, "%Y-%m-%d") + timedelta(days=1)
-        # Ensure at least 6 hours before next day's first start
+    @pooled
+    def validate_schedules(self, train_id: int, candidates: List[Tuple]) -> List[Optional[str]]:
+        """
+        Check a batch of (start_time, end_time, valid_from, valid_until) schedules for a train in one pass,
+        each one against the stored schedules and the feasible candidates before it.
+        Return None for the feasible ones, the reason of the conflict otherwise (see ScheduleIndex.conflict)
+        """
+        if not candidates:
+            return []
+        dates = [date.fromisoformat(str(day)) for candidate in candidates for day in candidate[2:4]]
+        return ScheduleIndex.load(self.rdbms_connection, train_id, min(dates), max(dates)).validate(candidates)
+    
+    def insert_trips(self, cursor, train_id: int, trips: List[Tuple], chunk_size: int = 1000) -> List[int]:
+        """
+        Insert the dated trips of a train with multi-row inserts and return their trip ids, in order.
+        Each trip is (starting_station_id, ending_station_id, departure datetime, arrival datetime, ...).
+        """
+        return self.insert_train_trips(cursor, [(train_id,) + tuple(trip[:4]) for trip in trips], chunk_size)
+
+    def insert_train_trips(self, cursor, trips: List[Tuple], chunk_size: int = 1000) -> List[int]:
+        """
+        insert_trips for the trips of several trains, each one is (train_id, starting_station_id,
+        ending_station_id, departure datetime, arrival datetime, ...).
+        Ids are read back by the trip_departure key (train, date, starting station, start time) of
+        the inserted trips, which is unique since schedules of the same train cannot overlap.
+        """
+        insert_trip_query = "INSERT INTO Trips (train_id, starting_station_id, ending_station_id, date, start_time, end_time) VALUES (%s,%s,%s,%s,%s,%s)"
+        trip_ids = []
+        for i in range(0, len(trips), chunk_size):
+            chunk = trips[i:i + chunk_size]
+            cursor.executemany(insert_trip_query, [
+                (trip[0], trip[1], trip[2], trip[3].date(), trip[3].time(), trip[4].time()) for trip in chunk])
+            cursor.execute(
+                f"""
+                SELECT trip_id, train_id, date, starting_station_id, start_time FROM Trips
+                WHERE (train_id, date, starting_station_id, start_time) IN ({', '.join(['(%s, %s, %s, %s)'] * len(chunk))});
+                """, tuple(value for trip in chunk for value in (trip[0], trip[3].date(), trip[1], trip[3].time()))
+            )
+            stored = {}
+            for trip_id, train_id, trip_date, starting_station_id, start_time in cursor.fetchall():
+                stored[(train_id, starting_station_id, datetime.combine(trip_date, time.min) + start_time)] = trip_id
+            trip_ids.extend(stored[(trip[0], trip[1], trip[3])] for trip in chunk)
+        return trip_ids
+
+    @pooled
+    def begin_graph_write(self, kind: str, name: str) -> int:
+        """
+        Commit a GraphOutbox entry before a dual-store write and return its write_id.
+        The entry has its own connection when there is an outbox pool, otherwise it is committed on the
+        admin connection, which must not hold uncommitted statements of the write yet
+        """
+        with self._outbox_connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute("INSERT INTO GraphOutbox (kind, name) VALUES (%s, %s);", (kind, name))
+            write_id = cursor.lastrowid
+            connection.commit()
+            cursor.close()
+        return write_id
+
+    @pooled
+    def mark_graph_write(self, write_id: int) -> None:
+        """
+        Flag the entry in the MariaDB transaction of the write, it is committed with it
+        """
+        cursor = self.rdbms_admin_connection.cursor()
+        cursor.execute("UPDATE GraphOutbox SET committed = TRUE WHERE write_id = %s;", (write_id,))
+        cursor.close()
+
+    @pooled
+    def end_graph_write(self, write_id: int) -> None:
+        with self._outbox_connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute("DELETE FROM GraphOutbox WHERE write_id = %s;", (write_id,))
+            connection.commit()
+            cursor.close()
+
+    @contextmanager
+    def _outbox_connection(self):
+        if self.outbox_pool is None:
+            yield self.rdbms_admin_connection
+        else:
+            with self.outbox_pool.connection() as connection:
+                yield connection
+
+    @pooled
+    def undo_graph_write(self, write_id: int) -> None:
+        """
+        Delete the Neo4j nodes and relationships of a write whose MariaDB side was rolled back
+        """
+        with self.neo4j_driver.session() as session:
+            session.run("MATCH ()-[r:TRIP {write_id: $write_id}]->() DELETE r", write_id=write_id).consume()
+            session.run("MATCH (s:Station {write_id: $write_id}) DETACH DELETE s", write_id=write_id).consume()
+        self.end_graph_write(write_id)
+
+    @pooled
+    def replay_graph_outbox(self, min_age: int = 300) -> List[Tuple[int, str, bool]]:
+        """
+        Settle the GraphOutbox entries left by interrupted writes, older than min_age seconds
+        (younger ones may still be in progress). Neo4j is always complete before MariaDB commits,
+        so committed entries are rolled forward by dropping them and the others are rolled back.
+        Return the settled entries as (write_id, name, committed).
+        """
+        cursor = self.rdbms_admin_connection.cursor()
         cursor.execute(
             """
-            SELECT end_time FROM Schedules 
-            WHERE train_id = %s AND  (%s BETWEEN valid_from AND valid_until)
-            ORDER BY start_time ASC LIMIT 1;
-            """, (train_id, next_date,)
+            SELECT write_id, name, committed FROM GraphOutbox
+            WHERE created_at <= NOW() - INTERVAL %s SECOND ORDER BY write_id;
+            """, (min_age,)
         )
-        # If new schedule is within six hours of previous day
-        first_start_time = cursor.fetchone()
-        if first_start_time:
-            if (new_end_time - first_start_time[0]).total_seconds() > 64800:
-                return False
+        entries = [(write_id, name, bool(committed)) for write_id, name, committed in cursor.fetchall()]
+        cursor.close()
+        for write_id, _, committed in entries:
+            if committed:
+                self.end_graph_write(write_id)
+            else:
+                self.undo_graph_write(write_id)
+        return entries
 
-        return True
-    
-    def add_schedule(self, train_id: int, start_station_id: int, end_station_id: int, start_time: time, end_time: time, valid_from: date, valid_until: date) -> None:
-        
+    @pooled
+    def add_schedule(self, train_id: int, start_station_id: int, end_station_id: int, start_time: time, end_time: time, valid_from: date, valid_until: date,
+                     service: Optional[ServicePattern] = None, calendar_id: Optional[int] = None) -> None:
+        """
+        Insert a feasible schedule and its exceptions and return its schedule_id, the caller commits
+        """
         # start_time = datetime.strptime(start_time, '%H:%M:%S')
         # end_time = datetime.strptime(end_time, '%H:%M:%S')
         if not self.is_schedule_feasible(train_id, start_time, end_time, valid_from, valid_until):
@@ -387,29 +878,246 @@ class TraitsUtility(TraitsUtilityInterface):
         cursor = self.rdbms_admin_connection.cursor()
         cursor.execute(
             """
-            INSERT INTO Schedules (train_id, starting_station_id, ending_station_id, start_time, end_time, valid_from, valid_until)
+            INSERT INTO Schedules (train_id, starting_station_id, ending_station_id, start_time, end_time, valid_from, valid_until, weekdays, calendar_id)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s);
+            """, (train_id, start_station_id, end_station_id, start_time, end_time, valid_from, valid_until,
+                  service.weekdays if service else EVERY_DAY, calendar_id)
+        )
+        schedule_id = cursor.lastrowid
+        if service and (service.added or service.removed):
+            cursor.executemany("INSERT INTO ScheduleExceptions (schedule_id, date, runs) VALUES (%s, %s, %s);",
+                               [(schedule_id, day, True) for day in sorted(service.added)]
+                               + [(schedule_id, day, False) for day in sorted(service.removed - service.added)])
+        cursor.close()
+        return schedule_id
+
+    def add_schedule_stops(self, cursor, schedule_id: int, stop_info: List) -> None:
+        """
+        Store the legs of a schedule instead of its dated trips (lazy_trips mode)
+        """
+        cursor.executemany(
+            """
+            INSERT INTO ScheduleStops (schedule_id, stop_index, starting_station_id, ending_station_id, start_time, end_time, travel_time)
             VALUES (%s, %s, %s, %s, %s, %s, %s);
-            """, (train_id, start_station_id, end_station_id, start_time, end_time, valid_from, valid_until)
+            """, [(schedule_id, i, stop[0], stop[1], stop[2], stop[3], stop[6]) for i, stop in enumerate(stop_info)]
+        )
+
+    @pooled
+    def get_schedule_legs(self, travel_time: datetime, is_departure_time: bool) -> List:
+        """
+        Return the schedule legs that can run on or after (before for arrivals) the travel time
+        """
+        cursor = self.rdbms_connection.cursor()
+        validity = "s.valid_until >= %s" if is_departure_time else "s.valid_from <= %s"
+        cursor.execute(
+            f"""
+            SELECT s.train_id, ss.starting_station_id, ss.ending_station_id, ss.start_time, ss.end_time,
+                ss.travel_time, s.valid_from, s.valid_until, st1.name, st2.name, s.schedule_id, s.weekdays, s.calendar_id
+            FROM ScheduleStops ss
+                JOIN Schedules s ON ss.schedule_id = s.schedule_id
+                JOIN Stations st1 ON ss.starting_station_id = st1.station_id
+                JOIN Stations st2 ON ss.ending_station_id = st2.station_id
+            WHERE {validity};
+            """, (travel_time.date(),)
+        )
+        legs = cursor.fetchall()
+        cursor.close()
+        return legs
+
+    @pooled
+    def materialize_trip(self, trip) -> int:
+        """
+        Return the trip_id of a generated (train_id, ..., date, start_time, end_time) trip row,
+        inserting it into Trips the first time it is needed
+        """
+        cursor = self.rdbms_admin_connection.cursor()
+        cursor.execute(
+            """
+            INSERT IGNORE INTO Trips (train_id, starting_station_id, ending_station_id, date, start_time, end_time)
+            VALUES (%s, %s, %s, %s, %s, %s);
+            """, tuple(trip[1:7])
+        )
+        cursor.execute(
+            """
+            SELECT trip_id FROM Trips
+            WHERE train_id = %s AND date = %s AND starting_station_id = %s AND start_time = %s;
+            """, (trip[1], trip[4], trip[2], trip[5])
         )
+        trip_id = cursor.fetchone()[0]
         self.rdbms_admin_connection.commit()
+        cursor.close()
+        return trip_id
+
+    @pooled
+    def fill_trip_ids(self, routes: List) -> List:
+        """
+        Replace the missing trip ids of generated trips with the ones already stored in Trips
+        """
+        trips = [trip for route in routes for trip in route]
+        if not trips:
+            return routes
+        cursor = self.rdbms_connection.cursor()
+        placeholders = ", ".join(["(%s, %s)"] * len(trips))
+        cursor.execute(
+            f"""
+            SELECT trip_id, train_id, date, starting_station_id, start_time FROM Trips
+            WHERE (train_id, date) IN ({placeholders});
+            """, tuple(value for trip in trips for value in (trip[1], trip[4]))
+        )
+        trip_ids = {(train_id, trip_date, station_id, start_time): trip_id
+                    for trip_id, train_id, trip_date, station_id, start_time in cursor.fetchall()}
+        cursor.close()
+        return [[(trip_ids.get((trip[1], trip[4], trip[2], trip[5])),) + tuple(trip[1:]) for trip in route] for route in routes]
 
 
     
 class Traits(TraitsInterface):
-    def __init__(self, rdbms_connection, rdbms_admin_connection, neo4j_driver) -> None:
+    def __init__(self, rdbms_connection, rdbms_admin_connection, neo4j_driver, lazy_trips: bool = False) -> None:
+        """
+        With lazy_trips, add_schedule only stores the schedule and its stops; dated trips are generated
+        when searching and stored in Trips only when a ticket is bought
+        """
+        self.lazy_trips = lazy_trips
         self.rdbms_connection = rdbms_connection
         self.rdbms_admin_connection = rdbms_admin_connection
         self.neo4j_driver = neo4j_driver
         self.utility = TraitsUtility(rdbms_connection, rdbms_admin_connection, neo4j_driver)
+        self.snapshot = None
+        self.search_cache = None
+        self.instrumentation = None
+        self.pools = []
+
+    @classmethod
+    def from_settings(cls, host: str = "127.0.0.1", port: int = 3306, database: str = "test",
+                      neo4j_uri: str = "neo4j://localhost:7687", neo4j_auth=None,
+                      pool_size: int = 5, timeout: Optional[float] = None, lazy_trips: bool = False) -> "Traits":
+        """
+        Build a Traits that can be shared between threads: every operation checks out a base and/or admin
+        connection from a bounded pool and gives it back when it returns. Neo4j sessions are opened per
+        operation on top of the driver's own bounded connection pool.
+        """
+        import mysql.connector
+        from neo4j import GraphDatabase
+
+        def connect(user, password):
+            return lambda: mysql.connector.connect(host=host, port=port, database=database, user=user, password=password)
+
+        base_pool = ConnectionPool(connect(BASE_USER_NAME, BASE_USER_PASS), pool_size, timeout)
+        admin_pool = ConnectionPool(connect(ADMIN_USER_NAME, ADMIN_USER_PASS), pool_size, timeout)
+        neo4j_driver = GraphDatabase.driver(neo4j_uri, auth=neo4j_auth, max_connection_pool_size=pool_size)
+        # Connections are only taken when used, a thread holding an admin connection falls back to
+        # base_reserve when every base connection is taken
+        base_reserve = ConnectionPool(connect(BASE_USER_NAME, BASE_USER_PASS), pool_size, timeout)
+        admin_connection = PooledConnection(admin_pool)
+        traits = cls(PooledConnection(base_pool, base_reserve, admin_connection), admin_connection, neo4j_driver,
+                     lazy_trips=lazy_trips)
+        # GraphOutbox entries are committed apart from the writes they track, on connections of their own
+        outbox_pool = ConnectionPool(connect(ADMIN_USER_NAME, ADMIN_USER_PASS), pool_size, timeout)
+        traits.utility.outbox_pool = outbox_pool
+        traits.pools = [base_pool, admin_pool, outbox_pool, base_reserve]
+        traits.utility.initialize_neo4j()
+        return traits
+
+    def close(self) -> None:
+        """
+        Close the pooled connections and the Neo4j driver (from_settings only)
+        """
+        for pool in self.pools:
+            pool.close()
+        if self.pools:
+            self.neo4j_driver.close()
+
+    def enable_search_cache(self, max_entries: int = 1024, max_bytes: int = 16 * 1024 * 1024, ttl: Optional[float] = 300) -> SearchCache:
+        """
+        Cache the results of search_connections for a given day. add_schedule, delete_train and
+        status changes in update_train_details only invalidate the searches they can affect.
+        """
+        self.search_cache = SearchCache(max_entries, max_bytes, ttl)
+        return self.search_cache
+
+    def enable_instrumentation(self, exporters: Optional[List] = None, profile: bool = False, keep: int = 1000) -> Instrumentation:
+        """
+        Trace every public call of this Traits and its TraitsUtility: wall time, SQL round trips and rows,
+        Cypher queries and their ResultSummary counters. Call it once, before sharing the instance.
+        """
+        instrumentation = Instrumentation(exporters, profile, keep)
+        instrumentation.instrument(self)
+        self.instrumentation = instrumentation
+        return instrumentation
+
+    @pooled
+    def load_timetable_snapshot(self) -> TimetableSnapshot:
+        """
+        Build an in-memory timetable from Trips/Stations/Trains. From now on search_connections
+        is answered from memory, and the snapshot follows add_schedule, delete_train and update_train_details
+        """
+        if self.lazy_trips:
+            # The snapshot is built from the materialized Trips
+            raise ValueError
+        snapshot = TimetableSnapshot()
+        snapshot.load(self.rdbms_admin_connection)
+        self.snapshot = snapshot
+        return snapshot
+
+    def _search_snapshot(self, starting_station: str, ending_station: str, travel_time: datetime,
+                         is_departure_time, sort_by, is_ascending, limit, horizon_days) -> List:
+        if not self.snapshot.has_station(starting_station) or not self.snapshot.has_station(ending_station):
+            raise ValueError
+        min_travel_time, min_legs = static_lower_bounds(self.snapshot.edges(), starting_station, ending_station)
+        if min_travel_time is None:
+            return []
+        search = ConnectionSearch(starting_station, ending_station, travel_time, is_departure_time, sort_by, is_ascending, limit,
+                                  horizon_days)
+        routes = search.run(self.snapshot.search_days(travel_time, is_departure_time), self.snapshot.legs, min_travel_time, min_legs)
+        return [route['relations'] for route in routes]
+
+    def _search_lazy(self, starting_station: str, ending_station: str, travel_time: datetime,
+                     is_departure_time, sort_by, is_ascending, limit, horizon_days) -> List:
+        """
+        Search on trips generated from the schedules for the days the search actually visits
+        """
+        schedule_legs = self.utility.get_schedule_legs(travel_time, is_departure_time)
+        min_travel_time, min_legs = static_lower_bounds([(leg[8], leg[9], leg[5]) for leg in schedule_legs],
+                                                        starting_station, ending_station)
+        if min_travel_time is None:
+            return []
+        services = self.utility.get_service_patterns(list({(leg[10], leg[11], leg[12]) for leg in schedule_legs}))
 
+        def days():
+            day = travel_time.date()
+            if is_departure_time:
+                last_day = max(leg[7] for leg in schedule_legs)
+                while day <= last_day:
+                    yield day
+                    day += timedelta(days=1)
+            else:
+                first_day = min(leg[6] for leg in schedule_legs)
+                while day >= first_day:
+                    yield day
+                    day -= timedelta(days=1)
+
+        def load_legs(day):
+            midnight = datetime.combine(day, time.min)
+            return [Leg(leg[8], leg[9], midnight + leg[3], midnight + leg[4], leg[5],
+                        (None, leg[0], leg[1], leg[2], day, leg[3], leg[4]))
+                    for leg in schedule_legs if leg[6] <= day <= leg[7] and services[leg[10]][0].runs_on(day, services[leg[10]][1])]
+
+        search = ConnectionSearch(starting_station, ending_station, travel_time, is_departure_time, sort_by, is_ascending, limit,
+                                  horizon_days)
+        routes = search.run(days(), load_legs, min_travel_time, min_legs)
+        return self.utility.fill_trip_ids([route['relations'] for route in routes])
+
+    @pooled
     def search_connections(self, starting_station_key: TraitsKey, ending_station_key: TraitsKey,
                            travel_time_day: int = None, travel_time_month : int = None, travel_time_year : int = None,
                            is_departure_time=True,
                            sort_by : SortingCriteria = SortingCriteria.OVERALL_TRAVEL_TIME, is_ascending : bool =True,
-                           limit : int = 5) -> List:
+                           limit : int = 5, horizon_days: Optional[int] = None) -> List:
         """
         Search Train Connections (between two stations).
         Sorting criteria can be one of the following:overall travel time, number of train changes, waiting time, and estimated price
+        With horizon_days, only the connections departing (arriving) in the horizon_days days from the travel day on
+        (up to the travel day) are searched, otherwise every day with trips is.
 
         Return the connections from a starting and ending stations, possibly including changes at interchanging stations.
         Returns an empty list if no connections are possible
@@ -418,12 +1126,49 @@ class Traits(TraitsInterface):
         # Implementation here
         if starting_station_key.to_string() == ending_station_key.to_string():
             raise ValueError
-        self.utility.search_station_keys(starting_station_key.to_string(), ending_station_key.to_string())
-        travel_time = date(travel_time_year, travel_time_month, travel_time_day) if travel_time_day or travel_time_month or travel_time_year else datetime.now()
-        travel_time_str = travel_time.strftime('%Y-%m-%dT%H:%M:%S')
+        if horizon_days is not None and horizon_days < 1:
+            raise ValueError
+        cache_key = self._search_cache_key(starting_station_key, ending_station_key, travel_time_day, travel_time_month, travel_time_year,
+                                           is_departure_time, sort_by, is_ascending, limit, horizon_days)
+        if cache_key is not None:
+            routes = self.search_cache.get(cache_key)
+            if routes is not None:
+                return routes
+        routes = self._find_routes(starting_station_key.to_string(), ending_station_key.to_string(),
+                                   travel_time_day, travel_time_month, travel_time_year,
+                                   is_departure_time, sort_by, is_ascending, limit, horizon_days)
+        if cache_key is not None:
+            self.search_cache.put(cache_key, routes)
+        return routes
 
-         # Build the Neo4j query
-        routes = self.utility._execute_neo4j_query(starting_station_key.to_string(), ending_station_key.to_string(), travel_time_str, is_departure_time, sort_by, is_ascending, limit)
+    def _search_cache_key(self, starting_station_key: TraitsKey, ending_station_key: TraitsKey,
+                          travel_time_day, travel_time_month, travel_time_year,
+                          is_departure_time, sort_by, is_ascending, limit, horizon_days=None) -> Optional[Tuple]:
+        """
+        Key of a search in the search cache, None when the cache is off or the search is not cached
+        """
+        if self.search_cache is None or not (travel_time_day or travel_time_month or travel_time_year):
+            # Searches from "now" depend on the current time and are not cached
+            return None
+        return (starting_station_key.to_string(), ending_station_key.to_string(),
+                date(travel_time_year, travel_time_month, travel_time_day), bool(is_departure_time),
+                sort_by, is_ascending, limit, horizon_days)
+
+    def _find_routes(self, starting_station: str, ending_station: str,
+                     travel_time_day, travel_time_month, travel_time_year,
+                     is_departure_time, sort_by, is_ascending, limit, horizon_days=None) -> List:
+        travel_time = search_travel_time(travel_time_day, travel_time_month, travel_time_year, is_departure_time)
+        if self.snapshot is not None:
+            return self._search_snapshot(starting_station, ending_station, travel_time,
+                                         is_departure_time, sort_by, is_ascending, limit, horizon_days)
+        self.utility.search_station_keys(starting_station, ending_station)
+        if self.lazy_trips:
+            return self._search_lazy(starting_station, ending_station, travel_time,
+                                     is_departure_time, sort_by, is_ascending, limit, horizon_days)
+
+        # Search the routes on the trip graph
+        routes = self.utility._execute_neo4j_query(starting_station, ending_station, travel_time, is_departure_time, sort_by, is_ascending,
+                                                   limit, horizon_days)
         if len(routes) == 0:
             return []
         # Fetch additional details from MariaDB
@@ -431,6 +1176,7 @@ class Traits(TraitsInterface):
 
         return detailed_routes
     
+    @pooled
     def get_train_current_status(self, train_key: TraitsKey) -> Optional[TrainStatus]:
         """
         Check the status of a train. If the train does not exist returns None
@@ -444,60 +1190,240 @@ class Traits(TraitsInterface):
             return TrainStatus(status[0])
         return None
 
+    @pooled
     def buy_ticket(self, user_email: str, connection, also_reserve_seats=True):
         """
         Given a train connection instance (e.g., on a given date/time), registered users can book tickets and optionally reserve seats.
+        The connection is either a single trip or a whole route as returned by search_connections; all the legs
+        of a route are booked in one transaction, or none if any of them is sold out.
+        Seats are taken with a conditional increment of the TripSeats counters, on the same connection as the
+        tickets, so concurrent buyers cannot overbook and a sold-out trip leaves no ticket behind.
+
+        Returns the id of the last reservation (or ticket) for a single trip, the ticket ids for a route.
         """
         # Implementation here
+        is_route, legs = self._connection_legs(connection)
+        if not legs:
+            raise ValueError
         cursor = self.rdbms_connection.cursor()
-        # Assuming the connection parameter is a trip object
-        # Fetch trip details and calculate the total price
         cursor.execute("SELECT * FROM Users WHERE email = %s;", (user_email,))
         user = cursor.fetchone()
         if not user:
             raise ValueError
+        # Trips generated from a schedule (lazy_trips) are stored before booking
+        trip_ids = [leg[0] if leg[0] is not None else self.utility.materialize_trip(leg) for leg in legs]
 
+        try:
+            result = execute_statements(cursor, purchase_statements(user[0], trip_ids, also_reserve_seats, is_route))
+            self.rdbms_connection.commit()
+        except Exception as e:
+            self.rdbms_connection.rollback()
+            raise e
+        return result
 
-        # Insert into Tickets table
-        cursor.execute(
-            "INSERT INTO Tickets (user_id, trip_id, reserved_seat) VALUES (%s, %s, %s);",
-            (user[0], connection[0], also_reserve_seats)
-        )
-        ticket_id = cursor.lastrowid
-        
-        if also_reserve_seats:
-            # Check available seats
-            available_seats = self.utility.check_available_seats(connection[0])
-            if available_seats > 0:
-                # Insert into Reservations table
+    @staticmethod
+    def _connection_legs(connection) -> Tuple[bool, List]:
+        """
+        A connection is a single Trips row or a route (list of Trips rows)
+        """
+        is_route = len(connection) > 0 and isinstance(connection[0], (list, tuple))
+        return is_route, list(connection) if is_route else [connection]
+
+    @pooled
+    def buy_tickets(self, purchases: List[Tuple[str, object, bool]]) -> List[Tuple[PurchaseOutcome, List[int]]]:
+        """
+        Book many (user_email, connection, also_reserve_seats) entries at once, e.g. for groups.
+        Users, trips and seat counters are handled with one set-based query each and everything
+        is inserted in a single transaction. Seats are granted in entry order while they last; an
+        entry that wanted seats on a full leg is booked without seat. Unknown users or trips are rejected.
+
+        Returns (outcome, ticket ids) for every entry.
+        """
+        cursor = self.rdbms_connection.cursor()
+        outcomes = [(PurchaseOutcome.REJECTED, [])] * len(purchases)
+        if not purchases:
+            return outcomes
+
+        emails = list(dict.fromkeys(purchase[0] for purchase in purchases))
+        cursor.execute(f"SELECT email, user_id FROM Users WHERE email IN ({', '.join(['%s'] * len(emails))});", tuple(emails))
+        user_ids = dict(cursor.fetchall())
+
+        entries = []
+        for index, (user_email, connection, also_reserve_seats) in enumerate(purchases):
+            _, legs = self._connection_legs(connection)
+            if user_email not in user_ids or not legs:
+                continue
+            # Trips generated from a schedule (lazy_trips) are stored before booking
+            trip_ids = [leg[0] if leg[0] is not None else self.utility.materialize_trip(leg) for leg in legs]
+            entries.append((index, user_ids[user_email], trip_ids, also_reserve_seats))
+        all_trips = list(dict.fromkeys(trip_id for entry in entries for trip_id in entry[2]))
+        if not all_trips:
+            return outcomes
+
+        try:
+            cursor.execute(
+                f"""
+                SELECT tr.trip_id, t.capacity FROM Trips tr JOIN Trains t ON tr.train_id = t.train_id
+                WHERE tr.trip_id IN ({', '.join(['%s'] * len(all_trips))});
+                """, tuple(all_trips)
+            )
+            capacities = dict(cursor.fetchall())
+            entries = [entry for entry in entries if all(trip_id in capacities for trip_id in entry[2])]
+
+            # Lock the counters of the trips where seats are requested
+            seat_trips = list(dict.fromkeys(trip_id for entry in entries if entry[3] for trip_id in entry[2]))
+            available = {}
+            if seat_trips:
+                placeholders = ", ".join(["%s"] * len(seat_trips))
+                cursor.execute(f"INSERT IGNORE INTO TripSeats (trip_id) VALUES {', '.join(['(%s)'] * len(seat_trips))};", tuple(seat_trips))
+                cursor.execute(f"SELECT trip_id, reserved_seats FROM TripSeats WHERE trip_id IN ({placeholders}) FOR UPDATE;", tuple(seat_trips))
+                available = {trip_id: capacities[trip_id] - reserved for trip_id, reserved in cursor.fetchall()}
+
+            reserved = {}
+            tickets = []
+            for index, user_id, trip_ids, also_reserve_seats in entries:
+                with_seat = also_reserve_seats and all(available[trip_id] - reserved.get(trip_id, 0) > 0 for trip_id in trip_ids)
+                if with_seat:
+                    for trip_id in trip_ids:
+                        reserved[trip_id] = reserved.get(trip_id, 0) + 1
+                tickets.extend((index, user_id, trip_id, with_seat) for trip_id in trip_ids)
+            if not tickets:
+                return outcomes
+
+            if reserved:
                 cursor.execute(
-                    "INSERT INTO Reservations (ticket_id) VALUES (%s);", (ticket_id,)
+                    f"""
+                    UPDATE TripSeats SET reserved_seats = reserved_seats + CASE trip_id {' '.join(['WHEN %s THEN %s'] * len(reserved))} END
+                    WHERE trip_id IN ({', '.join(['%s'] * len(reserved))});
+                    """, tuple(value for item in reserved.items() for value in item) + tuple(reserved)
                 )
-            else:
-                raise ValueError
-        self.rdbms_connection.commit()
-        return cursor.lastrowid
 
+            # One journey per booked entry. A multi-row insert does not always get consecutive ids
+            # (innodb_autoinc_lock_mode=2, Galera): journeys are inserted one by one and the tickets
+            # are read back by (journey, trip)
+            journey_ids = {}
+            for index, user_id, _, _ in tickets:
+                if index not in journey_ids:
+                    cursor.execute("INSERT INTO Journeys (user_id) VALUES (%s);", (user_id,))
+                    journey_ids[index] = cursor.lastrowid
+            cursor.execute(
+                f"INSERT INTO Tickets (user_id, trip_id, journey_id, reserved_seat) VALUES {', '.join(['(%s, %s, %s, %s)'] * len(tickets))};",
+                tuple(value for index, user_id, trip_id, with_seat in tickets for value in (user_id, trip_id, journey_ids[index], with_seat))
+            )
+            journeys = list(journey_ids.values())
+            placeholders = ", ".join(["%s"] * len(journeys))
+            cursor.execute(f"SELECT journey_id, trip_id, ticket_id FROM Tickets WHERE journey_id IN ({placeholders});", tuple(journeys))
+            stored = {(journey_id, trip_id): ticket_id for journey_id, trip_id, ticket_id in cursor.fetchall()}
+            ticket_ids = [stored[(journey_ids[index], trip_id)] for index, _, trip_id, _ in tickets]
+            cursor.execute(JOURNEY_TOTALS_QUERY.format(journeys=placeholders), tuple(journeys))
+            seat_journeys = list(dict.fromkeys(journey_ids[ticket[0]] for ticket in tickets if ticket[3]))
+            if seat_journeys:
+                cursor.execute(
+                    f"""
+                    INSERT INTO Reservations (ticket_id) SELECT ticket_id FROM Tickets
+                    WHERE journey_id IN ({', '.join(['%s'] * len(seat_journeys))}) ORDER BY ticket_id;
+                    """, tuple(seat_journeys)
+                )
+            self.rdbms_connection.commit()
+        except Exception as e:
+            self.rdbms_connection.rollback()
+            raise e
+
+        outcomes = list(outcomes)
+        for ticket_id, (index, _, _, with_seat) in zip(ticket_ids, tickets):
+            outcome = PurchaseOutcome.BOOKED if with_seat else PurchaseOutcome.BOOKED_WITHOUT_SEAT
+            outcomes[index] = (outcome, outcomes[index][1] + [ticket_id])
+        return outcomes
+
+    @pooled
     def get_purchase_history(self, user_email: str) -> List:
         """
         Access Purchase History
         """
         cursor = self.rdbms_connection.cursor()
         # Implementation here
-        cursor.execute("SELECT * FROM Users WHERE email = %s;", (user_email,))
+        cursor.execute("SELECT user_id FROM Users WHERE email = %s;", (user_email,))
         user = cursor.fetchone()
         if not user:
             return []
         
-        cursor.execute("""
-                       SELECT *
-                        FROM Purchase
-                        WHERE user_email = %s
-                        ORDER BY purchase_time DESC;
-                        """, (user_email,))
+        cursor.execute(PURCHASE_HISTORY_QUERY.format(after=""), (user[0],))
         records = cursor.fetchall()
         return records
 
+    @pooled
+    def get_purchase_history_page(self, user_email: str, limit: int = 100,
+                                  after: Optional[Tuple[datetime, int]] = None) -> Tuple[List, Optional[Tuple[datetime, int]]]:
+        """
+        One page of the purchase history, newest first, and the (purchase_time, ticket_id) key to pass
+        as `after` for the next page (None on the last page). Rows are those of get_purchase_history.
+        """
+        if limit < 1:
+            raise ValueError
+        cursor = self.rdbms_connection.cursor()
+        cursor.execute("SELECT user_id FROM Users WHERE email = %s;", (user_email,))
+        user = cursor.fetchone()
+        if not user:
+            cursor.close()
+            return [], None
+        cursor.execute(*purchase_history_page_query(user[0], limit, after))
+        records = cursor.fetchall()
+        cursor.close()
+        return purchase_history_page(records, limit)
+
+    def iter_purchase_history(self, user_email: str, chunk_size: int = 1000):
+        """
+        Generator over the purchase history, newest first, fetched `chunk_size` rows at a time.
+        The connection is only held while a chunk is read.
+        """
+        after = None
+        while True:
+            records, after = self.get_purchase_history_page(user_email, chunk_size, after)
+            yield from records
+            if after is None:
+                return
+
+    @pooled
+    def get_journey_history(self, user_email: str) -> List:
+        """
+        Purchases of the user, newest first, as (journey_id, booked_at, total_price, departure, arrival,
+        legs, reserved_seats) rows; a purchase is a single trip or a whole route (see buy_ticket).
+        Journeys whose trains were all cancelled are left out.
+        """
+        cursor = self.rdbms_connection.cursor()
+        cursor.execute(
+            """
+            SELECT j.journey_id, j.booked_at, j.total_price, j.departure, j.arrival, j.legs, j.reserved_seats
+            FROM Journeys j JOIN Users u ON j.user_id = u.user_id
+            WHERE u.email = %s AND j.legs > 0
+            ORDER BY j.booked_at DESC, j.journey_id DESC;
+            """, (user_email,)
+        )
+        records = cursor.fetchall()
+        cursor.close()
+        return records
+
+    @pooled
+    def add_holiday_calendar(self, name: str, dates: List[date]) -> None:
+        """
+        Create the holiday calendar if it does not exist and add the dates to it.
+        Schedules whose ServicePattern uses the calendar do not run on these dates.
+        """
+        cursor = self.rdbms_admin_connection.cursor()
+        try:
+            cursor.execute("INSERT IGNORE INTO HolidayCalendars (name) VALUES (%s);", (name,))
+            cursor.execute("SELECT calendar_id FROM HolidayCalendars WHERE name = %s;", (name,))
+            calendar_id = cursor.fetchone()[0]
+            cursor.executemany("INSERT IGNORE INTO HolidayDates (calendar_id, date) VALUES (%s, %s);",
+                               [(calendar_id, day) for day in dates])
+            self.rdbms_admin_connection.commit()
+        except Exception as e:
+            self.rdbms_admin_connection.rollback()
+            raise e
+        finally:
+            cursor.close()
+
+    @pooled
     def add_user(self, user_email: str, user_details) -> None:
         """
         Add a new user to the system with given email and details.
@@ -513,6 +1439,7 @@ class Traits(TraitsInterface):
             raise ValueError
         self.rdbms_admin_connection.commit()
 
+    @pooled
     def delete_user(self, user_email: str) -> None:
         """
         Delete the user from the db if the user exists.
@@ -524,14 +1451,24 @@ class Traits(TraitsInterface):
         # Implementation here
         cursor.execute("SET AUTOCOMMIT = 0;")
         cursor.execute("SET SESSION TRANSACTION ISOLATION LEVEL SERIALIZABLE;")
+        cursor.execute("START TRANSACTION;")
+        # Cascaded deletes do not fire triggers, so release the reserved seats here
         cursor.execute("""
-                       START TRANSACTION;
-                       DELETE FROM Users WHERE email = %s;
-                       COMMIT;
+                       UPDATE TripSeats s
+                       JOIN (SELECT t.trip_id, COUNT(*) AS seats
+                             FROM Reservations r
+                             JOIN Tickets t ON r.ticket_id = t.ticket_id
+                             JOIN Users u ON t.user_id = u.user_id
+                             WHERE u.email = %s
+                             GROUP BY t.trip_id) released ON s.trip_id = released.trip_id
+                       SET s.reserved_seats = s.reserved_seats - released.seats;
                        """, (user_email,))
+        cursor.execute("DELETE FROM Users WHERE email = %s;", (user_email,))
+        self.rdbms_admin_connection.commit()
         # The data should delete itself on the basis of cascade and trigger
        
 
+    @pooled
     def add_train(self, train_key: TraitsKey, train_capacity: int, train_status: TrainStatus) -> None:
         """
         Add new trains to the system with given code.
@@ -547,19 +1484,83 @@ class Traits(TraitsInterface):
             cursor.execute(insert_train_query, (train_key.to_string(),  train_capacity, train_status.value))
 
             self.rdbms_admin_connection.commit()
+            if self.snapshot is not None:
+                self.snapshot.set_train(cursor.lastrowid, train_key.to_string(), train_capacity, train_status.value)
             return cursor.lastrowid
         except Exception as ex:
             raise ValueError
+
+    @pooled
+    def add_trains(self, trains: List[Tuple[TraitsKey, int, TrainStatus]]) -> List[Optional[str]]:
+        """
+        Add many (train_key, train_capacity, train_status) trains with one existence query and one insert.
+        Return None for every added train, "duplicate" or "exists" for the rejected ones.
+        """
+        names = [train_key.to_string() for train_key, _, _ in trains]
+        results = self._duplicates(names)
+        cursor = self.rdbms_admin_connection.cursor()
+        try:
+            existing = self._existing(cursor, "SELECT train_name FROM Trains WHERE train_name IN ({});", names)
+            results = [result or ("exists" if name in existing else None) for name, result in zip(names, results)]
+            accepted = [train for train, result in zip(trains, results) if result is None]
+            if accepted:
+                cursor.execute(f"INSERT INTO Trains (train_name, capacity, status) VALUES {', '.join(['(%s, %s, %s)'] * len(accepted))};",
+                               tuple(value for train_key, capacity, status in accepted for value in (train_key.to_string(), capacity, status.value)))
+                self.rdbms_admin_connection.commit()
+                if self.snapshot is not None:
+                    train_ids = self._ids(cursor, "SELECT train_name, train_id FROM Trains WHERE train_name IN ({});",
+                                          [train_key.to_string() for train_key, _, _ in accepted])
+                    for train_key, capacity, status in accepted:
+                        self.snapshot.set_train(train_ids[train_key.to_string()], train_key.to_string(), capacity, status.value)
+        except Exception as e:
+            self.rdbms_admin_connection.rollback()
+            raise e
+        finally:
+            cursor.close()
+        return results
+
+    @staticmethod
+    def _duplicates(names: List) -> List[Optional[str]]:
+        """
+        "duplicate" for the names already seen earlier in the batch
+        """
+        seen = set()
+        results = []
+        for name in names:
+            results.append("duplicate" if name in seen else None)
+            seen.add(name)
+        return results
+
+    @staticmethod
+    def _existing(cursor, query: str, names: List) -> set:
+        """
+        The names already stored, `query` selects them with an IN ({}) list
+        """
+        names = list(set(names))
+        if not names:
+            return set()
+        cursor.execute(query.format(", ".join(["%s"] * len(names))), tuple(names))
+        return {row[0] for row in cursor.fetchall()}
+
+    @staticmethod
+    def _ids(cursor, query: str, names: List) -> Dict:
+        """
+        The ids of the stored names, `query` selects (name, id) with an IN ({}) list. Ids are read
+        back as a multi-row insert does not always get consecutive ids (innodb_autoinc_lock_mode=2, Galera)
+        """
+        cursor.execute(query.format(", ".join(["%s"] * len(names))), tuple(names))
+        return dict(cursor.fetchall())
         
+    @pooled
     def update_train_details(self, train_key: TraitsKey, train_capacity: Optional[int] = None, train_status: Optional[TrainStatus] = None) -> None:
         """
         Update the details of existing train if specified (i.e., not None), otherwise do nothing.
         """
         # Implementation here
         cursor = self.rdbms_admin_connection.cursor()
-        cursor.execute("SELECT COUNT(*) FROM Trains WHERE train_name = %s;", (train_key.to_string(),))
-
-        if cursor.fetchone()[0] == 0:
+        cursor.execute("SELECT train_id FROM Trains WHERE train_name = %s;", (train_key.to_string(),))
+        train = cursor.fetchone()
+        if not train:
             raise ValueError
         try:
             if train_capacity is not None:
@@ -576,9 +1577,15 @@ class Traits(TraitsInterface):
             
             
             self.rdbms_admin_connection.commit()
+            if self.snapshot is not None:
+                self.snapshot.update_train(train_key.to_string(), train_capacity,
+                                           train_status.value if train_status is not None else None)
+            if self.search_cache is not None and train_status is not None:
+                self.search_cache.invalidate_train(train[0])
         except Exception as Ex:
             raise Ex
         
+    @pooled
     def delete_train(self, train_key: TraitsKey) -> None:
         """
         Drop the train from the system. Note that all its schedules, reservations, etc. must be also dropped.
@@ -586,22 +1593,27 @@ class Traits(TraitsInterface):
         # Implementation here
         cursor = self.rdbms_admin_connection.cursor()
         try:
+            train = None
+            if self.search_cache is not None:
+                cursor.execute("SELECT train_id FROM Trains WHERE train_name = %s;", (train_key.to_string(),))
+                train = cursor.fetchone()
             cursor.execute("SET AUTOCOMMIT = 0;")
             cursor.execute("SET SESSION TRANSACTION ISOLATION LEVEL SERIALIZABLE;")
             # Delete the train and all related records (assuming cascading deletes are set up)
-            delete_train_query = """
-                START TRANSACTION;
-                DELETE FROM Trains WHERE train_name = %s;
-                COMMIT;
-                """
+            delete_train_query = "DELETE FROM Trains WHERE train_name = %s;"
             cursor.execute(delete_train_query, (train_key.to_string(),))
-            # self.rdbms_admin_connection.commit()
+            self.rdbms_admin_connection.commit()
+            if self.snapshot is not None:
+                self.snapshot.refresh_train(self.rdbms_admin_connection, train_key.to_string())
+            if train is not None:
+                self.search_cache.invalidate_train(train[0])
         except Exception as e:
             self.rdbms_admin_connection.rollback()
             raise e
         finally:
             cursor.close()
 
+    @pooled
     def add_train_station(self, train_station_key: TraitsKey, train_station_details) -> None:
         """
         Add a train station
@@ -615,24 +1627,52 @@ class Traits(TraitsInterface):
             if cursor.fetchone()[0] > 0:
                 raise ValueError
 
-            # Insert the station if it doesn't exist
-            insert_station_query = "INSERT INTO Stations (name) VALUES (%s)"
-            cursor.execute(insert_station_query, (train_station_key.to_string(),))
-            self.rdbms_admin_connection.commit()
-
-            # Insert the station as a node in Neo4j
-            with self.neo4j_driver.session() as session:
-                create_node_query = """
-                CREATE (s:Station {name: $name, details: $details})
-                """
-                session.run(create_node_query, name=train_station_key.to_string(), details=train_station_details)
+            # Insert the station in both stores at once
+            with graph_write(self.utility, self.rdbms_admin_connection, "station", train_station_key.to_string()) as writer:
+                writer.submit(CREATE_STATION_QUERY, name=train_station_key.to_string(), details=train_station_details)
+                insert_station_query = "INSERT INTO Stations (name) VALUES (%s)"
+                cursor.execute(insert_station_query, (train_station_key.to_string(),))
+                station_id = cursor.lastrowid
+            if self.snapshot is not None:
+                self.snapshot.add_station(station_id, train_station_key.to_string())
         
         except Exception as e:
             self.rdbms_admin_connection.rollback()
             raise ValueError
         finally:
             cursor.close()
+
+    @pooled
+    def add_train_stations(self, stations: List[Tuple[TraitsKey, object]]) -> List[Optional[str]]:
+        """
+        Add many (train_station_key, train_station_details) stations with one existence query,
+        one multi-row insert and a single UNWIND in Neo4j.
+        Return None for every added station, "duplicate" or "exists" for the rejected ones.
+        """
+        names = [station_key.to_string() for station_key, _ in stations]
+        results = self._duplicates(names)
+        cursor = self.rdbms_admin_connection.cursor()
+        try:
+            existing = self._existing(cursor, "SELECT name FROM Stations WHERE name IN ({});", names)
+            results = [result or ("exists" if name in existing else None) for name, result in zip(names, results)]
+            accepted = [(name, details) for name, (_, details), result in zip(names, stations, results) if result is None]
+            if accepted:
+                with graph_write(self.utility, self.rdbms_admin_connection, "station", f"{len(accepted)} stations") as writer:
+                    writer.submit(CREATE_STATIONS_QUERY, rows=[{"name": name, "details": details} for name, details in accepted])
+                    cursor.execute(f"INSERT INTO Stations (name) VALUES {', '.join(['(%s)'] * len(accepted))};",
+                                   tuple(name for name, _ in accepted))
+                if self.snapshot is not None:
+                    station_ids = self._ids(cursor, "SELECT name, station_id FROM Stations WHERE name IN ({});", [name for name, _ in accepted])
+                    for name, _ in accepted:
+                        self.snapshot.add_station(station_ids[name], name)
+        except Exception as e:
+            self.rdbms_admin_connection.rollback()
+            raise e
+        finally:
+            cursor.close()
+        return results
     
+    @pooled
     def connect_train_stations(self, starting_train_station_key: TraitsKey, ending_train_station_key: TraitsKey, travel_time_in_minutes: int)  -> None:
         """
         Connect to train station so trains can travel on them
@@ -648,28 +1688,104 @@ class Traits(TraitsInterface):
             cursor = self.rdbms_admin_connection.cursor()
      
             # Check if station already exists
-            check_station_query = "SELECT COUNT(*) FROM Connections WHERE starting_station = %s AND ending_station = %s"
-            cursor.execute(check_station_query, (starting_train_station_key.to_string(), ending_train_station_key.to_string()))
+            cursor.execute("SELECT name, station_id FROM Stations WHERE name IN (%s, %s)",
+                           (starting_train_station_key.to_string(), ending_train_station_key.to_string()))
+            station_ids = dict(cursor.fetchall())
+            starting_station_id = station_ids[starting_train_station_key.to_string()]
+            ending_station_id = station_ids[ending_train_station_key.to_string()]
+            check_station_query = "SELECT COUNT(*) FROM Connections WHERE starting_station_id = %s AND ending_station_id = %s"
+            cursor.execute(check_station_query, (starting_station_id, ending_station_id))
             if cursor.fetchone()[0] > 0:
                 raise ValueError
 
             # Insert the station if it doesn't exist
-            insert_station_query = "INSERT INTO Connections (starting_station, ending_station, travel_time) VALUES (%s, %s, %s)"
-            cursor.execute(insert_station_query, (starting_train_station_key.to_string(), ending_train_station_key.to_string(), travel_time_in_minutes))
+            insert_station_query = "INSERT INTO Connections (starting_station_id, ending_station_id, travel_time) VALUES (%s, %s, %s)"
+            cursor.execute(insert_station_query, (starting_station_id, ending_station_id, travel_time_in_minutes))
             # For the other way around
-            cursor.execute(insert_station_query, (ending_train_station_key.to_string(), starting_train_station_key.to_string(), travel_time_in_minutes))
+            cursor.execute(insert_station_query, (ending_station_id, starting_station_id, travel_time_in_minutes))
             
             self.rdbms_admin_connection.commit()
         except Exception as e:
             raise e
 
+    @pooled
+    def connect_many_train_stations(self, connections: List[Tuple[TraitsKey, TraitsKey, int]]) -> List[Optional[str]]:
+        """
+        Connect many (starting_train_station_key, ending_train_station_key, travel_time_in_minutes) pairs,
+        in both directions as connect_train_stations, with one query for the stations, one for the
+        existing connections and one multi-row insert.
+        Return None for every added connection, the reason why it was rejected otherwise.
+        """
+        pairs = [(start.to_string(), end.to_string()) for start, end, _ in connections]
+        results = self._duplicates([frozenset(pair) for pair in pairs])
+        cursor = self.rdbms_admin_connection.cursor()
+        try:
+            names = [name for pair in pairs for name in pair]
+            station_ids = {}
+            if names:
+                names = list(set(names))
+                cursor.execute(f"SELECT name, station_id FROM Stations WHERE name IN ({', '.join(['%s'] * len(names))});", tuple(names))
+                station_ids = dict(cursor.fetchall())
+            existing = set()
+            if station_ids:
+                cursor.execute(f"SELECT starting_station_id, ending_station_id FROM Connections "
+                               f"WHERE starting_station_id IN ({', '.join(['%s'] * len(station_ids))});", tuple(station_ids.values()))
+                existing = {frozenset(row) for row in cursor.fetchall()}
+            accepted = []
+            for i, ((start, end), (_, _, travel_time)) in enumerate(zip(pairs, connections)):
+                if results[i] is not None:
+                    continue
+                if start == end:
+                    results[i] = "same_station"
+                elif start not in station_ids or end not in station_ids:
+                    results[i] = "unknown_station"
+                elif travel_time < 1 or travel_time > 60:
+                    results[i] = "invalid_travel_time"
+                elif frozenset((station_ids[start], station_ids[end])) in existing:
+                    results[i] = "exists"
+                else:
+                    accepted.append((station_ids[start], station_ids[end], travel_time))
+            if accepted:
+                cursor.execute(f"INSERT INTO Connections (starting_station_id, ending_station_id, travel_time) VALUES "
+                               f"{', '.join(['(%s, %s, %s)'] * (2 * len(accepted)))};",
+                               tuple(value for start, end, travel_time in accepted
+                                     for value in (start, end, travel_time, end, start, travel_time)))
+                self.rdbms_admin_connection.commit()
+        except Exception as e:
+            self.rdbms_admin_connection.rollback()
+            raise e
+        finally:
+            cursor.close()
+        return results
+
+    def _schedule_added(self, train_key: TraitsKey, stops: List[Tuple[TraitsKey, int]], valid_from: str, valid_until: str) -> None:
+        """
+        Bring the snapshot and the search cache up to date after a new schedule
+        """
+        if self.snapshot is not None:
+            self.snapshot.refresh_train(self.rdbms_admin_connection, train_key.to_string())
+        if self.search_cache is not None:
+            self._invalidate_schedule(self.utility.get_connection_edges(), datetime.strptime(valid_from, "%Y-%m-%d").date(),
+                                      datetime.strptime(valid_until, "%Y-%m-%d").date(), {stop_key.to_string() for stop_key, _ in stops})
+
+    def _invalidate_schedule(self, edges: List[Tuple[str, str, int]], valid_from: date, valid_until: date, stations: set) -> None:
+        """
+        Drop the cached searches a schedule over `stations` running from valid_from to valid_until can change
+        """
+        # Only routes starting where the schedule can be reached and ending where it leads can change
+        self.search_cache.invalidate_schedule(valid_from, valid_until, reachable_stations(edges, stations, backward=True),
+                                              reachable_stations(edges, stations))
+
+    @pooled
     def add_schedule(self, train_key: TraitsKey,
                  starting_hours_24_h: int, starting_minutes: int,
                  stops: List[Tuple[TraitsKey, int]], # [station_key, waiting_time]
                  valid_from_day: int, valid_from_month: int, valid_from_year: int,
-                 valid_until_day: int, valid_until_month: int, valid_until_year: int) -> None:
+                 valid_until_day: int, valid_until_month: int, valid_until_year: int,
+                 service: Optional[ServicePattern] = None) -> None:
         """
         Create a schedule for a given train.
+        With a service pattern, it only runs on the days of the pattern (every day by default).
         """
         cursor = self.rdbms_admin_connection.cursor()
         try:
@@ -692,7 +1808,7 @@ class Traits(TraitsInterface):
                 if not station_id:
                     raise ValueError
                 if i != 0:
-                    cursor.execute("SELECT travel_time FROM Connections WHERE starting_station = %s AND ending_station = %s", ( prev_station_name.to_string(),stop_key.to_string(),))
+                    cursor.execute("SELECT travel_time FROM Connections WHERE starting_station_id = %s AND ending_station_id = %s", (prev_station_id, station_id[0],))
                     travel_time = cursor.fetchone()
                     if not travel_time:
                         raise ValueError
@@ -711,30 +1827,224 @@ class Traits(TraitsInterface):
             
             valid_from = f"{valid_from_year}-{valid_from_month:02d}-{valid_from_day:02d}"
             valid_until = f"{valid_until_year}-{valid_until_month:02d}-{valid_until_day:02d}"
-            self.utility.add_schedule(train_id, stop_info[0][0], stop_info[-1][1],f"{starting_hours_24_h}:{starting_minutes}:00", stop_info[-1][3], valid_from, valid_until )
-            dates = self.utility.get_dates(valid_from_day, valid_from_month, valid_from_year,
-                 valid_until_day, valid_until_month, valid_until_year)
-            insert_trip_query = "INSERT INTO Trips (train_id, starting_station_id, ending_station_id, date, start_time, end_time) VALUES (%s,%s,%s,%s,%s,%s)"
-            with self.neo4j_driver.session() as session:
-                for ind_date in dates:
-                    
-                    for stop in stop_info:
-                        cursor.execute(insert_trip_query,(train_id, stop[0], stop[1], ind_date[0], stop[2], stop[3]) )
-                        query = """
-                        MATCH (a:Station {name: $start_station_name}), (b:Station {name: $end_station_name})
-                        CREATE (a)-[:TRIP {trip_id: $trip_id, departure_time: $departure_time, travel_time: $travel_time, arrival_time: $arrival_time, train_name: $train_name}]->(b)
-                        """
-                        time_object1 = datetime.strptime(stop[2], '%H:%M:%S').time()
-                        dep_object = datetime.combine(ind_date[0], time_object1)
-                        time_object2 = datetime.strptime(stop[3], '%H:%M:%S').time()
-                        arr_object = datetime.combine(ind_date[0], time_object2)
-                        session.run(query, trip_id=cursor.lastrowid,start_station_name=stop[4], end_station_name=stop[5], departure_time=dep_object, travel_time=stop[6], arrival_time=arr_object, train_name=train_key.to_string())
-
-
-            # Insert the schedule into the database
-            self.rdbms_admin_connection.commit()
+            calendar_id, holidays = self.utility.get_holidays(service.holiday_calendar) if service and service.holiday_calendar else (None, frozenset())
+            if self.lazy_trips:
+                schedule_id = self.utility.add_schedule(train_id, stop_info[0][0], stop_info[-1][1], f"{starting_hours_24_h}:{starting_minutes}:00", stop_info[-1][3],
+                                                        valid_from, valid_until, service, calendar_id)
+                self.utility.add_schedule_stops(cursor, schedule_id, stop_info)
+                self.rdbms_admin_connection.commit()
+                self._schedule_added(train_key, stops, valid_from, valid_until)
+                return
+            dates = (service or ServicePattern()).days(date(valid_from_year, valid_from_month, valid_from_day),
+                                                       date(valid_until_year, valid_until_month, valid_until_day), holidays)
+            trips = []
+            for ind_date in dates:
+                for stop in stop_info:
+                    departure_time = datetime.combine(ind_date, datetime.strptime(stop[2], '%H:%M:%S').time())
+                    arrival_time = datetime.combine(ind_date, datetime.strptime(stop[3], '%H:%M:%S').time())
+                    trips.append((stop[0], stop[1], departure_time, arrival_time, stop[4], stop[5], stop[6]))
+            # Each chunk of trips goes to Neo4j while the next one is inserted in MariaDB
+            chunk_size = 1000
+            with graph_write(self.utility, self.rdbms_admin_connection, "schedule", train_key.to_string()) as writer:
+                # The schedule is committed with its trips, or not at all
+                self.utility.add_schedule(train_id, stop_info[0][0], stop_info[-1][1], f"{starting_hours_24_h}:{starting_minutes}:00", stop_info[-1][3],
+                                          valid_from, valid_until, service, calendar_id)
+                for i in range(0, len(trips), chunk_size):
+                    chunk = trips[i:i + chunk_size]
+                    trip_ids = self.utility.insert_trips(cursor, train_id, chunk)
+                    writer.submit(CREATE_TRIPS_QUERY, rows=[
+                        {"trip_id": trip_id, "start_station_name": trip[4], "end_station_name": trip[5],
+                         "departure_time": trip[2], "travel_time": trip[6], "arrival_time": trip[3],
+                         "train_name": train_key.to_string()}
+                        for trip_id, trip in zip(trip_ids, chunk)])
+            self._schedule_added(train_key, stops, valid_from, valid_until)
         except Exception as e:
             self.rdbms_admin_connection.rollback()
             raise e
         finally:
             cursor.close()
+
+    @pooled
+    def add_schedules(self, schedules: List[ScheduleSpec], chunk_size: int = 1000) -> List[Optional[str]]:
+        """
+        Create many schedules at once, e.g. when importing a feed. Trains, stations, connections and the
+        stored schedules are read with one query each, feasibility is checked in memory (also between the
+        schedules of the batch) and everything is written with multi-row inserts, the trips in chunks
+        pipelined with Neo4j as in add_schedule.
+
+        Return None for every created schedule, the reason why it was rejected otherwise.
+        """
+        results = [None] * len(schedules)
+        if not schedules:
+            return results
+        cursor = self.rdbms_admin_connection.cursor()
+        try:
+            train_names = list({spec.train_key.to_string() for spec in schedules})
+            cursor.execute(f"SELECT train_name, train_id FROM Trains WHERE train_name IN ({', '.join(['%s'] * len(train_names))});",
+                           tuple(train_names))
+            train_ids = dict(cursor.fetchall())
+            station_names = list({stop_key.to_string() for spec in schedules for stop_key, _ in spec.stops})
+            station_ids = {}
+            if station_names:
+                cursor.execute(f"SELECT name, station_id FROM Stations WHERE name IN ({', '.join(['%s'] * len(station_names))});",
+                               tuple(station_names))
+                station_ids = dict(cursor.fetchall())
+            travel_times = {}
+            if station_ids:
+                cursor.execute(f"SELECT starting_station_id, ending_station_id, travel_time FROM Connections "
+                               f"WHERE starting_station_id IN ({', '.join(['%s'] * len(station_ids))});", tuple(station_ids.values()))
+                travel_times = {(start, end): travel_time for start, end, travel_time in cursor.fetchall()}
+            indexes = ScheduleIndex.load_trains(self.rdbms_admin_connection, list(train_ids.values()),
+                                                min(spec.valid_from for spec in schedules), max(spec.valid_until for spec in schedules))
+            calendars = {}
+
+            accepted = []
+            for i, spec in enumerate(schedules):
+                stop_info, results[i] = self._schedule_stop_info(spec, train_ids, station_ids, travel_times)
+                if results[i] is not None:
+                    continue
+                calendar_id, holidays = None, frozenset()
+                if spec.service is not None and spec.service.holiday_calendar:
+                    name = spec.service.holiday_calendar
+                    if name not in calendars:
+                        try:
+                            calendars[name] = self.utility.get_holidays(name)
+                        except ValueError:
+                            calendars[name] = None
+                    if calendars[name] is None:
+                        results[i] = "unknown_calendar"
+                        continue
+                    calendar_id, holidays = calendars[name]
+                train_id = train_ids[spec.train_key.to_string()]
+                start_time = f"{spec.starting_hours_24_h}:{spec.starting_minutes}:00"
+                results[i] = indexes[train_id].conflict(start_time, stop_info[-1][3], spec.valid_from, spec.valid_until)
+                if results[i] is not None:
+                    continue
+                indexes[train_id].add(start_time, stop_info[-1][3], spec.valid_from, spec.valid_until)
+                accepted.append((spec, train_id, start_time, stop_info, calendar_id, holidays))
+            if not accepted:
+                return results
+
+            if self.lazy_trips:
+                schedule_ids = self._insert_schedules(cursor, accepted)
+                cursor.executemany(
+                    """
+                    INSERT INTO ScheduleStops (schedule_id, stop_index, starting_station_id, ending_station_id, start_time, end_time, travel_time)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s);
+                    """, [(schedule_id, i, stop[0], stop[1], stop[2], stop[3], stop[6])
+                          for schedule_id, (_, _, _, stop_info, _, _) in zip(schedule_ids, accepted) for i, stop in enumerate(stop_info)]
+                )
+                self.rdbms_admin_connection.commit()
+            else:
+                # The schedules are committed with their trips, or not at all
+                with graph_write(self.utility, self.rdbms_admin_connection, "schedule", f"{len(accepted)} schedules") as writer:
+                    self._insert_schedules(cursor, accepted)
+                    chunk = []
+                    for trip in self._batch_trips(accepted):
+                        chunk.append(trip)
+                        if len(chunk) == chunk_size:
+                            self._insert_trip_chunk(cursor, writer, chunk)
+                            chunk = []
+                    if chunk:
+                        self._insert_trip_chunk(cursor, writer, chunk)
+        except Exception as e:
+            self.rdbms_admin_connection.rollback()
+            raise e
+        finally:
+            cursor.close()
+
+        if self.snapshot is not None:
+            for train_name in {spec.train_key.to_string() for spec, *_ in accepted}:
+                self.snapshot.refresh_train(self.rdbms_admin_connection, train_name)
+        if self.search_cache is not None:
+            # One invalidation per train, over the days and the stations of its new schedules
+            edges = self.utility.get_connection_edges()
+            trains = {}
+            for spec, train_id, *_ in accepted:
+                valid_from, valid_until, stations = trains.get(train_id, (spec.valid_from, spec.valid_until, set()))
+                trains[train_id] = (min(valid_from, spec.valid_from), max(valid_until, spec.valid_until),
+                                    stations | {stop_key.to_string() for stop_key, _ in spec.stops})
+            for valid_from, valid_until, stations in trains.values():
+                self._invalidate_schedule(edges, valid_from, valid_until, stations)
+        return results
+
+    def _schedule_stop_info(self, spec: ScheduleSpec, train_ids: Dict, station_ids: Dict, travel_times: Dict) -> Tuple[List, Optional[str]]:
+        """
+        The stop_info of add_schedule computed from prefetched ids, or the reason why the schedule is invalid
+        """
+        if spec.train_key.to_string() not in train_ids:
+            return [], "unknown_train"
+        if len(spec.stops) < 2:
+            return [], "invalid_stops"
+        if not (0 <= spec.starting_hours_24_h <= 23 and 0 <= spec.starting_minutes <= 59):
+            return [], "invalid_time"
+        if spec.valid_until < spec.valid_from:
+            return [], "invalid_dates"
+        if spec.stops[-1][1] < 10:
+            # Last stop to have atleast 10 minute waiting time
+            return [], "last_stop_wait"
+        stop_info = []
+        start_time = f"{spec.starting_hours_24_h}:{spec.starting_minutes}:00"
+        hrs, mins = spec.starting_hours_24_h, spec.starting_minutes
+        for (prev_key, _), (stop_key, waiting_time) in zip(spec.stops, spec.stops[1:]):
+            prev_station_id, station_id = station_ids.get(prev_key.to_string()), station_ids.get(stop_key.to_string())
+            if prev_station_id is None or station_id is None:
+                return [], "unknown_station"
+            travel_time = travel_times.get((prev_station_id, station_id))
+            if travel_time is None:
+                return [], "not_connected"
+            end_time, hrs, mins = self.utility.add_travel_time(hrs, mins, travel_time)
+            stop_info.append([prev_station_id, station_id, start_time, end_time, prev_key.to_string(), stop_key.to_string(), travel_time])
+            start_time, hrs, mins = self.utility.add_travel_time(hrs, mins, waiting_time)
+        return stop_info, None
+
+    @staticmethod
+    def _insert_schedules(cursor, accepted: List) -> List[int]:
+        """
+        Insert the Schedules and ScheduleExceptions rows of the accepted schedules of add_schedules
+        """
+        cursor.execute(
+            f"""
+            INSERT INTO Schedules (train_id, starting_station_id, ending_station_id, start_time, end_time, valid_from, valid_until, weekdays, calendar_id)
+            VALUES {', '.join(['(%s, %s, %s, %s, %s, %s, %s, %s, %s)'] * len(accepted))};
+            """, tuple(value for spec, train_id, start_time, stop_info, calendar_id, _ in accepted
+                       for value in (train_id, stop_info[0][0], stop_info[-1][1], start_time, stop_info[-1][3], spec.valid_from,
+                                     spec.valid_until, spec.service.weekdays if spec.service else EVERY_DAY, calendar_id))
+        )
+        # Ids are read back by (train, valid_from, start time), which is unique since schedules of the same train cannot overlap
+        train_ids = list({train_id for _, train_id, *_ in accepted})
+        cursor.execute(
+            f"""
+            SELECT schedule_id, train_id, valid_from, start_time FROM Schedules
+            WHERE train_id IN ({', '.join(['%s'] * len(train_ids))}) AND valid_from BETWEEN %s AND %s;
+            """, tuple(train_ids) + (min(spec.valid_from for spec, *_ in accepted), max(spec.valid_from for spec, *_ in accepted))
+        )
+        ids = {(train_id, valid_from, start_time): schedule_id for schedule_id, train_id, valid_from, start_time in cursor.fetchall()}
+        schedule_ids = [ids[(train_id, spec.valid_from, datetime.strptime(start_time, '%H:%M:%S') - datetime(1900, 1, 1))]
+                        for spec, train_id, start_time, *_ in accepted]
+        exceptions = [(schedule_id, day, runs) for schedule_id, (spec, *_) in zip(schedule_ids, accepted) if spec.service
+                      for days, runs in ((spec.service.added, True), (spec.service.removed - spec.service.added, False))
+                      for day in sorted(days)]
+        if exceptions:
+            cursor.executemany("INSERT INTO ScheduleExceptions (schedule_id, date, runs) VALUES (%s, %s, %s);", exceptions)
+        return schedule_ids
+
+    @staticmethod
+    def _batch_trips(accepted: List):
+        """
+        Dated trips of the accepted schedules of add_schedules, generated lazily
+        """
+        for spec, train_id, _, stop_info, _, holidays in accepted:
+            legs = [(stop, datetime.strptime(stop[2], '%H:%M:%S').time(), datetime.strptime(stop[3], '%H:%M:%S').time())
+                    for stop in stop_info]
+            for day in (spec.service or ServicePattern()).days(spec.valid_from, spec.valid_until, holidays):
+                for stop, departure, arrival in legs:
+                    yield (train_id, stop[0], stop[1], datetime.combine(day, departure), datetime.combine(day, arrival),
+                           stop[4], stop[5], stop[6], spec.train_key.to_string())
+
+    def _insert_trip_chunk(self, cursor, writer, chunk: List) -> None:
+        trip_ids = self.utility.insert_train_trips(cursor, chunk, len(chunk))
+        writer.submit(CREATE_TRIPS_QUERY, rows=[
+            {"trip_id": trip_id, "start_station_name": trip[5], "end_station_name": trip[6],
+             "departure_time": trip[3], "travel_time": trip[7], "arrival_time": trip[4], "train_name": trip[8]}
+            for trip_id, trip in zip(trip_ids, chunk)])
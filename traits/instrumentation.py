@@ -0,0 +1,422 @@
+import json
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from functools import wraps
+from typing import Callable, Dict, List, Optional
+
+# Upper bounds of the histogram buckets (milliseconds, round trips, rows, ...), the last one is open
+BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, float("inf"))
+# Same statement repeated at least this many times in a call, a likely N+1 pattern
+REPEATED_QUERY_THRESHOLD = 5
+
+
+class QueryTrace:
+    """
+    A single SQL statement or Cypher query run during a call
+    """
+
+    def __init__(self, store: str, text: str) -> None:
+        self.store = store
+        self.text = " ".join(text.split())
+        self.ms = 0.0
+        self.rows = 0
+        self.db_hits = None
+        self.result_available_after = None
+        self.result_consumed_after = None
+
+    def to_dict(self) -> Dict:
+        return dict(vars(self))
+
+
+class CallTrace:
+    """
+    What a public Traits/TraitsUtility method did: wall time, SQL round trips and rows,
+    Cypher queries and the counters of their ResultSummary
+    """
+
+    def __init__(self, method: str) -> None:
+        self.method = method
+        self.started = time.time()
+        self.wall_ms = 0.0
+        self.error = None
+        self.queries: List[QueryTrace] = []
+        self._lock = threading.Lock()
+
+    def add(self, query: QueryTrace) -> QueryTrace:
+        # Neo4j writes of add_schedule run on a worker thread (see traits.pipeline)
+        with self._lock:
+            self.queries.append(query)
+        return query
+
+    def _of(self, store: str) -> List[QueryTrace]:
+        return [query for query in self.queries if query.store == store]
+
+    @property
+    def sql_round_trips(self) -> int:
+        return len(self._of("sql"))
+
+    @property
+    def sql_rows(self) -> int:
+        return sum(query.rows for query in self._of("sql"))
+
+    @property
+    def sql_ms(self) -> float:
+        return sum(query.ms for query in self._of("sql"))
+
+    @property
+    def cypher_queries(self) -> int:
+        return len(self._of("cypher"))
+
+    @property
+    def cypher_rows(self) -> int:
+        return sum(query.rows for query in self._of("cypher"))
+
+    @property
+    def cypher_ms(self) -> float:
+        return sum(query.ms for query in self._of("cypher"))
+
+    @property
+    def db_hits(self) -> Optional[int]:
+        hits = [query.db_hits for query in self._of("cypher") if query.db_hits is not None]
+        return sum(hits) if hits else None
+
+    @property
+    def result_available_after(self) -> int:
+        return sum(query.result_available_after or 0 for query in self._of("cypher"))
+
+    @property
+    def python_ms(self) -> float:
+        """
+        Wall time not spent waiting on MariaDB or Neo4j
+        """
+        return max(0.0, self.wall_ms - self.sql_ms - self.cypher_ms)
+
+    def repeated_queries(self, threshold: int = REPEATED_QUERY_THRESHOLD) -> Dict[str, int]:
+        counts = {}
+        for query in self.queries:
+            counts[query.text] = counts.get(query.text, 0) + 1
+        return {text: count for text, count in counts.items() if count >= threshold}
+
+    def metrics(self) -> Dict[str, float]:
+        return {
+            "wall_ms": self.wall_ms,
+            "python_ms": self.python_ms,
+            "sql_round_trips": self.sql_round_trips,
+            "sql_rows": self.sql_rows,
+            "cypher_queries": self.cypher_queries,
+            "cypher_rows": self.cypher_rows,
+            "result_available_after": self.result_available_after,
+        }
+
+    def to_dict(self) -> Dict:
+        return dict(method=self.method, started=self.started, error=self.error, db_hits=self.db_hits,
+                    repeated_queries=self.repeated_queries(), queries=[query.to_dict() for query in self.queries],
+                    **self.metrics())
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram (see BUCKETS)
+    """
+
+    def __init__(self) -> None:
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, p: float) -> float:
+        """
+        Upper bound of the bucket holding the p-th value (the maximum for the open bucket)
+        """
+        rank = p * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if count and seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self) -> Dict:
+        return {"count": self.count, "sum": self.total, "max": self.max,
+                "p50": self.percentile(0.5), "p95": self.percentile(0.95), "p99": self.percentile(0.99),
+                "buckets": {str(bound): count for bound, count in zip(BUCKETS, self.counts) if count}}
+
+
+class InstrumentedCursor:
+    def __init__(self, cursor, instrumentation: "Instrumentation") -> None:
+        self.cursor = cursor
+        self.instrumentation = instrumentation
+        self._query = None
+
+    def _timed(self, text: Optional[str], function, *args, **kwargs):
+        trace = self.instrumentation.current()
+        if trace is None:
+            return function(*args, **kwargs)
+        if text is not None:
+            self._query = trace.add(QueryTrace("sql", text))
+        begin = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            if self._query is not None:
+                self._query.ms += (time.perf_counter() - begin) * 1000
+
+    def execute(self, operation, params=None, *args, **kwargs):
+        return self._timed(operation, self.cursor.execute, operation, params, *args, **kwargs)
+
+    def executemany(self, operation, seq_params, *args, **kwargs):
+        # Multi-row INSERTs are sent as one statement, anything else row by row
+        result = self._timed(operation, self.cursor.executemany, operation, seq_params, *args, **kwargs)
+        trace = self.instrumentation.current()
+        if trace is not None and not operation.lstrip().upper().startswith("INSERT"):
+            for _ in range(len(seq_params) - 1):
+                trace.add(QueryTrace("sql", operation))
+        return result
+
+    def _rows(self, rows: int) -> None:
+        if self._query is not None and self.instrumentation.current() is not None:
+            self._query.rows += rows
+
+    def fetchone(self):
+        row = self._timed(None, self.cursor.fetchone)
+        self._rows(row is not None)
+        return row
+
+    def fetchall(self):
+        rows = self._timed(None, self.cursor.fetchall)
+        self._rows(len(rows))
+        return rows
+
+    def fetchmany(self, *args, **kwargs):
+        rows = self._timed(None, self.cursor.fetchmany, *args, **kwargs)
+        self._rows(len(rows))
+        return rows
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+
+class InstrumentedConnection:
+    def __init__(self, connection, instrumentation: "Instrumentation") -> None:
+        self.target = connection
+        self.instrumentation = instrumentation
+
+    def cursor(self, *args, **kwargs):
+        return InstrumentedCursor(self.target.cursor(*args, **kwargs), self.instrumentation)
+
+    def _round_trip(self, statement: str, function):
+        trace = self.instrumentation.current()
+        if trace is None:
+            return function()
+        query = trace.add(QueryTrace("sql", statement))
+        begin = time.perf_counter()
+        try:
+            return function()
+        finally:
+            query.ms += (time.perf_counter() - begin) * 1000
+
+    def commit(self):
+        return self._round_trip("COMMIT", self.target.commit)
+
+    def rollback(self):
+        return self._round_trip("ROLLBACK", self.target.rollback)
+
+    def __getattr__(self, name):
+        return getattr(self.target, name)
+
+
+class InstrumentedResult:
+    def __init__(self, result, query: QueryTrace) -> None:
+        self.result = result
+        self.query = query
+        self._summarized = False
+
+    def _summarize(self, summary) -> None:
+        if self._summarized:
+            return
+        self._summarized = True
+        self.query.result_available_after = summary.result_available_after
+        self.query.result_consumed_after = summary.result_consumed_after
+        if summary.profile:
+            self.query.db_hits = _db_hits(summary.profile)
+
+    def __iter__(self):
+        begin = time.perf_counter()
+        for record in self.result:
+            self.query.rows += 1
+            yield record
+        self.query.ms += (time.perf_counter() - begin) * 1000
+        self._summarize(self.result.consume())
+
+    def consume(self):
+        begin = time.perf_counter()
+        summary = self.result.consume()
+        self.query.ms += (time.perf_counter() - begin) * 1000
+        self._summarize(summary)
+        return summary
+
+    def __getattr__(self, name):
+        return getattr(self.result, name)
+
+
+def _db_hits(profile: Dict) -> int:
+    return profile.get("dbHits", 0) + sum(_db_hits(child) for child in profile.get("children", []))
+
+
+class InstrumentedSession:
+    def __init__(self, session, instrumentation: "Instrumentation", trace: Optional[CallTrace]) -> None:
+        self.session = session
+        self.instrumentation = instrumentation
+        # Bound to the trace of the thread that asked for the session, see session_factory
+        self.trace = trace
+
+    def run(self, query, parameters=None, **kwargs):
+        if self.trace is None:
+            return self.session.run(query, parameters, **kwargs)
+        if self.instrumentation.profile and not query.lstrip().upper().startswith(("PROFILE", "EXPLAIN", "CREATE CONSTRAINT", "CREATE INDEX")):
+            query = "PROFILE " + query
+        trace_query = self.trace.add(QueryTrace("cypher", query))
+        begin = time.perf_counter()
+        result = self.session.run(query, parameters, **kwargs)
+        trace_query.ms += (time.perf_counter() - begin) * 1000
+        return InstrumentedResult(result, trace_query)
+
+    def __enter__(self):
+        self.session.__enter__()
+        return self
+
+    def __exit__(self, *args):
+        return self.session.__exit__(*args)
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+
+class InstrumentedDriver:
+    def __init__(self, driver, instrumentation: "Instrumentation") -> None:
+        self.target = driver
+        self.instrumentation = instrumentation
+
+    def session(self, *args, **kwargs):
+        return InstrumentedSession(self.target.session(*args, **kwargs), self.instrumentation, self.instrumentation.current())
+
+    def session_factory(self, *args, **kwargs) -> Callable:
+        """
+        Open sessions later, e.g. on a worker thread, still attributed to the current trace
+        """
+        trace = self.instrumentation.current()
+        return lambda: InstrumentedSession(self.target.session(*args, **kwargs), self.instrumentation, trace)
+
+    def __getattr__(self, name):
+        return getattr(self.target, name)
+
+
+class Instrumentation:
+    """
+    Opt-in tracing of Traits (see Traits.enable_instrumentation). Every public method call produces
+    a CallTrace (calls made by another traced method are part of the caller's trace), handed to the
+    exporters and folded into per-method histograms and per-statement totals.
+
+    Exporters are callables taking the finished CallTrace, see log_exporter. With profile, Cypher
+    queries are run with PROFILE to get their db hits (slower, for troubleshooting only).
+    """
+
+    def __init__(self, exporters: Optional[List[Callable[[CallTrace], None]]] = None, profile: bool = False,
+                 keep: int = 1000) -> None:
+        self.exporters = list(exporters or [])
+        self.profile = profile
+        self.traces = deque(maxlen=keep)
+        self._histograms: Dict[str, Dict[str, Histogram]] = {}
+        self._statements: Dict[str, Dict[str, float]] = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def current(self) -> Optional[CallTrace]:
+        return getattr(self._local, "trace", None)
+
+    def instrument(self, traits) -> None:
+        """
+        Wrap the connections, the driver and the public methods of a Traits and of its TraitsUtility
+        """
+        rdbms_connection = InstrumentedConnection(traits.rdbms_connection, self)
+        rdbms_admin_connection = InstrumentedConnection(traits.rdbms_admin_connection, self)
+        neo4j_driver = InstrumentedDriver(traits.neo4j_driver, self)
+        for target in (traits, traits.utility):
+            target.rdbms_connection = rdbms_connection
+            target.rdbms_admin_connection = rdbms_admin_connection
+            target.neo4j_driver = neo4j_driver
+            names = {name for cls in type(target).__mro__ for name, value in vars(cls).items()
+                     if not name.startswith("_") and callable(value) and not isinstance(value, (staticmethod, classmethod))}
+            for name in names:
+                setattr(target, name, self.traced(f"{type(target).__name__}.{name}", getattr(target, name)))
+
+    def traced(self, name: str, method: Callable) -> Callable:
+        @wraps(method)
+        def wrapper(*args, **kwargs):
+            if self.current() is not None:
+                return method(*args, **kwargs)
+            trace = self._local.trace = CallTrace(name)
+            begin = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            except Exception as e:
+                trace.error = type(e).__name__
+                raise
+            finally:
+                trace.wall_ms = (time.perf_counter() - begin) * 1000
+                self._local.trace = None
+                self._finish(trace)
+        return wrapper
+
+    def _finish(self, trace: CallTrace) -> None:
+        with self._lock:
+            self.traces.append(trace)
+            histograms = self._histograms.setdefault(trace.method, {})
+            for metric, value in trace.metrics().items():
+                histograms.setdefault(metric, Histogram()).observe(value)
+            for query in trace.queries:
+                statement = self._statements.setdefault(query.text, {"store": query.store, "count": 0, "ms": 0.0, "rows": 0})
+                statement["count"] += 1
+                statement["ms"] += query.ms
+                statement["rows"] += query.rows
+        for exporter in self.exporters:
+            exporter(trace)
+
+    def histograms(self) -> Dict[str, Dict[str, Dict]]:
+        with self._lock:
+            return {method: {metric: histogram.to_dict() for metric, histogram in metrics.items()}
+                    for method, metrics in self._histograms.items()}
+
+    def hot_queries(self, limit: int = 10) -> List[Dict]:
+        """
+        Statements with the highest total time
+        """
+        with self._lock:
+            statements = [dict(statement, text=text) for text, statement in self._statements.items()]
+        return sorted(statements, key=lambda statement: statement["ms"], reverse=True)[:limit]
+
+
+def log_exporter(logger=None, min_wall_ms: float = 0) -> Callable[[CallTrace], None]:
+    """
+    Exporter writing each trace slower than min_wall_ms as one JSON line on a logging.Logger
+    """
+    if logger is None:
+        import logging
+        logger = logging.getLogger("traits.instrumentation")
+
+    def export(trace: CallTrace) -> None:
+        if trace.wall_ms >= min_wall_ms:
+            logger.info(json.dumps(trace.to_dict(), default=str))
+    return export
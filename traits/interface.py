@@ -96,10 +96,12 @@ class TraitsInterface(ABC):
                            travel_time_day: int = None, travel_time_month : int = None, travel_time_year : int = None,
                            is_departure_time=True,
                            sort_by : SortingCriteria = SortingCriteria.OVERALL_TRAVEL_TIME, is_ascending : bool =True,
-                           limit : int = 5) -> List:
+                           limit : int = 5, horizon_days: Optional[int] = None) -> List:
         """
         Search Train Connections (between two stations).
         Sorting criteria can be one of the following:overall travel time, number of train changes, waiting time, and estimated price
+        With horizon_days, only the connections departing (arriving) in the horizon_days days from the travel day on
+        (up to the travel day) are searched, otherwise every day with trips is.
 
         Return the connections from a starting and ending stations, possibly including changes at interchanging stations.
         Returns an empty list if no connections are possible
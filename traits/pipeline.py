@@ -0,0 +1,91 @@
+import threading
+from contextlib import contextmanager
+from queue import Queue
+from traits.instrumentation import InstrumentedDriver
+
+
+class GraphWriter:
+    """
+    Worker thread applying Neo4j writes while the caller keeps writing MariaDB, so a
+    dual-store ingest takes about as long as the slower store instead of the sum of both.
+    Every query gets the $write_id of its GraphOutbox entry, used to undo the writes.
+    The queue is bounded, a producer faster than Neo4j waits instead of buffering everything.
+    """
+
+    def __init__(self, neo4j_driver, write_id: int, max_pending: int = 2) -> None:
+        self.neo4j_driver = neo4j_driver
+        self.write_id = write_id
+        self.error = None
+        self._queue = Queue(max_pending)
+        # Neo4j sessions are not thread-safe, the worker opens its own. Instrumentation still
+        # attributes its writes to the caller's trace.
+        if isinstance(neo4j_driver, InstrumentedDriver):
+            self._open_session = neo4j_driver.session_factory()
+        else:
+            self._open_session = neo4j_driver.session
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, query: str, **params) -> None:
+        if self.error is not None:
+            raise self.error
+        self._queue.put((query, params))
+
+    def join(self, raise_error: bool = True) -> None:
+        """
+        Wait for the submitted writes, raise the first Neo4j error
+        """
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        if raise_error and self.error is not None:
+            raise self.error
+
+    def _run(self) -> None:
+        try:
+            with self._open_session() as session:
+                while True:
+                    job = self._queue.get()
+                    if job is None:
+                        return
+                    if self.error is None:
+                        query, params = job
+                        session.run(query, write_id=self.write_id, **params).consume()
+        except Exception as e:
+            self.error = e
+            # Drain the queue so that the producer is never blocked
+            while self._queue.get() is not None:
+                pass
+
+
+@contextmanager
+def graph_write(utility, connection, kind: str, name: str):
+    """
+    Pipelined MariaDB + Neo4j write kept consistent with a GraphOutbox entry (outbox log).
+
+    The entry is committed first, apart from the write, so every MariaDB statement of the write
+    must run inside the block, on `connection`, while the GraphWriter applies the Neo4j ones. MariaDB is committed only once Neo4j succeeded, in the
+    same transaction that flags the entry as committed. On failure MariaDB is rolled back and the
+    Neo4j writes are deleted; an entry left behind by a crash is settled by replay_graph_outbox.
+    """
+    write_id = utility.begin_graph_write(kind, name)
+    writer = GraphWriter(utility.neo4j_driver, write_id)
+    try:
+        yield writer
+        writer.join()
+        utility.mark_graph_write(write_id)
+        connection.commit()
+    except BaseException:
+        connection.rollback()
+        writer.join(raise_error=False)
+        try:
+            utility.undo_graph_write(write_id)
+        except Exception:
+            # Kept in GraphOutbox, replay_graph_outbox rolls it back later
+            pass
+        raise
+    try:
+        utility.end_graph_write(write_id)
+    except Exception:
+        # Both stores are written, replay_graph_outbox only drops the entry
+        pass
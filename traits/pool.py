@@ -0,0 +1,258 @@
+import asyncio
+import inspect
+import threading
+from contextlib import ExitStack, asynccontextmanager, contextmanager
+from functools import wraps
+from queue import LifoQueue, Empty
+from typing import Callable, Optional
+from mysql.connector.errors import PoolError
+from traits.instrumentation import InstrumentedConnection
+
+
+class ConnectionPool:
+    """
+    Bounded pool of MariaDB connections for one role (base or admin user).
+    Connections are created on demand up to `size`, checked on checkout and
+    reset on checkin (transaction, isolation level, autocommit, session variables)
+    so the next operation starts from a clean session.
+    """
+
+    def __init__(self, connect: Callable, size: int = 5, timeout: Optional[float] = None) -> None:
+        if size < 1:
+            raise ValueError
+        self.connect = connect
+        self.size = size
+        self.timeout = timeout
+        self._idle = LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, block: bool = True):
+        """
+        Check out a connection, waiting up to `timeout` seconds for one to be given back.
+        Without `block`, return None instead of waiting.
+        """
+        try:
+            connection = self._idle.get_nowait()
+        except Empty:
+            with self._lock:
+                create = self._created < self.size
+                if create:
+                    self._created += 1
+            if create:
+                try:
+                    return self.connect()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            if not block:
+                return None
+            try:
+                connection = self._idle.get(timeout=self.timeout)
+            except Empty:
+                raise PoolError(f"Pool exhausted: no connection given back within {self.timeout} s "
+                                f"({self.size} connections)") from None
+
+        # Health check, replaces connections dropped by the server
+        try:
+            if not connection.is_connected():
+                connection.reconnect()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            return self.acquire(block)
+        return connection
+
+    def release(self, connection) -> None:
+        try:
+            # Rolls back and restores the session settings of the server (e.g. SET SESSION TRANSACTION
+            # ISOLATION LEVEL in delete_user), without reconnecting
+            connection.reset_session()
+        except Exception:
+            # Broken connection, the slot is freed and a new one is created on demand
+            self.discard(connection)
+            return
+        self._idle.put(connection)
+
+    def discard(self, connection) -> None:
+        """
+        Close a checked out connection instead of giving it back, e.g. one with an unread result
+        """
+        with self._lock:
+            self._created -= 1
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    @contextmanager
+    def connection(self):
+        connection = self.acquire()
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    def close(self) -> None:
+        while True:
+            try:
+                connection = self._idle.get_nowait()
+            except Empty:
+                break
+            connection.close()
+            with self._lock:
+                self._created -= 1
+
+
+class PooledConnection:
+    """
+    Stand-in for a connection that checks one out of the pool for the current thread.
+    A connection is taken on first use inside an operation (see `pooled`) and given
+    back when the outermost operation returns.
+    With `reserve`, a thread that already holds a connection of `holder` never waits for this
+    pool: when no connection is free it takes one from `reserve`, a pool of its own as large as
+    the one of `holder`. So each connection is only taken when it is used and two threads
+    cannot wait for each other's (e.g. admin then base against base then admin).
+    """
+
+    def __init__(self, pool: ConnectionPool, reserve: Optional[ConnectionPool] = None,
+                 holder: Optional["PooledConnection"] = None) -> None:
+        if (reserve is None) != (holder is None):
+            raise ValueError
+        self.pool = pool
+        self.reserve = reserve
+        self.holder = holder
+        self._local = threading.local()
+
+    @contextmanager
+    def operation(self):
+        self._local.depth = getattr(self._local, "depth", 0) + 1
+        try:
+            yield
+        finally:
+            self._local.depth -= 1
+            connection = getattr(self._local, "connection", None)
+            if self._local.depth == 0 and connection is not None:
+                self._local.connection = None
+                self._local.source.release(connection)
+
+    def __getattr__(self, name):
+        if getattr(self._local, "depth", 0) == 0:
+            raise RuntimeError("Pooled connections can only be used inside a Traits operation")
+        return getattr(self._connection(), name)
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            source = self.pool
+            if self.holder is not None and getattr(self.holder._local, "connection", None) is not None:
+                connection = self.pool.acquire(block=False)
+                if connection is None:
+                    source = self.reserve
+            if connection is None:
+                connection = source.acquire()
+            self._local.connection, self._local.source = connection, source
+        return connection
+
+
+def _pooled_connections(target) -> list:
+    connections = [c.target if isinstance(c, InstrumentedConnection) else c
+                   for c in (target.rdbms_connection, target.rdbms_admin_connection)]
+    return [c for c in connections if isinstance(c, PooledConnection)]
+
+
+def pooled(method):
+    """
+    Run a Traits/TraitsUtility method inside a pooled operation (no-op for plain connections).
+    For a generator the operation lasts until it is exhausted or closed, so it must be consumed
+    by the thread that started it.
+    """
+    if inspect.isgeneratorfunction(method):
+        @wraps(method)
+        def generator_wrapper(self, *args, **kwargs):
+            with ExitStack() as stack:
+                for connection in _pooled_connections(self):
+                    stack.enter_context(connection.operation())
+                yield from method(self, *args, **kwargs)
+        return generator_wrapper
+
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        connections = _pooled_connections(self)
+        if not connections:
+            return method(self, *args, **kwargs)
+        with ExitStack() as stack:
+            for connection in connections:
+                stack.enter_context(connection.operation())
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class AsyncConnectionPool:
+    """
+    asyncio counterpart of ConnectionPool for mysql.connector.aio connections.
+    `connect` is a coroutine function; all the methods must run on the same event loop.
+    """
+
+    def __init__(self, connect: Callable, size: int = 5, timeout: Optional[float] = None) -> None:
+        if size < 1:
+            raise ValueError
+        self.connect = connect
+        self.size = size
+        self.timeout = timeout
+        self._idle = asyncio.LifoQueue()
+        self._created = 0
+
+    async def acquire(self):
+        try:
+            connection = self._idle.get_nowait()
+        except asyncio.QueueEmpty:
+            if self._created < self.size:
+                self._created += 1
+                try:
+                    return await self.connect()
+                except Exception:
+                    self._created -= 1
+                    raise
+            try:
+                connection = await asyncio.wait_for(self._idle.get(), self.timeout)
+            except asyncio.TimeoutError:
+                raise PoolError(f"Pool exhausted: no connection given back within {self.timeout} s "
+                                f"({self.size} connections)") from None
+
+        # Health check, replaces connections dropped by the server
+        try:
+            if not await connection.is_connected():
+                await connection.reconnect()
+        except Exception:
+            self._created -= 1
+            return await self.acquire()
+        return connection
+
+    async def release(self, connection) -> None:
+        try:
+            # Same session reset as ConnectionPool.release
+            await connection.reset_session()
+        except Exception:
+            self._created -= 1
+            try:
+                await connection.close()
+            except Exception:
+                pass
+            return
+        self._idle.put_nowait(connection)
+
+    @asynccontextmanager
+    async def connection(self):
+        connection = await self.acquire()
+        try:
+            yield connection
+        finally:
+            await self.release(connection)
+
+    async def close(self) -> None:
+        while not self._idle.empty():
+            connection = self._idle.get_nowait()
+            await connection.close()
+            self._created -= 1
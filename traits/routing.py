@@ -0,0 +1,495 @@
+import heapq
+import math
+from bisect import bisect_right, insort
+from collections import deque
+from datetime import datetime, date, time, timedelta
+from itertools import count
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+from traits.interface import SortingCriteria
+
+# Keys of the route dictionaries, indexed by SortingCriteria.value
+SORT_CRITERIA = ["overallTravelTime", "numberOfTrains", "totalWaitingTime", "Price"]
+
+
+class Leg(NamedTuple):
+    """
+    A single dated trip between two consecutive stations, as used by the search
+    """
+    start: str
+    end: str
+    departure: datetime
+    arrival: datetime
+    travel_time: int
+    relation: Dict
+
+
+def _minutes(delta: timedelta) -> int:
+    return int(delta.total_seconds() // 60)
+
+
+def route_metrics(legs: List[Leg], travel_time: datetime, is_departure_time: bool) -> Dict:
+    """
+    Build the route dictionary returned by the search (same keys as the former Cypher query)
+    """
+    overall_travel_time = sum(leg.travel_time for leg in legs)
+    intermediate_waiting_time = sum(_minutes(legs[i + 1].departure - legs[i].arrival) for i in range(len(legs) - 1))
+    if is_departure_time:
+        initial_waiting_time = _minutes(legs[0].departure - travel_time)
+    else:
+        initial_waiting_time = _minutes(travel_time - legs[-1].arrival)
+    return {
+        "relations": [leg.relation for leg in legs],
+        "overallTravelTime": overall_travel_time,
+        "numberOfTrains": len(legs),
+        "totalWaitingTime": initial_waiting_time + intermediate_waiting_time,
+        "Price": int((overall_travel_time - intermediate_waiting_time) / 2) + len(legs) * 2,
+    }
+
+
+def static_lower_bounds(edges: Iterable[Tuple[str, str, int]], start: str, end: str) -> Tuple[Optional[int], Optional[int]]:
+    """
+    Return the minimal travel time and the minimal number of legs between two stations
+    on the (time independent) connection graph, or (None, None) if end is unreachable.
+    Every dated trip follows a connection, so these are lower bounds for any day.
+    """
+    graph = {}
+    for a, b, travel_time in edges:
+        graph.setdefault(a, []).append((b, travel_time))
+
+    # Dijkstra for the travel time
+    best = {start: 0}
+    heap = [(0, start)]
+    min_travel_time = None
+    while heap:
+        dist, station = heapq.heappop(heap)
+        if station == end:
+            min_travel_time = dist
+            break
+        if dist > best[station]:
+            continue
+        for nxt, travel_time in graph.get(station, []):
+            if dist + travel_time < best.get(nxt, dist + travel_time + 1):
+                best[nxt] = dist + travel_time
+                heapq.heappush(heap, (dist + travel_time, nxt))
+    if min_travel_time is None:
+        return None, None
+
+    # BFS for the number of legs
+    hops = {start: 0}
+    queue = deque([start])
+    while queue:
+        station = queue.popleft()
+        for nxt, _ in graph.get(station, []):
+            if nxt not in hops:
+                hops[nxt] = hops[station] + 1
+                queue.append(nxt)
+    return min_travel_time, hops[end]
+
+
+def reachable_stations(edges: Iterable[Tuple[str, str, int]], sources: Iterable[str], backward: bool = False) -> set:
+    """
+    Stations reachable from `sources` on the connection graph (or that can reach them with backward)
+    """
+    graph = {}
+    for a, b, _ in edges:
+        if backward:
+            a, b = b, a
+        graph.setdefault(a, []).append(b)
+    reached = set(sources)
+    queue = deque(reached)
+    while queue:
+        station = queue.popleft()
+        for nxt in graph.get(station, []):
+            if nxt not in reached:
+                reached.add(nxt)
+                queue.append(nxt)
+    return reached
+
+
+class _Label(NamedTuple):
+    """
+    A partial route ending with `leg`, `parent` is the label of the previous leg
+    """
+    arrival: datetime
+    key: Tuple
+    leg: Leg
+    parent: Optional["_Label"]
+    stations: frozenset
+    legs: int
+    riding_time: int
+    riding_minutes: int
+    first_departure: datetime
+
+
+def corridor_stations(edges: Iterable[Tuple[str, str, int]], start: str, end: str) -> set:
+    """
+    Stations on some path from start to end of the connection graph, the only ones a route can visit
+    """
+    edges = list(edges)
+    return reachable_stations(edges, [start]) & reachable_stations(edges, [end], backward=True)
+
+
+class ConnectionSearch:
+    """
+    Time-dependent connection search between two stations.
+
+    Days are scanned in travel order (forward from the travel time for departures, backward
+    for arrivals). Inside a day the legs are scanned once in departure order, as in the
+    connection scan algorithm: every station keeps labels (arrival, criterion so far, visited
+    stations) of the partial routes reaching it. A label dominates another one when it arrives
+    no later, is no worse on the criterion and visited a subset of its stations: it can take
+    every continuation of the other one (no station is visited twice) and makes an at least as
+    good route with it. A label dominated by `limit` others cannot be part of the top `limit`
+    routes and is dropped.
+    Labels that cannot beat the top `limit` routes found so far are dropped as well, from a lower
+    bound of their completions computed backward over the legs of the day. The routes of a first,
+    fast scan ignoring the visited stations in the dominance test make the initial bound.
+    For ascending criteria that cannot decrease along a route the search stops as soon as a later
+    day cannot beat the top `limit` routes. The other criteria (Price and the descending sorts) have
+    no such bound and scan every day; they look for the longest routes of some kind, which can take
+    exponential time on dense networks. With `horizon_days`, only the days up to that many days
+    after (before for arrivals) the travel time are scanned, whatever the criterion.
+    """
+
+    def __init__(self, start: str, end: str, travel_time: datetime, is_departure_time: bool = True,
+                 sort_by: SortingCriteria = SortingCriteria.OVERALL_TRAVEL_TIME, is_ascending: bool = True,
+                 limit: int = 5, horizon_days: Optional[int] = None) -> None:
+        self.start = start
+        self.end = end
+        self.travel_time = travel_time
+        self.is_departure_time = is_departure_time
+        self.sort_by = sort_by
+        self.is_ascending = is_ascending
+        self.limit = limit
+        self.horizon_days = horizon_days
+        # Price can decrease when a leg is added (waiting is subtracted), so it has no bound
+        self.best_first = is_ascending and sort_by != SortingCriteria.ESTIMATED_PRICE
+
+    def run(self, days: Iterable[date], load_legs: Callable[[date], List[Leg]],
+            min_travel_time: int = 0, min_legs: int = 1) -> List[Dict]:
+        """
+        Return the best `limit` routes. `days` must be ordered in travel order and
+        `load_legs(day)` returns the legs departing on that day.
+        """
+        if self.limit is not None and self.limit <= 0:
+            return []
+        results = []
+        for day_index, day in enumerate(days):
+            if self.settled(results, day, min_travel_time, min_legs):
+                break
+            self.add_day(results, day_index, load_legs(day))
+        return self.finish(results)
+
+    def add_day(self, results: List, day_index: int, legs: List[Leg]) -> None:
+        """
+        Merge the routes of one day into `results`, keeping the best `limit`
+        """
+        bound = None
+        if self.limit is not None and len(results) >= self.limit:
+            # Routes of this day tying with the results of the previous days come after them
+            bound = results[self.limit - 1][0]
+        for seq, (cost, route) in enumerate(self._day_routes(legs, bound)):
+            sort_key = cost if self.is_ascending else -cost
+            results.append((sort_key, day_index, seq, route))
+        results.sort(key=lambda r: r[:3])
+        if self.limit is not None:
+            del results[self.limit:]
+
+    def finish(self, results: List) -> List[Dict]:
+        return [route_metrics(r[3], self.travel_time, self.is_departure_time) for r in results]
+
+    def settled(self, results: List, day: date, min_travel_time: int, min_legs: int) -> bool:
+        """
+        True when no route of `day` (or of the following days) can enter the top `limit`
+        """
+        if self.horizon_days is not None and abs((day - self.travel_time.date()).days) >= self.horizon_days:
+            return True
+        if not self.best_first:
+            return False
+        if self.limit is None or len(results) < self.limit:
+            return False
+        if self.sort_by == SortingCriteria.OVERALL_TRAVEL_TIME:
+            bound = min_travel_time
+        elif self.sort_by == SortingCriteria.NUMBER_OF_TRAIN_CHANGES:
+            bound = min_legs
+        elif self.is_departure_time:
+            bound = max(0, _minutes(datetime.combine(day, time.min) - self.travel_time))
+        else:
+            bound = max(0, _minutes(self.travel_time - datetime.combine(day + timedelta(days=1), time.min)))
+        return results[self.limit - 1][0] <= bound
+
+    def _key(self, legs: int, riding_time: int, riding_minutes: int, first_departure: datetime) -> Tuple:
+        """
+        Part of the criterion fixed by a partial route, smaller is better whatever the continuation
+        """
+        if self.sort_by == SortingCriteria.OVERALL_TRAVEL_TIME:
+            key = (riding_time,)
+        elif self.sort_by == SortingCriteria.NUMBER_OF_TRAIN_CHANGES:
+            key = (legs,)
+        elif self.sort_by == SortingCriteria.OVERALL_WAITING_TIME:
+            # Waiting = last arrival - travel time - riding (departures),
+            # travel time - first departure - riding (arrivals)
+            if self.is_departure_time:
+                key = (-riding_minutes,)
+            else:
+                key = (-_minutes(first_departure - self.travel_time) - riding_minutes,)
+        else:
+            # Price grows with riding time + riding minutes + first departure - last arrival and the legs
+            key = (riding_time + riding_minutes + _minutes(first_departure - self.travel_time), legs)
+        return key if self.is_ascending else tuple(-k for k in key)
+
+    def _extend(self, parent: Optional[_Label], leg: Leg) -> _Label:
+        riding_minutes = _minutes(leg.arrival - leg.departure)
+        if parent is None:
+            stations = frozenset((self.start, leg.end))
+            legs, riding_time, first_departure = 1, leg.travel_time, leg.departure
+        else:
+            stations = parent.stations | {leg.end}
+            legs, riding_time, first_departure = parent.legs + 1, parent.riding_time + leg.travel_time, parent.first_departure
+            riding_minutes += parent.riding_minutes
+        return _Label(leg.arrival, self._key(legs, riding_time, riding_minutes, first_departure), leg, parent,
+                      stations, legs, riding_time, riding_minutes, first_departure)
+
+    def _label_cost(self, label: _Label) -> int:
+        """
+        Cost of the complete route ending with `label`, as computed by route_metrics
+        """
+        if self.sort_by == SortingCriteria.OVERALL_TRAVEL_TIME:
+            return label.riding_time
+        if self.sort_by == SortingCriteria.NUMBER_OF_TRAIN_CHANGES:
+            return label.legs
+        intermediate_waiting_time = _minutes(label.arrival - label.first_departure) - label.riding_minutes
+        if self.sort_by == SortingCriteria.OVERALL_WAITING_TIME:
+            if self.is_departure_time:
+                return _minutes(label.first_departure - self.travel_time) + intermediate_waiting_time
+            return _minutes(self.travel_time - label.arrival) + intermediate_waiting_time
+        return int((label.riding_time - intermediate_waiting_time) / 2) + label.legs * 2
+
+    def _accrued(self, label: _Label) -> int:
+        """
+        Part of the criterion fixed by the legs of `label`, the next legs add to it (see _step)
+        """
+        intermediate_waiting_time = _minutes(label.arrival - label.first_departure) - label.riding_minutes
+        if self.sort_by == SortingCriteria.OVERALL_TRAVEL_TIME:
+            return label.riding_time
+        if self.sort_by == SortingCriteria.NUMBER_OF_TRAIN_CHANGES:
+            return label.legs
+        if self.sort_by == SortingCriteria.OVERALL_WAITING_TIME:
+            # The initial waiting of an arrival depends on the last leg, it is added by _to_end
+            if self.is_departure_time:
+                return _minutes(label.first_departure - self.travel_time) + intermediate_waiting_time
+            return intermediate_waiting_time
+        # Twice the price, up to the rounding
+        return label.riding_time - intermediate_waiting_time + label.legs * 4
+
+    def _step(self, leg: Leg) -> Tuple[int, int]:
+        """
+        (a, c) such that taking `leg` after a leg arriving at `arrival` adds a + c * (arrival - travel time)
+        minutes to the accrued criterion
+        """
+        if self.sort_by == SortingCriteria.OVERALL_TRAVEL_TIME:
+            return leg.travel_time, 0
+        if self.sort_by == SortingCriteria.NUMBER_OF_TRAIN_CHANGES:
+            return 1, 0
+        waiting = _minutes(leg.departure - self.travel_time)
+        if self.sort_by == SortingCriteria.OVERALL_WAITING_TIME:
+            return waiting, -1
+        return leg.travel_time + 4 - waiting, 1
+
+    def _lower_bound(self, label: _Label, to_end: Dict[int, float]) -> float:
+        """
+        Lower bound of the sort key of the complete routes continuing `label`
+        """
+        bound = (self._accrued(label) if self.is_ascending else -self._accrued(label)) + to_end[id(label.leg)]
+        if self.sort_by == SortingCriteria.ESTIMATED_PRICE and not math.isinf(bound):
+            # The price is rounded toward zero, by half a unit at most
+            return bound // 2
+        return bound
+
+    @staticmethod
+    def _covers(other: _Label, label: _Label, relaxed: bool) -> bool:
+        """
+        True when `other` is no worse than `label` on the criterion and visited a subset of its stations
+        (any stations when relaxed)
+        """
+        return all(a <= b for a, b in zip(other.key, label.key)) and (relaxed or other.stations <= label.stations)
+
+    def _dominated(self, label: _Label, labels: List[_Label], relaxed: bool) -> bool:
+        """
+        True when `limit` labels arrive no later than `label` and cover it
+        """
+        if self.limit is None:
+            return False
+        dominating = 0
+        for other in labels:
+            if other.arrival <= label.arrival and self._covers(other, label, relaxed):
+                dominating += 1
+                if dominating >= self.limit:
+                    return True
+        return False
+
+    def _parents(self, labels: List[_Label], leg: Leg, relaxed: bool) -> List[_Label]:
+        """
+        Labels worth extending with `leg`: `labels` have arrived before its departure and are sorted
+        by key, the ones covered by `limit` labels taking the leg as well are skipped
+        """
+        parents = []
+        for label in labels:
+            if leg.end in label.stations:
+                continue
+            if self.limit is not None and len(parents) >= self.limit:
+                if sum(self._covers(other, label, relaxed) for other in parents) >= self.limit:
+                    continue
+            parents.append(label)
+        return parents
+
+    def _prune(self, labels: List[_Label], relaxed: bool) -> List[_Label]:
+        """
+        Drop the labels (sorted by key) covered by `limit` others
+        """
+        if self.limit is None:
+            return labels
+        kept = []
+        for label in labels:
+            # In key order, the labels covering `label` come before it
+            if sum(self._covers(other, label, relaxed) for other in kept) < self.limit:
+                kept.append(label)
+        return kept
+
+    def _day_routes(self, legs: List[Leg], bound: Optional[int] = None) -> List[Tuple[int, List[Leg]]]:
+        """
+        (cost, legs) of the best `limit` routes of a single day, by ascending sort key.
+        Routes whose sort key is `bound` or more are not needed.
+        """
+        by_station = {}
+        for leg in legs:
+            if self.is_departure_time and leg.departure < self.travel_time:
+                continue
+            if not self.is_departure_time and leg.arrival > self.travel_time:
+                continue
+            by_station.setdefault(leg.start, []).append(leg)
+        useful = self._reaching_end(by_station)
+        if self.start not in useful:
+            return []
+        scan = sorted((leg for station, station_legs in by_station.items() if station in useful
+                       for leg in station_legs if leg.end in useful), key=lambda l: (l.departure, l.arrival))
+        to_end = self._to_end(scan) if self.limit is not None else None
+        routes = []
+        if to_end is not None:
+            # Ignoring the visited stations in the dominance test is fast but can miss routes: the
+            # routes found that way only bound the exact scan
+            routes = self._scan(scan, to_end, bound, relaxed=True)
+            keys = sorted(cost if self.is_ascending else -cost for cost, _ in routes)
+            if len(keys) >= self.limit and (bound is None or keys[self.limit - 1] < bound):
+                bound = keys[self.limit - 1]
+        routes += self._scan(scan, to_end, bound, relaxed=False)
+
+        complete = {}
+        for cost, label in routes:
+            route = []
+            while label is not None:
+                route.append(label.leg)
+                label = label.parent
+            route.reverse()
+            # Both scans can find a route
+            complete[tuple(map(id, route))] = ((cost if self.is_ascending else -cost, [leg.departure for leg in route]), cost, route)
+        complete = sorted(complete.values(), key=lambda r: r[0])
+        if self.limit is not None:
+            del complete[self.limit:]
+        return [(cost, route) for _, cost, route in complete]
+
+    def _scan(self, scan: List[Leg], to_end: Optional[Tuple], bound: Optional[int], relaxed: bool) -> List[Tuple[int, _Label]]:
+        """
+        (cost, last label) of the routes of the legs of a day in departure order, the labels whose
+        lower bound reaches `bound` or the sort key of the best `limit` routes found are dropped
+        """
+        # Labels of a station wait in `pending` (by arrival) until a leg departs after their arrival,
+        # the arrival of `ready` labels no longer matters so they only compete on the criterion
+        pending: Dict[str, List] = {}
+        ready: Dict[str, List[_Label]] = {}
+        tie = count()
+        routes = []
+        # Sort keys of the best `limit` routes found so far (negated), the worst one is the bound
+        best = []
+        for leg in scan:
+            if leg.start == self.start:
+                parents = [None]
+            else:
+                waiting = pending.get(leg.start)
+                arrived = ready.setdefault(leg.start, [])
+                if waiting and waiting[0][0] <= leg.departure:
+                    while waiting and waiting[0][0] <= leg.departure:
+                        insort(arrived, heapq.heappop(waiting)[2], key=lambda label: label.key)
+                    arrived[:] = self._prune(arrived, relaxed)
+                parents = self._parents(arrived, leg, relaxed)
+            for parent in parents:
+                label = self._extend(parent, leg)
+                if to_end is not None and bound is not None and self._lower_bound(label, to_end) >= bound:
+                    continue
+                if leg.end == self.end:
+                    cost = self._label_cost(label)
+                    routes.append((cost, label))
+                    if to_end is not None:
+                        heapq.heappush(best, -cost if self.is_ascending else cost)
+                        if len(best) > self.limit:
+                            heapq.heappop(best)
+                        if len(best) == self.limit and (bound is None or -best[0] < bound):
+                            bound = -best[0]
+                    continue
+                if not self._dominated(label, ready.get(leg.end, [])
+                                       + [entry[2] for entry in pending.get(leg.end, ())], relaxed):
+                    heapq.heappush(pending.setdefault(leg.end, []), (label.arrival, next(tie), label))
+        return routes
+
+    def _to_end(self, legs: List[Leg]) -> Dict[int, float]:
+        """
+        Lower bound of what the legs following each of `legs` (by id) up to the end station add to the
+        accrued criterion, negated for descending sorts. Visited stations are ignored, the bound is
+        infinite when the end cannot be reached after the leg.
+        """
+        sign = 1 if self.is_ascending else -1
+        to_end = {}
+        # Legs of every station already seen, by descending departure (stored negated, in seconds
+        # after the travel time), with the running minimum of what they add from their departure on
+        departures: Dict[str, List[float]] = {}
+        minimums: Dict[str, List[float]] = {}
+        for leg in sorted(legs, key=lambda l: (l.departure, l.arrival), reverse=True):
+            arrival = _minutes(leg.arrival - self.travel_time)
+            if leg.end == self.end:
+                added = 0
+                if self.sort_by == SortingCriteria.OVERALL_WAITING_TIME and not self.is_departure_time:
+                    added = -sign * arrival
+            elif leg.arrival == leg.departure:
+                # Its next legs can depart at the same time and are not all known yet
+                added = -math.inf
+            else:
+                # Number of next legs departing after the arrival
+                index = bisect_right(departures.get(leg.end, []), -(leg.arrival - self.travel_time).total_seconds())
+                added = minimums[leg.end][index - 1] if index else math.inf
+                if not math.isinf(added):
+                    added += sign * self._step(leg)[1] * arrival
+            to_end[id(leg)] = added
+            a, _ = self._step(leg)
+            added += sign * a
+            departures.setdefault(leg.start, []).append(-(leg.departure - self.travel_time).total_seconds())
+            minimum = minimums.setdefault(leg.start, [])
+            minimum.append(min(added, minimum[-1]) if minimum else added)
+        return to_end
+
+    def _reaching_end(self, by_station: Dict[str, List[Leg]]) -> set:
+        """
+        Stations from which the end station can be reached with the legs of the day
+        """
+        reverse = {}
+        for station_legs in by_station.values():
+            for leg in station_legs:
+                reverse.setdefault(leg.end, set()).add(leg.start)
+        reached = {self.end}
+        queue = deque([self.end])
+        while queue:
+            station = queue.popleft()
+            for prev in reverse.get(station, ()):
+                if prev not in reached:
+                    reached.add(prev)
+                    queue.append(prev)
+        return reached
@@ -0,0 +1,187 @@
+import random
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# A train needs 6 hours between the end of a schedule and the start of one on the next day,
+# i.e. an end more than 18 hours after the next day's start is a conflict
+TURNAROUND = timedelta(hours=18)
+
+
+def _as_timedelta(value) -> timedelta:
+    """
+    TIME columns come back as timedelta, add_schedule uses "H:M:S" strings
+    """
+    if isinstance(value, timedelta):
+        return value
+    hours, minutes, seconds = (int(part) for part in str(value).split(':'))
+    return timedelta(hours=hours, minutes=minutes, seconds=seconds)
+
+
+def _as_date(value) -> date:
+    return value if isinstance(value, date) else date.fromisoformat(str(value))
+
+
+def _window(valid_from, valid_until) -> Tuple[str, Tuple]:
+    """
+    Condition on the schedules valid between the two dates, widened by a day for the turnaround checks
+    """
+    if valid_from is None or valid_until is None:
+        return "", ()
+    return " AND valid_until >= %s AND valid_from <= %s", (_as_date(valid_from) - timedelta(days=1),
+                                                          _as_date(valid_until) + timedelta(days=1))
+
+
+class _Node:
+    """
+    Treap node keyed by valid_from. The subtree aggregates (latest valid_until, latest end time,
+    earliest start time) prune the searches, as in an augmented interval tree.
+    """
+    __slots__ = ("valid_from", "valid_until", "start", "end", "priority", "left", "right",
+                 "max_until", "max_end", "min_start")
+
+    def __init__(self, valid_from: date, valid_until: date, start: timedelta, end: timedelta, priority: float,
+                 left: Optional["_Node"] = None, right: Optional["_Node"] = None) -> None:
+        self.valid_from = valid_from
+        self.valid_until = valid_until
+        self.start = start
+        self.end = end
+        self.priority = priority
+        self.left = left
+        self.right = right
+        self.max_until = valid_until
+        self.max_end = end
+        self.min_start = start
+        for child in (left, right):
+            if child is not None:
+                self.max_until = max(self.max_until, child.max_until)
+                self.max_end = max(self.max_end, child.max_end)
+                self.min_start = min(self.min_start, child.min_start)
+
+    def copy(self, left: Optional["_Node"], right: Optional["_Node"]) -> "_Node":
+        return _Node(self.valid_from, self.valid_until, self.start, self.end, self.priority, left, right)
+
+
+def _insert(node: Optional[_Node], new: _Node) -> _Node:
+    """
+    Persistent insert: only the nodes on the path are copied, the previous root stays valid
+    """
+    if node is None:
+        return new
+    if new.valid_from < node.valid_from:
+        left = _insert(node.left, new)
+        if left.priority > node.priority:
+            return left.copy(left.left, node.copy(left.right, node.right))
+        return node.copy(left, node.right)
+    right = _insert(node.right, new)
+    if right.priority > node.priority:
+        return right.copy(node.copy(node.left, right.left), right.right)
+    return node.copy(node.left, right)
+
+
+def _any(node: Optional[_Node], first_day: date, last_day: date, prune, match) -> bool:
+    """
+    True if a schedule valid on some day of [first_day, last_day] satisfies match.
+    Subtrees without such a day, or ruled out by prune on their aggregates, are skipped.
+    """
+    while node is not None:
+        if node.max_until < first_day or prune(node):
+            return False
+        if node.valid_from <= last_day and node.valid_until >= first_day and match(node):
+            return True
+        if node.valid_from <= last_day and _any(node.right, first_day, last_day, prune, match):
+            return True
+        node = node.left
+    return False
+
+
+class ScheduleIndex:
+    """
+    Schedules of one train as intervals over (validity dates x time of day), answering the
+    feasibility checks of add_schedule without scanning all the schedules of the train.
+    Snapshots are cheap (persistent treap), so a batch can be validated without touching the index.
+    """
+
+    def __init__(self, schedules: Iterable[Tuple] = (), seed: Optional[int] = None) -> None:
+        self._random = random.Random(seed)
+        self._root = None
+        self.size = 0
+        for start_time, end_time, valid_from, valid_until in schedules:
+            self.add(start_time, end_time, valid_from, valid_until)
+
+    @classmethod
+    def load(cls, connection, train_id: int, valid_from=None, valid_until=None) -> "ScheduleIndex":
+        """
+        Build the index of a train with a single query. With a validity window, only the schedules
+        that can conflict with a schedule valid in it are loaded, the expired ones are left out
+        """
+        window, params = _window(valid_from, valid_until)
+        cursor = connection.cursor()
+        cursor.execute(f"SELECT start_time, end_time, valid_from, valid_until FROM Schedules WHERE train_id = %s{window};",
+                       (train_id,) + params)
+        index = cls(cursor.fetchall())
+        cursor.close()
+        return index
+
+    @classmethod
+    def load_trains(cls, connection, train_ids: List[int], valid_from=None, valid_until=None) -> Dict[int, "ScheduleIndex"]:
+        """
+        Build the indexes of several trains with a single query, see load for the validity window
+        """
+        indexes = {train_id: cls() for train_id in train_ids}
+        if not indexes:
+            return indexes
+        window, params = _window(valid_from, valid_until)
+        cursor = connection.cursor()
+        cursor.execute(f"SELECT train_id, start_time, end_time, valid_from, valid_until FROM Schedules "
+                       f"WHERE train_id IN ({', '.join(['%s'] * len(indexes))}){window};", tuple(indexes) + params)
+        for train_id, *schedule in cursor.fetchall():
+            indexes[train_id].add(*schedule)
+        cursor.close()
+        return indexes
+
+    def conflict(self, start_time, end_time, valid_from, valid_until) -> Optional[str]:
+        """
+        Return why the schedule cannot be added ("next_day", "overlap", "turnaround_before",
+        "turnaround_after"), None if it is feasible
+        """
+        start, end = _as_timedelta(start_time), _as_timedelta(end_time)
+        valid_from, valid_until = _as_date(valid_from), _as_date(valid_until)
+        one_day = timedelta(days=1)
+        if end < start:
+            # The schedule went onto the next day
+            return "next_day"
+        if _any(self._root, valid_from, valid_until,
+                lambda node: node.max_end < start or node.min_start > end,
+                lambda node: node.start <= end and node.end >= start):
+            return "overlap"
+        # Schedules of the previous days ending less than 6 hours before the start
+        if _any(self._root, valid_from - one_day, valid_until - one_day,
+                lambda node: node.max_end - start <= TURNAROUND,
+                lambda node: node.end - start > TURNAROUND):
+            return "turnaround_before"
+        # Schedules of the next days starting less than 6 hours after the end
+        if _any(self._root, valid_from + one_day, valid_until + one_day,
+                lambda node: end - node.min_start <= TURNAROUND,
+                lambda node: end - node.start > TURNAROUND):
+            return "turnaround_after"
+        return None
+
+    def is_feasible(self, start_time, end_time, valid_from, valid_until) -> bool:
+        return self.conflict(start_time, end_time, valid_from, valid_until) is None
+
+    def validate(self, candidates: List[Tuple]) -> List[Optional[str]]:
+        """
+        Check (start_time, end_time, valid_from, valid_until) candidates in order, each one against the
+        index and the accepted candidates before it. The index itself is left unchanged.
+        """
+        root, size = self._root, self.size
+        results = []
+        try:
+            for candidate in candidates:
+                reason = self.conflict(*candidate)
+                if reason is None:
+                    self.add(*candidate)
+                results.append(reason)
+        finally:
+            self._root, self.size = root, size
+        return results
@@ -0,0 +1,46 @@
+from datetime import date
+from typing import Iterable, List, Optional
+
+# Weekday masks of a ServicePattern, bit 0 is Monday (date.weekday())
+MONDAY, TUESDAY, WEDNESDAY, THURSDAY, FRIDAY, SATURDAY, SUNDAY = (1 << day for day in range(7))
+EVERY_DAY = 0b1111111
+WEEKDAYS = MONDAY | TUESDAY | WEDNESDAY | THURSDAY | FRIDAY
+WEEKENDS = SATURDAY | SUNDAY
+
+
+class ServicePattern:
+    """
+    Days a schedule runs on: the days of `weekdays` that are not holidays of `holiday_calendar`
+    (see Traits.add_holiday_calendar) nor `removed`, plus the `added` dates.
+    """
+
+    def __init__(self, weekdays: int = EVERY_DAY, added: Iterable[date] = (), removed: Iterable[date] = (),
+                 holiday_calendar: Optional[str] = None) -> None:
+        if not 0 <= weekdays <= EVERY_DAY:
+            raise ValueError
+        self.weekdays = weekdays
+        self.added = frozenset(added)
+        self.removed = frozenset(removed)
+        self.holiday_calendar = holiday_calendar
+
+    def runs_on(self, day: date, holidays: frozenset = frozenset()) -> bool:
+        if day in self.added:
+            return True
+        return bool(self.weekdays >> day.weekday() & 1) and day not in self.removed and day not in holidays
+
+    def days(self, valid_from: date, valid_until: date, holidays: frozenset = frozenset()) -> List[date]:
+        """
+        Service days between valid_from and valid_until (included), in order
+        """
+        if valid_until < valid_from:
+            return []
+        first, last = valid_from.toordinal(), valid_until.toordinal()
+        ordinals = set()
+        # One stride of 7 days per weekday of the mask instead of testing every day
+        for weekday in range(7):
+            if self.weekdays >> weekday & 1:
+                ordinals.update(range(first + (weekday - valid_from.weekday()) % 7, last + 1, 7))
+        ordinals.difference_update(day.toordinal() for day in self.removed | holidays)
+        ordinals.update(day.toordinal() for day in self.added if valid_from <= day <= valid_until)
+        return [date.fromordinal(ordinal) for ordinal in sorted(ordinals)]
+
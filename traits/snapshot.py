@@ -0,0 +1,183 @@
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime, date, time, timedelta
+from typing import Dict, List, Optional, Tuple
+from traits.routing import Leg
+
+
+def _to_minutes(value) -> int:
+    """
+    TIME columns come back as timedelta, schedules built in Python use "H:M:S" strings
+    """
+    if isinstance(value, timedelta):
+        return int(value.total_seconds() // 60)
+    if isinstance(value, time):
+        return value.hour * 60 + value.minute
+    hours, minutes = str(value).split(':')[:2]
+    return int(hours) * 60 + int(minutes)
+
+
+class DayTimetable:
+    """
+    Array-backed list of the trips of a single day, sorted by departure.
+    Never changed once built, an update of the day builds a new one.
+    """
+
+    def __init__(self, day: date, rows: List[Tuple[int, int, int, int, int, int]] = ()) -> None:
+        """
+        `rows` are (trip_id, train_id, start, end, departure, arrival) tuples
+        """
+        rows = sorted(rows, key=lambda r: (r[4], r[0]))
+        self.day = day
+        self.trip_ids = array('l', [r[0] for r in rows])
+        self.train_ids = array('l', [r[1] for r in rows])
+        self.starting_stations = array('l', [r[2] for r in rows])
+        self.ending_stations = array('l', [r[3] for r in rows])
+        self.departures = array('H', [r[4] for r in rows])  # minutes after midnight
+        self.arrivals = array('H', [r[5] for r in rows])
+
+    def __len__(self) -> int:
+        return len(self.trip_ids)
+
+    def rows(self) -> List[Tuple[int, int, int, int, int, int]]:
+        return list(zip(self.trip_ids, self.train_ids, self.starting_stations, self.ending_stations,
+                        self.departures, self.arrivals))
+
+
+class TimetableSnapshot:
+    """
+    In-process copy of Trips, Stations and Trains used to answer search_connections
+    without touching MariaDB or Neo4j. Legs carry the Trips row as relation, so the
+    search results do not need to be hydrated.
+    Updates hold a lock and replace the day timetables, sorted_days and min_travel_times
+    instead of changing them, so searches of other threads read them without locking.
+    """
+
+    def __init__(self) -> None:
+        self.station_ids: Dict[str, int] = {}
+        self.station_names: Dict[int, str] = {}
+        self.train_ids: Dict[str, int] = {}
+        self.trains: Dict[int, Tuple[str, int, int]] = {}  # train_id -> (name, capacity, status)
+        self.days: Dict[date, DayTimetable] = {}
+        self.sorted_days: List[date] = []
+        self.train_days: Dict[int, set] = {}
+        self.min_travel_times: Dict[Tuple[str, str], int] = {}
+        self._lock = threading.RLock()
+
+    def load(self, connection) -> None:
+        """
+        Build the snapshot from scratch
+        """
+        with self._lock:
+            cursor = connection.cursor()
+            cursor.execute("SELECT station_id, name FROM Stations")
+            for station_id, name in cursor.fetchall():
+                self.add_station(station_id, name)
+            cursor.execute("SELECT train_id, train_name, capacity, status FROM Trains")
+            for train_id, name, capacity, status in cursor.fetchall():
+                self.set_train(train_id, name, capacity, status)
+            cursor.execute("SELECT trip_id, train_id, starting_station_id, ending_station_id, date, start_time, end_time FROM Trips")
+            self._add_trips(cursor.fetchall())
+            cursor.close()
+
+    def add_station(self, station_id: int, name: str) -> None:
+        with self._lock:
+            self.station_ids[name] = station_id
+            self.station_names[station_id] = name
+
+    def set_train(self, train_id: int, name: str, capacity: int, status: int) -> None:
+        with self._lock:
+            self.train_ids[name] = train_id
+            self.trains[train_id] = (name, capacity, status)
+
+    def update_train(self, name: str, capacity: Optional[int] = None, status: Optional[int] = None) -> None:
+        with self._lock:
+            train_id = self.train_ids.get(name)
+            if train_id is None:
+                return
+            _, old_capacity, old_status = self.trains[train_id]
+            self.trains[train_id] = (name, old_capacity if capacity is None else capacity,
+                                     old_status if status is None else status)
+
+    def refresh_train(self, connection, train_name: str) -> None:
+        """
+        Reload the trips of a single train (after a schedule was added or the train was deleted)
+        """
+        # The trips are read under the lock too, a concurrent refresh cannot apply older ones
+        with self._lock:
+            cursor = connection.cursor()
+            cursor.execute("SELECT train_id, train_name, capacity, status FROM Trains WHERE train_name = %s", (train_name,))
+            train = cursor.fetchone()
+            train_id = train[0] if train else self.train_ids.get(train_name)
+            if train_id is None:
+                cursor.close()
+                return
+            if train:
+                self.set_train(*train)
+            else:
+                self.train_ids.pop(train_name, None)
+                self.trains.pop(train_id, None)
+            cursor.execute("""SELECT trip_id, train_id, starting_station_id, ending_station_id, date, start_time, end_time
+                              FROM Trips WHERE train_id = %s""", (train_id,))
+            trips = cursor.fetchall()
+            cursor.close()
+            self._remove_train(train_id)
+            self._add_trips(trips)
+
+    def _remove_train(self, train_id: int) -> None:
+        for day in self.train_days.pop(train_id, set()):
+            rows = [row for row in self.days[day].rows() if row[1] != train_id]
+            if rows:
+                self.days[day] = DayTimetable(day, rows)
+            else:
+                del self.days[day]
+        self.sorted_days = sorted(self.days)
+
+    def _add_trips(self, trips) -> None:
+        by_day = {}
+        for trip_id, train_id, start, end, day, start_time, end_time in trips:
+            by_day.setdefault(day, []).append((trip_id, train_id, start, end, _to_minutes(start_time), _to_minutes(end_time)))
+        min_travel_times = dict(self.min_travel_times)
+        for day, rows in by_day.items():
+            table = self.days.get(day)
+            self.days[day] = DayTimetable(day, rows if table is None else table.rows() + rows)
+            for row in rows:
+                self.train_days.setdefault(row[1], set()).add(day)
+                pair = (self.station_names[row[2]], self.station_names[row[3]])
+                travel_time = row[5] - row[4]
+                if travel_time < min_travel_times.get(pair, travel_time + 1):
+                    min_travel_times[pair] = travel_time
+        self.min_travel_times = min_travel_times
+        self.sorted_days = sorted(self.days)
+
+    def has_station(self, name: str) -> bool:
+        return name in self.station_ids
+
+    def edges(self) -> List[Tuple[str, str, int]]:
+        return [(a, b, travel_time) for (a, b), travel_time in self.min_travel_times.items()]
+
+    def search_days(self, travel_time: datetime, is_departure_time: bool) -> List[date]:
+        """
+        Days that can hold a route, in travel order
+        """
+        days = self.sorted_days
+        if is_departure_time:
+            return days[bisect_left(days, travel_time.date()):]
+        return days[:bisect_right(days, travel_time.date())][::-1]
+
+    def legs(self, day: date) -> List[Leg]:
+        """
+        Legs of a day, the relation is the Trips row as returned by MariaDB
+        """
+        table = self.days.get(day)
+        if table is None:
+            return []
+        midnight = datetime.combine(day, time.min)
+        legs = []
+        for trip_id, train_id, start, end, departure, arrival in table.rows():
+            row = (trip_id, train_id, start, end, day, timedelta(minutes=departure), timedelta(minutes=arrival))
+            legs.append(Leg(self.station_names[start], self.station_names[end],
+                            midnight + timedelta(minutes=departure), midnight + timedelta(minutes=arrival),
+                            arrival - departure, row))
+        return legs